@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""Array helpers shared by the CIFAR-10 models (gda_models.py, svm_sweep.py, svm_primal.py,
+pca_features.py), which all take batches of images as numpy arrays or CPU torch tensors
+"""
+
+import numpy as np
+
+# (n, d) float32 rows from a batch of images (numpy array or CPU torch tensor)
+def flat_rows(X):
+    X = np.asarray(X)
+    return X.reshape(len(X), -1).astype(np.float32, copy=False)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for loading CIFAR-10 into memory (cifar10_data.py)
+
+Accumulates the 45000 training and 5000 validation images of gda_svm_cifar10.py, each
+variant in a fresh interpreter, and reports wall time and peak RSS:
+
+- vstack: the extract_data the notebook used, growing X with torch.vstack every batch,
+  float32 images, float64 labels, then torch.vstack((Xtrain, Xval)) for trainX
+- cache: CIFAR10Cache, the uint8 memory maps decoded once (built before timing): opening
+  the cache and taking the train, validation and test splits as tensor views, and the same
+  with every image read once
+
+    python benchmark_cifar10_data.py [data root]
+"""
+
+import os
+import subprocess
+import sys
+
+VSTACK = '''
+import resource, time
+import torch, torchvision
+import torchvision.transforms as transforms
+from cifar10_data import tmean, tstd
+transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize(tmean, tstd)])
+trainset = torchvision.datasets.CIFAR10(root=%(root)r, train=True, download=True, transform=transform)
+lengths = [int(p * len(trainset)) for p in [0.9, 0.1]]
+tr, v = torch.utils.data.random_split(trainset, lengths, generator=torch.Generator().manual_seed(0))
+loaders = [torch.utils.data.DataLoader(trainset, batch_size=128,
+                                       sampler=torch.utils.data.SubsetRandomSampler(s.indices))
+           for s in (tr, v)]
+start = time.perf_counter()
+def extract_data(generator):
+    X = torch.zeros((0,3,32,32))
+    y = torch.zeros((0,))
+    for (Xtr,ytr) in generator:
+        X = torch.vstack([X,Xtr])
+        y = torch.concat((y,ytr),axis=0)
+    return X,y
+Xtrain, ytrain = extract_data(loaders[0])
+Xval, yval = extract_data(loaders[1])
+trainX = torch.vstack((Xtrain, Xval))
+trainy = torch.cat([ytrain, yval])
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+'''
+
+CACHE = '''
+import resource, time
+import torch
+from cifar10_data import CIFAR10Cache
+start = time.perf_counter()
+cifar10 = CIFAR10Cache(%(root)r)
+splits = [cifar10.split(name) for name in ('train', 'val', 'test')]
+if %(flag)r:
+    # page every image in
+    total = sum(int(X.sum()) for X, y in splits)
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+'''
+
+# flag makes the cache variant read every image
+def run(code, root, flag=False):
+    out = subprocess.run([sys.executable, '-c', code % {'root': root, 'flag': flag}],
+                         check=True, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed, rss = map(float, out.stdout.split()[-2:])
+    return elapsed, rss
+
+if __name__ == '__main__':
+    root = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else './data')
+    # the data set is downloaded (once) before the timer starts, the cache is built here
+    run(CACHE, root)
+    print('%-24s %10s %14s' % ('', 'time(s)', 'peak RSS(MB)'))
+    for name, code, flag in [('vstack', VSTACK, False),
+                             ('cache, views', CACHE, False),
+                             ('cache, read', CACHE, True)]:
+        print('%-24s %10.2f %14.0f' % ((name,) + run(code, root, flag)))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the NumPy runtime in cnn_numpy_runtime.py against torch
+
+- checks that the NumPy logits match torch's on the same weights
+- cold start: a fresh interpreter that imports the runtime, loads the weights and
+  scores one image, against one that does the same with torch (wall time and peak RSS)
+- per-batch latency of the forward pass for a few batch sizes
+
+Pass an .npz written by export_state_dict (e.g. a trained ConvModel); without one,
+randomly initialized ConvModel weights are used.
+
+    python benchmark_cnn_numpy_runtime.py [model.npz]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from cnn_numpy_runtime import ARCHITECTURES, load_model
+
+# the shapes of the ConvModel weights, for the random model
+def random_conv_model(path, seed=0):
+    rng = np.random.default_rng(seed)
+    params = {}
+    convs = [(0, 3, 32), (2, 32, 64), (6, 64, 128), (8, 128, 128), (12, 128, 256), (14, 256, 256)]
+    for k, c_in, c_out in convs:
+        params['net.%d.weight' % k] = rng.normal(0, np.sqrt(2 / (9 * c_in)), (c_out, c_in, 3, 3))
+        params['net.%d.bias' % k] = rng.normal(0, 0.01, c_out)
+    for k, c in [(5, 64), (11, 128), (17, 256)]:
+        params['net.%d.weight' % k] = rng.uniform(0.5, 1.5, c)
+        params['net.%d.bias' % k] = rng.normal(0, 0.1, c)
+        params['net.%d.running_mean' % k] = rng.normal(0, 0.5, c)
+        params['net.%d.running_var' % k] = rng.uniform(0.5, 2, c)
+        params['net.%d.num_batches_tracked' % k] = np.array(100)
+    for k, n_in, n_out in [(19, 256 * 4 * 4, 1024), (21, 1024, 512), (23, 512, 10)]:
+        params['net.%d.weight' % k] = rng.normal(0, np.sqrt(2 / n_in), (n_out, n_in))
+        params['net.%d.bias' % k] = rng.normal(0, 0.01, n_out)
+    params = {k: v.astype(np.float32) if v.dtype.kind == 'f' else v for k, v in params.items()}
+    params['__architecture__'] = np.array(json.dumps(ARCHITECTURES['ConvModel']))
+    np.savez(path, **params)
+
+# build the same network in torch from the layer list and weights of a NumpyCNN
+def torch_model(net):
+    modules = []
+    for layer in net.layers:
+        kind = layer['type']
+        weight = net.params.get(layer.get('key', '') + '.weight')
+        if kind == 'Conv2d':
+            modules.append(nn.Conv2d(weight.shape[1], weight.shape[0], weight.shape[2:], stride=layer['stride'],
+                                     padding=layer['padding'], dilation=layer['dilation']))
+        elif kind == 'MaxPool2d':
+            modules.append(nn.MaxPool2d(layer['kernel_size'], layer['stride'], layer['padding']))
+        elif kind == 'BatchNorm2d':
+            modules.append(nn.BatchNorm2d(weight.shape[0], eps=layer['eps']))
+        elif kind == 'Linear':
+            modules.append(nn.Linear(weight.shape[1], weight.shape[0]))
+        else:
+            modules.append(getattr(nn, kind)())
+    model = nn.Module()
+    model.net = nn.Sequential(*modules)
+    model.net.load_state_dict({k[len('net.'):]: torch.from_numpy(np.asarray(v)) for k, v in net.params.items()})
+    return model.eval()
+
+COLD_START_NUMPY = '''
+import time, resource
+import numpy as np
+from cnn_numpy_runtime import load_model
+net = load_model(%(path)r)
+net(np.zeros((1, 3, 32, 32), np.float32))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+'''
+
+COLD_START_TORCH = '''
+import time, resource
+import numpy as np
+import torch
+from cnn_numpy_runtime import load_model
+from benchmark_cnn_numpy_runtime import torch_model
+model = torch_model(load_model(%(path)r))
+with torch.no_grad():
+    model.net(torch.zeros((1, 3, 32, 32)))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+'''
+
+# wall time and peak RSS (MB) of running code in a fresh interpreter, best of a few runs
+def cold_start(code, path, repeats=3):
+    best, rss = np.inf, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', code % {'path': path}], check=True, capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        best = min(best, time.perf_counter() - start)
+        rss = float(out.stdout.split()[-1])
+    return best, rss
+
+def best_time(f, repeats=5):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(path):
+    net = load_model(path)
+    model = torch_model(net)
+
+    X = np.random.default_rng(1).normal(size=(256, 3, 32, 32)).astype(np.float32)
+    with torch.no_grad():
+        expected = model.net(torch.from_numpy(X)).numpy()
+    logits = net(X)
+    print('max |numpy - torch| logit difference: %.2e (largest logit %.2f)'
+          % (np.max(np.abs(logits - expected)), np.max(np.abs(expected))))
+    print('predictions agree on %d of %d images' % (np.sum(logits.argmax(1) == expected.argmax(1)), len(X)))
+
+    print('\n%-8s %14s %14s' % ('', 'cold start(s)', 'peak RSS(MB)'))
+    for name, code in [('numpy', COLD_START_NUMPY), ('torch', COLD_START_TORCH)]:
+        print('%-8s %14.2f %14.0f' % ((name,) + cold_start(code, path)))
+
+    print('\n%6s %12s %12s' % ('batch', 'numpy(ms)', 'torch(ms)'))
+    for n in [1, 16, 64, 256]:
+        with torch.no_grad():
+            t_torch = best_time(lambda: model.net(torch.from_numpy(X[:n])))
+        t_numpy = best_time(lambda: net(X[:n]))
+        print('%6d %12.1f %12.1f' % (n, 1e3 * t_numpy, 1e3 * t_torch))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'convmodel.npz')
+            random_conv_model(path)
+            main(path)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for convolution_2d_rgb in convolution2drgb.py
+
+Times the direct, FFT, im2col+GEMM and separable methods for a range of
+filter sizes and strides, checks that they agree, and shows which method
+choose_conv_method picks. The crossover is where the faster column switches
+from one method to another. Pass a number of filters to time a whole filter
+bank; the separable mode uses rank-1 filters.
+
+The out-of-core mode writes a random image_size x image_size memmapped image
+to a temporary directory and times convolution_2d_rgb_out_of_core with 1, 2,
+4, ... worker processes, reporting throughput and the peak RSS of the
+parent and of the largest worker.
+
+    python benchmark_convolution2drgb.py [image_size] [num_filters]
+    python benchmark_convolution2drgb.py separable [image_size]
+    python benchmark_convolution2drgb.py out-of-core [image_size]
+"""
+
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from convolution2drgb import convolution_2d_rgb, convolution_2d_rgb_out_of_core, choose_conv_method, separable_factors
+
+# best of a few runs of f(), in seconds
+def best_time(f, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+METHODS = ('direct', 'fft', 'gemm', 'separable')
+
+# with separable=True every filter is an outer product of two random vectors per channel,
+# the case the separable method is meant for
+def benchmark_methods(image_size=256, num_filters=1, filter_sizes=(3, 5, 7, 9, 11, 15, 21, 31), strides=(1, 2, 4),
+                      separable=False):
+    rng = np.random.default_rng(0)
+    I = rng.random((image_size, image_size, 3))
+    rows = []
+    for s in strides:
+        for f in filter_sizes:
+            if separable:
+                G = rng.random((num_filters, f, 1, 3)) * rng.random((num_filters, 1, f, 3))
+            else:
+                G = rng.random((num_filters, f, f, 3))
+            outputs = {m: convolution_2d_rgb(I, G, s, method=m) for m in METHODS}
+            row = {'stride': s, 'filter': f}
+            for m in METHODS:
+                row[m] = best_time(lambda: convolution_2d_rgb(I, G, s, method=m))
+            row['rank'] = separable_factors(G)[0].shape[1]
+            row['auto'] = choose_conv_method((1,) + I.shape, G.shape, s, rank=row['rank'])
+            row['max_err'] = max(np.max(np.abs(outputs['direct'] - outputs[m])) for m in METHODS)
+            rows.append(row)
+    return rows
+
+def print_table(rows):
+    print('%6s %6s %4s %10s %10s %10s %10s %9s %9s %10s' % ('stride', 'filter', 'rank', 'direct(s)', 'fft(s)',
+                                                            'gemm(s)', 'separ.(s)', 'faster', 'auto', 'max_err'))
+    for r in rows:
+        faster = min(METHODS, key=lambda m: r[m])
+        print('%6d %6d %4d %10.4f %10.4f %10.4f %10.4f %9s %9s %10.2e' % (r['stride'], r['filter'], r['rank'],
+                                                                         r['direct'], r['fft'], r['gemm'],
+                                                                         r['separable'], faster, r['auto'],
+                                                                         r['max_err']))
+
+def benchmark_out_of_core(image_size=8192, filter_size=9, s=1, max_bytes=16 * 2**20):
+    rng = np.random.default_rng(0)
+    G = rng.random((filter_size, filter_size, 3)).astype(np.float32)
+    cores = os.cpu_count() or 1
+    counts = sorted({2**i for i in range(cores.bit_length()) if 2**i <= cores} | {cores})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, 'image.npy')
+        output_path = os.path.join(tmp, 'output.npy')
+        # write the image a few rows at a time so the parent never holds all of it
+        with open(image_path, 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                                                     'fortran_order': False,
+                                                     'shape': (image_size, image_size, 3)})
+            for x0 in range(0, image_size, 256):
+                f.write(rng.random((min(256, image_size - x0), image_size, 3), dtype=np.float32).tobytes())
+
+        print('image %d x %d x 3 float32 (%.0f MB), filter %d x %d, stride %d, tiles of %.0f MB'
+              % (image_size, image_size, image_size**2 * 12 / 2**20, filter_size, filter_size, s, max_bytes / 2**20))
+        print('%9s %10s %12s %8s %14s %14s' % ('processes', 'time(s)', 'Mpixel/s', 'speedup', 'parent RSS(MB)', 'worker RSS(MB)'))
+        base = None
+        for processes in counts:
+            start = time.perf_counter()
+            convolution_2d_rgb_out_of_core(image_path, G, s, output_path, processes=processes, max_bytes=max_bytes)
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            # ru_maxrss is in kilobytes on Linux
+            parent = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            worker = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+            print('%9d %10.2f %12.1f %8.2f %14.0f %14.0f' % (processes, elapsed, image_size**2 / elapsed / 1e6,
+                                                             base / elapsed, parent, worker))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'out-of-core':
+        benchmark_out_of_core(int(sys.argv[2]) if len(sys.argv) > 2 else 8192)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'separable':
+        print_table(benchmark_methods(int(sys.argv[2]) if len(sys.argv) > 2 else 256, separable=True))
+    else:
+        image_size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+        num_filters = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+        print_table(benchmark_methods(image_size, num_filters))
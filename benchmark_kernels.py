@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the kernel logistic regression workflows of kernels_logistic_regression.py
+
+Runs headless (no plots, no widgets) on the XOR data of the notebook, with more points.
+
+- rff: the exact Gaussian kernel with every training point as a landmark against random
+  Fourier features (RBFSampler) as the number of training points N grows; reports the time
+  to build the features, fit and score the 50x50 test grid, the accuracy on held-out XOR
+  points and how far the grid probabilities of the two models are apart
+
+- kernel: the cdist -> square -> divide -> negate -> exp chain the notebook used against
+  gaussian_kernel (kernel_features.py) in float64 and float32, for a growing test set scored
+  against a fixed set of landmarks; reports time and peak traced memory
+
+- widths: a scan over many kernel widths, one sklearn LogisticRegression fit per width
+  against BatchedKernelLogisticRegression (kernel_solvers.py) fitting all widths together
+  from one squared distance matrix; reports time and the largest difference between the
+  validation log-losses of the two
+
+- landmarks: landmark selection on a large XOR set, full-batch KMeans against mini-batch
+  k-means (each N seeded from the centers of the previous one) for growing N, and pivoted
+  Cholesky for decreasing error tolerances (kernel_features.select_landmarks); reports the
+  selection time, the Nystrom approximation error of the kernel and the held-out accuracy
+  of a logistic regression on the landmark features
+
+- sparse: every training point as a landmark with a small kernel width, the dense
+  gaussian_kernel against the CSR sparse_gaussian_kernel truncated at 4s (KD-tree radius
+  query), for growing N; reports build + fit time, peak traced memory, the stored entries
+  and the largest difference between the test grid probabilities of the two
+
+- streaming: StreamingKernelLogisticRegression (kernel_solvers.py) against sklearn's
+  LogisticRegression on the in-memory kernel matrix for a small set, fitted until the
+  gradient is below a tolerance (epochs, largest difference of the grid probabilities,
+  held-out accuracy; fails if a fit does not converge to sklearn's), then on a
+  memory-mapped X of several million rows with per-epoch checkpoints and a streamed
+  prediction of a 1000x1000 grid; reports time and peak traced memory
+
+- boundary: adaptive_grid (boundary_grid.py) against scoring every point of the same
+  1025x1025 grid, for the all-points model at a few kernel widths; reports the points
+  scored, time, the largest probability difference and the share of grid points whose
+  predicted class differs
+
+- suite: the three workflows of the notebook (all points as landmarks, KMeans centers,
+  the 4 strategic landmarks) over N from 200 to 10^6 XOR points, landmark counts and
+  kernel widths; records the build, fit and predict times, peak traced memory and held-out
+  accuracy of every setting to results.json and results.csv, and flags the settings that
+  got slower, bigger or less accurate than a stored baseline (the results.json of an
+  earlier run); exits with status 1 if any did
+
+    python benchmark_kernels.py rff
+    python benchmark_kernels.py kernel
+    python benchmark_kernels.py widths
+    python benchmark_kernels.py landmarks
+    python benchmark_kernels.py sparse
+    python benchmark_kernels.py streaming
+    python benchmark_kernels.py boundary
+    python benchmark_kernels.py suite [results.json] [baseline.json]
+"""
+
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.spatial.distance import cdist
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.cluster import KMeans
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import log_loss
+
+from kernel_features import (gaussian_kernel, minibatch_kmeans_landmarks, neighbor_index, select_landmarks,
+                             sparse_gaussian_kernel, sq_distances)
+from boundary_grid import adaptive_grid
+from kernel_solvers import StreamingKernelLogisticRegression, width_scan
+
+# the XOR data of the notebook: n standard normal points, labelled by the sign of x0*x1
+def make_xor(n, random_state=0):
+    rng = np.random.RandomState(random_state)
+    X = rng.randn(n, 2)
+    y = np.logical_xor(X[:, 0] > 0, X[:, 1] > 0)
+    return X, y
+
+# the 50x50 grid of test points on [-3,3] x [-3,3]
+def make_grid(n=50):
+    xx, yy = np.meshgrid(np.linspace(-3, 3, n), np.linspace(-3, 3, n))
+    return np.vstack((xx.ravel(), yy.ravel())).T
+
+class Timer:
+
+    def __init__(self):
+        self.times = {}
+
+    def __call__(self, name):
+        self.name = name
+        return self
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.times[self.name] = self.times.get(self.name, 0.0) + time.perf_counter() - self.start
+
+# every training point is a landmark, exp(-d^2/2s^2) on the full N x N distance matrix
+def exact_workflow(X, y, X_eval, test_points, s, timer):
+    with timer('build'):
+        Ktrain = gaussian_kernel(X, X, s)
+    with timer('fit'):
+        logreg = LogisticRegression().fit(Ktrain, y)
+    with timer('predict'):
+        Z = logreg.predict_proba(gaussian_kernel(test_points, X, s))[:, 1]
+    y_eval = logreg.predict(gaussian_kernel(X_eval, X, s))
+    return Z, y_eval
+
+# D random Fourier features approximating the same kernel, no distances to the training set
+def rff_workflow(X, y, X_eval, test_points, s, timer, D=300, random_state=0):
+    with timer('build'):
+        rff = RBFSampler(gamma=1 / (2 * s * s), n_components=D, random_state=random_state).fit(X)
+        Ftrain = rff.transform(X)
+    with timer('fit'):
+        logreg = LogisticRegression().fit(Ftrain, y)
+    with timer('predict'):
+        Z = logreg.predict_proba(rff.transform(test_points))[:, 1]
+    y_eval = logreg.predict(rff.transform(X_eval))
+    return Z, y_eval
+
+def benchmark_rff(sizes=(200, 1000, 5000, 10000, 20000, 100000, 1000000), D=300, s=1.5, max_exact=20000):
+    X_eval, y_eval = make_xor(10000, random_state=1)
+    test_points = make_grid()
+    print('%8s %10s %9s %10s %9s %10s' % ('N', 'exact(s)', 'exact acc', 'rff(s)', 'rff acc', 'max |dZ|'))
+    for n in sizes:
+        X, y = make_xor(n)
+        rff_timer = Timer()
+        Z_rff, pred_rff = rff_workflow(X, y, X_eval, test_points, s, rff_timer, D)
+        rff_acc = np.mean(pred_rff == y_eval)
+        if n <= max_exact:
+            exact_timer = Timer()
+            Z_exact, pred_exact = exact_workflow(X, y, X_eval, test_points, s, exact_timer)
+            print('%8d %10.3f %9.4f %10.3f %9.4f %10.4f' % (n, sum(exact_timer.times.values()),
+                                                            np.mean(pred_exact == y_eval),
+                                                            sum(rff_timer.times.values()), rff_acc,
+                                                            np.max(np.abs(Z_exact - Z_rff))))
+        else:
+            print('%8d %10s %9s %10.3f %9.4f %10s' % (n, '-', '-', sum(rff_timer.times.values()), rff_acc, '-'))
+
+# time and peak traced memory (MB) of f()
+def time_and_memory(f):
+    tracemalloc.start()
+    start = time.perf_counter()
+    f()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak
+
+def benchmark_kernel(sizes=(2500, 10000, 100000, 1000000), landmarks=200, s=1.5):
+    rng = np.random.RandomState(0)
+    B = rng.randn(landmarks, 2)
+    print('%8s %5s %16s %16s %16s' % ('rows', 'cols', 'cdist chain', 'fused float64', 'fused float32'))
+    print('%8s %5s %16s %16s %16s' % ('', '', 's / MB', 's / MB', 's / MB'))
+    for n in sizes:
+        A = rng.randn(n, 2)
+        runs = [time_and_memory(lambda: np.exp(-1 * (cdist(A, B, metric='euclidean')) ** 2 / (2 * s * s))),
+                time_and_memory(lambda: gaussian_kernel(A, B, s)),
+                time_and_memory(lambda: gaussian_kernel(A, B, s, dtype=np.float32))]
+        print('%8d %5d' % (n, landmarks) + ''.join(' %7.3f / %6.1f' % r for r in runs))
+
+def benchmark_widths(settings=((200, 200), (2000, 30), (2000, 200), (10000, 50)), num_widths=(20, 50)):
+    X_val, y_val = make_xor(2000, random_state=1)
+    print('%6s %9s %6s %12s %12s %12s' % ('N', 'landmarks', 'widths', 'sklearn(s)', 'batched(s)', 'max |dloss|'))
+    for n, m in settings:
+        X, y = make_xor(n)
+        landmarks = X[np.random.RandomState(0).choice(n, m, replace=False)]
+        for S in num_widths:
+            widths = np.linspace(0.25, 4, S)
+            start = time.perf_counter()
+            sklearn_loss = []
+            for s in widths:
+                logreg = LogisticRegression().fit(gaussian_kernel(X, landmarks, s), y)
+                sklearn_loss.append(log_loss(y_val, logreg.predict_proba(gaussian_kernel(X_val, landmarks, s))[:, 1]))
+            t_sklearn = time.perf_counter() - start
+
+            start = time.perf_counter()
+            batched_loss, _ = width_scan(sq_distances(X, landmarks), y, sq_distances(X_val, landmarks), y_val, widths)
+            t_batched = time.perf_counter() - start
+            print('%6d %9d %6d %12.3f %12.3f %12.2e' % (n, m, S, t_sklearn, t_batched,
+                                                        np.max(np.abs(batched_loss - sklearn_loss))))
+
+def benchmark_landmarks(n=200000, sizes=(10, 20, 40, 80), tols=(1e-1, 3e-2, 1e-2, 3e-3), s=1.0, max_kmeans=500000):
+    X, y = make_xor(n)
+    X_eval, y_eval = make_xor(10000, random_state=1)
+
+    def accuracy(landmarks):
+        logreg = LogisticRegression().fit(gaussian_kernel(X, landmarks, s, dtype=np.float32), y)
+        return np.mean(logreg.predict(gaussian_kernel(X_eval, landmarks, s, dtype=np.float32)) == y_eval)
+
+    print('%-18s %6s %10s %12s %9s' % ('method', 'N', 'select(s)', 'Nystrom err', 'accuracy'))
+    previous = None
+    for N in sizes:
+        runs = [('minibatch-kmeans', dict(N=N, init_centers=previous))]
+        if n <= max_kmeans:
+            runs.insert(0, ('kmeans', dict(N=N)))
+        for method, kwargs in runs:
+            landmarks, info = select_landmarks(X, s, method, **kwargs)
+            print('%-18s %6d %10.3f %12.2e %9.4f' % (method, info['landmarks'], info['time'],
+                                                     info['nystrom_error'], accuracy(landmarks)))
+        previous = landmarks
+    for tol in tols:
+        landmarks, info = select_landmarks(X, s, 'pivoted-cholesky', tol=tol)
+        print('%-18s %6d %10.3f %12.2e %9.4f   tol %g' % ('pivoted-cholesky', info['landmarks'], info['time'],
+                                                          info['nystrom_error'], accuracy(landmarks), tol))
+
+def benchmark_sparse(sizes=(1000, 5000, 10000, 20000, 50000), s=0.05, radius=4.0, max_dense=20000):
+    test_points = make_grid()
+    print('%8s %16s %16s %10s %10s' % ('N', 'dense', 'sparse', 'stored', 'max |dZ|'))
+    print('%8s %16s %16s %10s %10s' % ('', 's / MB', 's / MB', '', ''))
+    for n in sizes:
+        X, y = make_xor(n)
+        result = {}
+
+        def dense():
+            logreg = LogisticRegression().fit(gaussian_kernel(X, X, s), y)
+            result['dense'] = logreg.predict_proba(gaussian_kernel(test_points, X, s))[:, 1]
+
+        def sparse():
+            index = neighbor_index(X)
+            Ktrain = sparse_gaussian_kernel(X, X, s, radius, index=index)
+            logreg = LogisticRegression().fit(Ktrain, y)
+            result['sparse'] = logreg.predict_proba(sparse_gaussian_kernel(test_points, X, s, radius, index=index))[:, 1]
+            result['stored'] = Ktrain.nnz / (n * n)
+
+        sparse_run = time_and_memory(sparse)
+        if n <= max_dense:
+            dense_run = time_and_memory(dense)
+            print('%8d %7.3f / %6.1f %7.3f / %6.1f %9.2f%% %10.2e' % ((n,) + dense_run + sparse_run + (
+                100 * result['stored'], np.max(np.abs(result['dense'] - result['sparse'])))))
+        else:
+            print('%8d %16s %7.3f / %6.1f %9.2f%% %10s' % ((n, '-') + sparse_run + (100 * result['stored'], '-')))
+
+# the streamed fits converged to tol must give the grid probabilities of LogisticRegression
+# (fitted to a tighter tol) within max_difference, or the benchmark fails
+def benchmark_streaming(n_small=5000, n_large=5000000, landmarks=(20, 30), s=1.0, tol=1e-6, max_difference=2e-3):
+    X, y = make_xor(n_small)
+    X_eval, y_eval = make_xor(10000, random_state=1)
+    test_points = make_grid()
+    print('%9s %10s %8s %8s %10s %10s %9s' % ('landmarks', 'optimizer', 'chunk', 'epochs', 'max |dZ|', 'accuracy', 'time(s)'))
+    failed = []
+    for m in landmarks:
+        B = KMeans(n_clusters=m, random_state=0).fit(X).cluster_centers_
+        logreg = LogisticRegression(tol=1e-8, max_iter=10000).fit(gaussian_kernel(X, B, s), y)
+        Z = logreg.predict_proba(gaussian_kernel(test_points, B, s))[:, 1]
+        print('%9d %10s %8s %8s %10s %10.4f' % (m, 'sklearn', '-', '-', '-',
+                                              np.mean(logreg.predict(gaussian_kernel(X_eval, B, s)) == y_eval)))
+        for optimizer, rate in [('adam', 0.05), ('adam', 0.1), ('sgd', 0.5)]:
+            for chunk_rows in (64, 1000):
+                start = time.perf_counter()
+                model = StreamingKernelLogisticRegression(B, s, optimizer=optimizer, learning_rate=rate, tol=tol,
+                                                          epochs=300, chunk_rows=chunk_rows).fit(X, y)
+                difference = np.max(np.abs(model.predict_proba(test_points) - Z))
+                print('%9d %10s %8d %8d %10.2e %10.4f %9.2f' % (m, '%s %g' % (optimizer, rate), chunk_rows, model.epoch_, difference,
+                                                                np.mean(model.predict(X_eval) == y_eval),
+                                                                time.perf_counter() - start))
+                if not model.converged_ or difference > max_difference:
+                    failed.append((m, optimizer, rate, chunk_rows))
+    if failed:
+        raise SystemExit('streamed fits that did not converge to LogisticRegression: %s' % (failed,))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        X, y = make_xor(n_large)
+        np.save(os.path.join(tmp, 'X.npy'), X)
+        np.save(os.path.join(tmp, 'y.npy'), y)
+        del X, y
+        X = np.load(os.path.join(tmp, 'X.npy'), mmap_mode='r')
+        y = np.load(os.path.join(tmp, 'y.npy'), mmap_mode='r')
+        model = StreamingKernelLogisticRegression(B, s, epochs=2, checkpoint=os.path.join(tmp, 'checkpoint.npz'))
+        fit_run = time_and_memory(lambda: model.fit(X, y))
+        grid = make_grid(1000)
+        Z = np.lib.format.open_memmap(os.path.join(tmp, 'Z.npy'), mode='w+', dtype=np.float64, shape=(len(grid),))
+        predict_run = time_and_memory(lambda: model.predict_proba(grid, out=Z))
+        print('\n%d memory-mapped rows (%.0f MB), %d epochs: fit %.1f s / %.1f MB peak, '
+              '1000x1000 grid %.1f s / %.1f MB peak, accuracy %.4f'
+              % (n_large, X.nbytes / 2**20, model.epochs, fit_run[0], fit_run[1], predict_run[0], predict_run[1],
+                 np.mean(model.predict(X_eval) == y_eval)))
+        del X, y, Z
+
+def benchmark_boundary(n=200, widths=(0.3, 0.75, 1.5), resolution=1000):
+    X, y = make_xor(n)
+    print('%6s %14s %10s %10s %10s %11s' % ('s', 'scored', 'adaptive(s)', 'dense(s)', 'max |dZ|', 'class diff'))
+    for s in widths:
+        logreg = LogisticRegression().fit(gaussian_kernel(X, X, s), y)
+        predict = lambda P: logreg.predict_proba(gaussian_kernel(P, X, s))[:, 1]
+        start = time.perf_counter()
+        Z, xx, yy, evaluated = adaptive_grid(predict, resolution=resolution)
+        t_adaptive = time.perf_counter() - start
+        start = time.perf_counter()
+        Z_dense = predict(np.column_stack((xx.ravel(), yy.ravel()))).reshape(Z.shape)
+        t_dense = time.perf_counter() - start
+        print('%6.2f %7d (%4.1f%%) %10.3f %10.3f %10.2e %10.4f%%' % (s, evaluated.sum(), 100 * evaluated.mean(), t_adaptive,
+                                                                 t_dense, np.max(np.abs(Z - Z_dense)),
+                                                                 100 * np.mean((Z > 0.5) != (Z_dense > 0.5))))
+
+# the strategic landmarks of the notebook, one in each quadrant
+STRATEGIC_CENTERS = np.array([[-1, -1], [-1, 1], [1, -1], [1, 1]])
+
+# fields of a suite result, in the column order of the CSV
+SUITE_FIELDS = ['workflow', 'N', 'landmarks', 's', 'build', 'fit', 'predict', 'total', 'peak_mb', 'accuracy']
+
+# settings of the suite: (workflow, N, landmark count, s); every training point is a landmark
+# only up to max_all points (the kernel matrix is N x N)
+def suite_settings(sizes=(200, 1000, 10000, 100000, 1000000), num_landmarks=(20, 100), widths=(0.5, 1.5),
+                   max_all=10000):
+    settings = []
+    for n in sizes:
+        for s in widths:
+            if n <= max_all:
+                settings.append(('all', n, n, s))
+            for m in num_landmarks:
+                if m < n:
+                    settings.append(('kmeans', n, m, s))
+            settings.append(('strategic', n, len(STRATEGIC_CENTERS), s))
+    return settings
+
+# landmarks of a workflow; the KMeans landmarks are in 'build', like the kernel matrix
+# KMeans goes over to mini-batch k-means from max_kmeans points on
+def suite_landmarks(workflow, X, m, max_kmeans=100000):
+    if workflow == 'all':
+        return X
+    if workflow == 'strategic':
+        return STRATEGIC_CENTERS
+    if len(X) > max_kmeans:
+        return minibatch_kmeans_landmarks(X, m)
+    return KMeans(n_clusters=m, random_state=0).fit(X).cluster_centers_
+
+# one setting: build the kernel matrix, fit, score the 50x50 test grid; the accuracy is on
+# held-out XOR points
+def suite_run(workflow, n, m, s, X_eval, y_eval, test_points):
+    X, y = make_xor(n)
+    timer = Timer()
+    tracemalloc.start()
+    with timer('build'):
+        landmarks = suite_landmarks(workflow, X, m)
+        Ktrain = gaussian_kernel(X, landmarks, s)
+    with timer('fit'):
+        logreg = LogisticRegression().fit(Ktrain, y)
+    with timer('predict'):
+        logreg.predict_proba(gaussian_kernel(test_points, landmarks, s))
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    del Ktrain
+    accuracy = np.mean(logreg.predict(gaussian_kernel(X_eval, landmarks, s)) == y_eval)
+    result = dict(workflow=workflow, N=n, landmarks=len(landmarks), s=s, peak_mb=peak, accuracy=accuracy)
+    result.update(timer.times)
+    result['total'] = sum(timer.times.values())
+    return result
+
+# the settings of results that are worse than in baseline: a time more than time_tolerance
+# (relative) and min_seconds slower, peak memory more than memory_tolerance bigger, or an
+# accuracy more than accuracy_tolerance lower; returns (result, [reasons]) pairs
+def suite_regressions(results, baseline, time_tolerance=0.25, min_seconds=0.05, memory_tolerance=0.2,
+                      accuracy_tolerance=0.01):
+    key = lambda r: (r['workflow'], r['N'], r['landmarks'], r['s'])
+    old = {key(r): r for r in baseline}
+    flagged = []
+    for r in results:
+        b = old.get(key(r))
+        if b is None:
+            continue
+        reasons = []
+        for field in ('build', 'fit', 'predict', 'total'):
+            if r[field] > b[field] * (1 + time_tolerance) and r[field] - b[field] > min_seconds:
+                reasons.append('%s %.3fs -> %.3fs' % (field, b[field], r[field]))
+        if r['peak_mb'] > b['peak_mb'] * (1 + memory_tolerance):
+            reasons.append('peak %.1fMB -> %.1fMB' % (b['peak_mb'], r['peak_mb']))
+        if r['accuracy'] < b['accuracy'] - accuracy_tolerance:
+            reasons.append('accuracy %.4f -> %.4f' % (b['accuracy'], r['accuracy']))
+        if reasons:
+            flagged.append((r, reasons))
+    return flagged
+
+def benchmark_suite(output='results.json', baseline=None, settings=None):
+    settings = suite_settings() if settings is None else settings
+    X_eval, y_eval = make_xor(10000, random_state=1)
+    test_points = make_grid()
+    results = []
+    print('%-10s %8s %9s %5s %9s %9s %9s %9s %9s' % ('workflow', 'N', 'landmarks', 's', 'build(s)', 'fit(s)',
+                                                   'predict(s)', 'peak(MB)', 'accuracy'))
+    for workflow, n, m, s in settings:
+        r = suite_run(workflow, n, m, s, X_eval, y_eval, test_points)
+        results.append(r)
+        print('%-10s %8d %9d %5.2f %9.3f %9.3f %9.3f %9.1f %9.4f' % tuple(r[f] for f in SUITE_FIELDS
+                                                                          if f != 'total'))
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    with open(os.path.splitext(output)[0] + '.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, SUITE_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            flagged = suite_regressions(results, json.load(f))
+        for r, reasons in flagged:
+            print('REGRESSION %s N=%d landmarks=%d s=%g: %s' % (r['workflow'], r['N'], r['landmarks'], r['s'],
+                                                               ', '.join(reasons)))
+        if flagged:
+            raise SystemExit(1)
+        print('no regressions against %s' % (baseline,))
+    return results
+
+if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'rff'
+    if mode == 'rff':
+        benchmark_rff()
+    elif mode == 'kernel':
+        benchmark_kernel()
+    elif mode == 'widths':
+        benchmark_widths()
+    elif mode == 'landmarks':
+        benchmark_landmarks()
+    elif mode == 'sparse':
+        benchmark_sparse()
+    elif mode == 'streaming':
+        benchmark_streaming()
+    elif mode == 'boundary':
+        benchmark_boundary()
+    elif mode == 'suite':
+        benchmark_suite(*sys.argv[2:4])
+    else:
+        raise SystemExit("unknown benchmark %r" % (mode,))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the PCA feature stage (pca_features.py) for the LDA and SVM of gda_svm_cifar10.py
+
+Fits StreamingPCA once on the training set (and reports the fit and the cached load time),
+then for k components, and for the raw pixels, reports fit time, predict time (test set) and
+test accuracy of
+- StreamingLDA on all training images, streamed through the projection
+- SVC(kernel='rbf') on the first n_svm training images
+
+    python benchmark_pca_features.py [n_train] [n_svm] [cifar10 root]
+
+Without a CIFAR-10 root it runs on CIFAR-10 shaped synthetic data: 3072 features, a noisy
+random embedding of 50 latent dimensions, and 10 classes from a random nonlinear teacher on
+the latent dimensions.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.svm import SVC
+
+from gda_models import StreamingLDA
+from pca_features import StreamingPCA, cached_pca
+
+KS = [16, 32, 64, 128, 256]
+
+def synthetic(n, n_test=5000, d=3072, random_state=0):
+    rng = np.random.default_rng(random_state)
+    Z = rng.normal(size=(n + n_test, 50))
+    X = (Z @ rng.normal(size=(50, d)) / np.sqrt(50) + rng.normal(size=(len(Z), d))).astype(np.float32)
+    y = np.argmax(np.cos(Z @ rng.normal(size=(50, 100)) / np.sqrt(50)) @ rng.normal(size=(100, 10))
+                  + Z[:, :10] + 0.3 * rng.normal(size=(len(Z), 10)), axis=1)
+    return X[:n], y[:n], X[n:], y[n:]
+
+def cifar10(n, root):
+    from cifar10_data import CIFAR10Cache, normalize
+    cache = CIFAR10Cache(root)
+    Xtrain, ytrain = cache.split('trainval')
+    Xtest, ytest = cache.split('test')
+    flat = lambda X: normalize(X).reshape(len(X), -1).numpy()
+    return flat(Xtrain[:n]), ytrain[:n].numpy(), flat(Xtest), ytest.numpy()
+
+def batches(X, y, batch_size=1000):
+    return ((X[i:i + batch_size], y[i:i + batch_size]) for i in range(0, len(X), batch_size))
+
+def timed(fit, predict, ytest):
+    start = time.perf_counter()
+    model = fit()
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    accuracy = np.mean(predict(model) == ytest)
+    return fit_time, time.perf_counter() - start, accuracy
+
+def main(Xtrain, ytrain, Xtest, ytest, n_svm):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'pca.npz')
+        start = time.perf_counter()
+        pca = cached_pca(path, batches(Xtrain, ytrain), n_components=max(KS))
+        print('PCA fit on %d images: %.1fs' % (len(Xtrain), time.perf_counter() - start))
+        start = time.perf_counter()
+        StreamingPCA.load(path)
+        print('PCA load from the cache: %.3fs' % (time.perf_counter() - start))
+
+    print('%-6s %9s | %-28s | %-28s' % ('', '', 'LDA, %d images' % len(Xtrain), 'SVC rbf, %d images' % n_svm))
+    print('%-6s %9s | %8s %10s %8s | %8s %10s %8s' % ('k', 'variance', 'fit(s)', 'predict(s)', 'accuracy',
+                                                     'fit(s)', 'predict(s)', 'accuracy'))
+    for k in KS + [None]:
+        if k is None:
+            project = lambda X: X
+            variance = 1.0
+        else:
+            project = lambda X: pca.transform(X, k)
+            variance = pca.explained_variance_ratio_[:k].sum()
+        lda = timed(lambda: StreamingLDA().fit((project(X), y) for X, y in batches(Xtrain, ytrain)),
+                    lambda model: model.predict(project(Xtest)), ytest)
+        svm = timed(lambda: SVC(kernel='rbf').fit(project(Xtrain[:n_svm]), ytrain[:n_svm]),
+                    lambda model: model.predict(project(Xtest)), ytest)
+        print('%-6s %9.3f | %8.1f %10.2f %8.4f | %8.1f %10.2f %8.4f'
+              % ((k or 'raw', variance) + lda + svm))
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    n_svm = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    data = cifar10(n, sys.argv[3]) if len(sys.argv) > 3 else synthetic(n)
+    main(*data, n_svm)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of svm_primal.LinearSVMPath: the linear C sweep of gda_svm_cifar10.py in one path
+
+For the C values of the notebook's linear sweep, reports the time of
+- LinearSVMPath fitted cold for every C (a path of one C each)
+- the slowest of these single fits, about what the whole path should cost
+- LinearSVMPath over all of C_vals, warm-started, with 1 and with n_jobs worker processes
+with the Newton steps taken and the validation accuracies. With --liblinear, LinearSVC (same
+loss, liblinear's default solver) is fitted for every C too, which takes tens of minutes from
+a few thousand 3072-dimensional samples on.
+
+It then checks every point of a warm-started path against LinearSVC(C=C) fitted cold in
+the primal to a tight tolerance, on the first 1000 training images and their first 256
+features (liblinear is slow beyond that), and fails if the weights of any C are further
+than 1% apart (relative) or predict more than 0.5% of the validation set differently.
+
+    python benchmark_svm_path.py [n_train] [n_jobs] [cifar10 root] [--liblinear]
+
+Runs on CIFAR-10 shaped synthetic data (3072 features, 10 classes from a noisy linear
+teacher) without a CIFAR-10 root.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.svm import LinearSVC
+
+from svm_primal import LinearSVMPath
+
+C_VALS = [0.0001, 0.001, 0.01, 0.1, 1, 10]
+
+def synthetic(n_train, n_val=5000, d=3072, random_state=0):
+    rng = np.random.default_rng(random_state)
+    X = rng.normal(size=(n_train + n_val, d)).astype(np.float32)
+    y = np.argmax(X @ rng.normal(size=(d, 10)) + 30 * rng.normal(size=(len(X), 10)), axis=1)
+    return X[:n_train], y[:n_train], X[n_train:], y[n_train:]
+
+def cifar10(n_train, root):
+    from cifar10_data import CIFAR10Cache, normalize
+    cache = CIFAR10Cache(root)
+    Xtrain, ytrain = cache.split('train')
+    Xval, yval = cache.split('val')
+    flat = lambda X: normalize(X).reshape(len(X), -1).numpy()
+    return flat(Xtrain[:n_train]), ytrain[:n_train].numpy(), flat(Xval), yval.numpy()
+
+# every C of a warm-started path against a cold LinearSVC(C=C), on the first n training images
+# and their first d features
+def check_liblinear(Xtrain, ytrain, Xval, n=1000, d=256, max_error=1e-2, min_agreement=0.995):
+    X, y, Xval = np.ascontiguousarray(Xtrain[:n, :d]), ytrain[:n], np.ascontiguousarray(Xval[:, :d])
+    path = LinearSVMPath(C_VALS, n_jobs=1).fit(X, y)
+    failed = []
+    for i, C in enumerate(C_VALS):
+        reference = LinearSVC(C=C, dual=False, tol=1e-8, max_iter=10000).fit(X, y)
+        error = np.linalg.norm(path.coef_path_[i] - reference.coef_) / np.linalg.norm(reference.coef_)
+        agreement = np.mean(path.predict(Xval, i) == reference.predict(Xval))
+        print('C=%-8g %4d Newton steps, relative weight error %.1e, %.2f%% of the predictions agree'
+              % (C, path.n_iter_[i].sum(), error, 100 * agreement))
+        if error > max_error or agreement < min_agreement:
+            failed.append(C)
+    if failed:
+        raise SystemExit('path points that do not match LinearSVC: C in %s' % (failed,))
+
+def main(Xtrain, ytrain, Xval, yval, n_jobs, liblinear=False):
+    print('%-34s %9s %13s  %s' % ('', 'time(s)', 'Newton steps', 'validation accuracies'))
+    if liblinear:
+        start = time.perf_counter()
+        expected = [LinearSVC(C=C).fit(Xtrain, ytrain).score(Xval, yval) for C in C_VALS]
+        print('%-34s %9.1f %13s  %s' % ('LinearSVC per C', time.perf_counter() - start, '',
+                                       np.round(expected, 4)))
+
+    cold, times = [], []
+    for C in C_VALS:
+        start = time.perf_counter()
+        cold.append(LinearSVMPath([C], n_jobs=1).fit(Xtrain, ytrain))
+        times.append(time.perf_counter() - start)
+    print('%-34s %9.1f %13d  %s' % ('LinearSVMPath cold per C', sum(times),
+                                   sum(path.n_iter_.sum() for path in cold),
+                                   np.round([path.score_path(Xval, yval)[0] for path in cold], 4)))
+    slowest = np.argmax(times)
+    print('%-34s %9.1f %13d' % ('slowest single fit, C=%g' % C_VALS[slowest], times[slowest],
+                               cold[slowest].n_iter_.sum()))
+
+    for jobs in sorted({1, n_jobs}):
+        start = time.perf_counter()
+        path = LinearSVMPath(C_VALS, n_jobs=jobs).fit(Xtrain, ytrain)
+        print('%-34s %9.1f %13d  %s' % ('LinearSVMPath warm, %d job(s)' % jobs, time.perf_counter() - start,
+                                       path.n_iter_.sum(), np.round(path.score_path(Xval, yval), 4)))
+    check_liblinear(Xtrain, ytrain, Xval)
+
+if __name__ == '__main__':
+    liblinear = '--liblinear' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--liblinear']
+    n_train = int(args[0]) if len(args) > 0 else 45000
+    n_jobs = int(args[1]) if len(args) > 1 else os.cpu_count()
+    data = cifar10(n_train, args[2]) if len(args) > 2 else synthetic(n_train)
+    main(*data, n_jobs, liblinear)
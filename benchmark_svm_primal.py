@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of svm_primal.py: approximate RBF SVMs on all training images against exact SVC
+
+Fits SVC(kernel='rbf') on the first n_exact training images, as gda_svm_cifar10.py does, and
+ApproximateRBFSVM with random Fourier and with Nystroem features on all n training images,
+and reports test accuracy, fit time and predict time (test set) of each. It then checks, on
+the first 5000 training images, that each approximate SVM predicts the test set as
+LinearSVC(loss='hinge') fitted on the same features does, and fails otherwise:
+
+    python benchmark_svm_primal.py [n] [n_exact] [n_components] [cifar10 root]
+
+Without a CIFAR-10 root it runs on CIFAR-10 shaped synthetic data: 3072 features, a noisy
+random embedding of 10 latent dimensions (images are far from filling their space either),
+and 10 classes from a random nonlinear (cosine feature) teacher on the latent dimensions.
+"""
+
+import sys
+import time
+
+import numpy as np
+from sklearn.svm import SVC, LinearSVC
+
+from svm_primal import ApproximateRBFSVM
+
+C_EXACT = 10
+C_APPROXIMATE = 1
+
+def synthetic(n, n_test=5000, d=3072, random_state=0):
+    rng = np.random.default_rng(random_state)
+    Z = rng.normal(size=(n + n_test, 10))
+    X = (Z @ rng.normal(size=(10, d)) / np.sqrt(10) + 0.5 * rng.normal(size=(len(Z), d))).astype(np.float32)
+    y = np.argmax(np.cos(1.5 * Z @ rng.normal(size=(10, 50)) / np.sqrt(10)) @ rng.normal(size=(50, 10))
+                  + 0.3 * rng.normal(size=(len(Z), 10)), axis=1)
+    return X[:n], y[:n], X[n:], y[n:]
+
+def cifar10(n, root):
+    from cifar10_data import CIFAR10Cache, normalize
+    cache = CIFAR10Cache(root)
+    Xtrain, ytrain = cache.split('trainval')
+    Xtest, ytest = cache.split('test')
+    flat = lambda X: normalize(X).reshape(len(X), -1).numpy()
+    return flat(Xtrain[:n]), ytrain[:n].numpy(), flat(Xtest), ytest.numpy()
+
+def timed(model, Xtrain, ytrain, Xtest, ytest):
+    start = time.perf_counter()
+    model.fit(Xtrain, ytrain)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    accuracy = np.mean(model.predict(Xtest) == ytest)
+    return accuracy, fit_time, time.perf_counter() - start
+
+# the share of test images each approximate SVM, fitted on the first n training images, predicts
+# as LinearSVC(loss='hinge') on its feature map does; fails below min_agreement
+def check_liblinear(Xtrain, ytrain, Xtest, n_components, n=5000, min_agreement=0.999):
+    for features in ('rff', 'nystroem'):
+        model = ApproximateRBFSVM(features, n_components, C=C_APPROXIMATE).fit(Xtrain[:n], ytrain[:n])
+        reference = LinearSVC(C=C_APPROXIMATE, loss='hinge').fit(model.feature_map_.transform(Xtrain[:n]), ytrain[:n])
+        agreement = np.mean(model.predict(Xtest) == reference.predict(model.feature_map_.transform(Xtest)))
+        print('%s agrees with LinearSVC on %.2f%% of the test predictions' % (features, 100 * agreement))
+        if agreement < min_agreement:
+            raise SystemExit('%s disagrees with LinearSVC' % features)
+
+def main(Xtrain, ytrain, Xtest, ytest, n_exact, n_components):
+    print('%-32s %8s %9s %10s %11s' % ('model', 'n', 'accuracy', 'fit(s)', 'predict(s)'))
+    rows = [('SVC rbf, C=%g' % C_EXACT, n_exact, SVC(kernel='rbf', C=C_EXACT))]
+    for features in ('rff', 'nystroem'):
+        rows.append(('%s %d, C=%g' % (features, n_components, C_APPROXIMATE), len(Xtrain),
+                     ApproximateRBFSVM(features, n_components, C=C_APPROXIMATE)))
+    for name, n, model in rows:
+        print('%-32s %8d %9.4f %10.1f %11.2f' % ((name, n) + timed(model, Xtrain[:n], ytrain[:n], Xtest, ytest)))
+    check_liblinear(Xtrain, ytrain, Xtest, n_components)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    n_exact = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    n_components = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    data = cifar10(n, sys.argv[4]) if len(sys.argv) > 4 else synthetic(n)
+    main(*data, n_exact, n_components)
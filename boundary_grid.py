@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Adaptive evaluation of decision boundaries for plot_boundary in kernels_logistic_regression.py
+
+adaptive_grid scores a model on a coarse grid first and then only refines the cells whose
+corner probabilities straddle the 0.5 level or differ by more than max_change, halving the
+cell size until the grid spacing reaches the target resolution. Cells that are not refined
+are filled in by bilinear interpolation of their corners. The result is a full resolution
+grid for plot_boundary (1025x1025 by default) from a small fraction of the kernel
+evaluations a dense grid needs:
+
+    predict = lambda P: logreg.predict_proba(gaussian_kernel(P, X, s))[:,1]
+    Z, xx, yy, evaluated = adaptive_grid(predict)
+    plot_boundary(Z, X, y, xx, yy)
+
+A boundary that enters and leaves a coarse cell between two of its corners is not seen, so
+the coarse grid has to be fine enough for the smallest feature of the boundary.
+"""
+
+import numpy as np
+
+# evaluate predict (k x 2 points -> k probabilities) on the grid over extent = (xmin, xmax,
+# ymin, ymax) with at least `resolution` points per axis, starting from coarse x coarse cells
+# returns Z, xx, yy (as from np.meshgrid, Z[i, j] at (xx[i, j], yy[i, j])) and the boolean
+# mask of the grid points predict was called on
+def adaptive_grid(predict, extent=(-3, 3, -3, 3), resolution=1000, coarse=32, threshold=0.5, max_change=0.1):
+    levels = max(0, int(np.ceil(np.log2((resolution - 1) / coarse))))
+    n = coarse * 2**levels + 1
+    xs = np.linspace(extent[0], extent[1], n)
+    ys = np.linspace(extent[2], extent[3], n)
+    Z = np.empty((n, n))
+    evaluated = np.zeros((n, n), dtype=bool)
+
+    def evaluate(rows, cols):
+        # the points of (rows, cols) not scored yet
+        new = ~evaluated[rows, cols]
+        rows, cols = rows[new], cols[new]
+        # the same point can come from two neighbouring cells
+        rows, cols = np.unique(np.stack((rows, cols)), axis=1)
+        if len(rows):
+            Z[rows, cols] = predict(np.column_stack((xs[cols], ys[rows])))
+            evaluated[rows, cols] = True
+
+    # lower left corners of the cells of the current level
+    step = 2**levels
+    corner = np.arange(0, n - 1, step)
+    cells = np.stack(np.meshgrid(corner, corner, indexing='ij')).reshape(2, -1)
+    evaluate(*np.stack(np.meshgrid(np.arange(0, n, step), np.arange(0, n, step), indexing='ij')).reshape(2, -1))
+
+    # cells of one grid spacing are final, nothing inside them to fill
+    while step > 1 and len(cells[0]):
+        r, c = cells
+        corners = np.stack((Z[r, c], Z[r + step, c], Z[r, c + step], Z[r + step, c + step]))
+        low, high = corners.min(axis=0), corners.max(axis=0)
+        refine = ((low < threshold) & (high >= threshold)) | (high - low > max_change)
+
+        # fill the cells that stay as they are from their corners
+        _interpolate(Z, evaluated, r[~refine], c[~refine], step)
+
+        # split the others in four: score the edge midpoints and the centers
+        r, c, h = r[refine], c[refine], step // 2
+        evaluate(np.concatenate((r + h, r + h, r + h, r, r + step)),
+                 np.concatenate((c, c + h, c + step, c + h, c + h)))
+        step = h
+        cells = np.stack((np.concatenate((r, r + h, r, r + h)), np.concatenate((c, c, c + h, c + h))))
+
+    xx, yy = np.meshgrid(xs, ys)
+    return Z, xx, yy, evaluated
+
+# fill the grid points of the step x step cells with lower left corners (r, c) that were not
+# scored by bilinear interpolation of the cell corners
+def _interpolate(Z, evaluated, r, c, step):
+    if not len(r):
+        return
+    t = np.arange(step + 1) / step
+    # (cells, step + 1, step + 1) grid indices and weights
+    rows, cols = np.broadcast_arrays(r[:, None, None] + np.arange(step + 1)[None, :, None],
+                                     c[:, None, None] + np.arange(step + 1)[None, None, :])
+    u, v = t[None, :, None], t[None, None, :]
+    z00, z10 = Z[r, c][:, None, None], Z[r + step, c][:, None, None]
+    z01, z11 = Z[r, c + step][:, None, None], Z[r + step, c + step][:, None, None]
+    values = (1 - u) * (1 - v) * z00 + u * (1 - v) * z10 + (1 - u) * v * z01 + u * v * z11
+    keep = ~evaluated[rows, cols]
+    Z[rows[keep], cols[keep]] = values[keep]
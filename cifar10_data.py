@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""CIFAR-10 for gda_svm_cifar10.py, deepnnforcifar10.py and softmax_cifar10_pytorch.py
+
+normalize turns uint8 images into the same normalized float32 tensors the usual ToTensor +
+Normalize transform gives, when they are used.
+
+CIFAR10Cache decodes the data set once into uint8 .npy files under root (images as
+(n, 3, 32, 32), the layout ToTensor gives, and int64 labels) and fixes the 90/10
+train/validation split with a seed: the training images are stored in split order, train
+first, so every split is a contiguous slice of a memory map. split() gives zero-copy uint8
+tensor views of a split, loader() a DataLoader-like batch iterator that normalizes each batch
+as it is read. Opening the cache reads nothing but the file headers:
+
+    cifar10 = CIFAR10Cache('./data')
+    trainloader = cifar10.loader('train', batch_size=64, shuffle=True)
+    Xval, yval = cifar10.split('val')      # uint8, normalize(Xval) for the model
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+import torchvision
+
+# mean and std for the RGB channels in CIFAR10
+tmean = [0.49139968, 0.48215841, 0.44653091]
+tstd = [0.24703223, 0.24348513, 0.26158784]
+
+# normalized float32 images from uint8 ones (float images are returned as they are)
+def normalize(X):
+    if X.dtype != torch.uint8:
+        return X
+    mean = torch.tensor(tmean).view(1, 3, 1, 1)
+    std = torch.tensor(tstd).view(1, 3, 1, 1)
+    # one float32 copy, scaled and shifted in place
+    return X.to(torch.float32).div_(255).sub_(mean).div_(std)
+
+# seed of the 90/10 train/validation split stored in the cache
+SPLIT_SEED = 0
+
+# write the cache files into path: the training images and labels permuted so that the
+# train split comes first, the test set as it is, and the split (original indices) with its seed
+def _write_cache(path, train_images, train_labels, test_images, test_labels, seed, val_fraction):
+    n = len(train_images)
+    n_val = int(round(val_fraction * n))
+    order = np.random.default_rng(seed).permutation(n)
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, images, labels, rows in [('train', train_images, train_labels, order),
+                                       ('test', test_images, test_labels, np.arange(len(test_images)))]:
+        # HWC (as torchvision keeps them) to CHW (as ToTensor gives them)
+        out = np.lib.format.open_memmap(os.path.join(tmp, name + '_images.npy'), mode='w+', dtype=np.uint8,
+                                        shape=(len(rows), 3) + images.shape[1:3])
+        out[:] = images[rows].transpose(0, 3, 1, 2)
+        out.flush()
+        del out
+        np.save(os.path.join(tmp, name + '_labels.npy'), np.asarray(labels, dtype=np.int64)[rows])
+    np.savez(os.path.join(tmp, 'split.npz'), train=order[:n - n_val], val=order[n - n_val:])
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'seed': seed, 'train': n - n_val, 'val': n_val, 'test': len(test_images)}, f)
+    # a half-written cache never looks complete
+    os.replace(tmp, path)
+
+class CIFAR10Cache:
+
+    # the cache lives in root/cifar10_uint8_seed<seed>; it is built from torchvision's
+    # download (into root) the first time
+    def __init__(self, root='./data', seed=SPLIT_SEED, val_fraction=0.1):
+        self.path = os.path.join(root, 'cifar10_uint8_seed%d' % seed)
+        if not os.path.exists(self.path):
+            train = torchvision.datasets.CIFAR10(root=root, train=True, download=True)
+            test = torchvision.datasets.CIFAR10(root=root, train=False, download=True)
+            _write_cache(self.path, train.data, train.targets, test.data, test.targets, seed, val_fraction)
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        # copy-on-write maps: writable for torch.from_numpy, the files are never changed
+        self.arrays = {name: np.load(os.path.join(self.path, name + '.npy'), mmap_mode='c')
+                       for name in ('train_images', 'train_labels', 'test_images', 'test_labels')}
+        n_train, n_val = self.meta['train'], self.meta['val']
+        self.rows = {'train': ('train', slice(0, n_train)),
+                     'val': ('train', slice(n_train, n_train + n_val)),
+                     'trainval': ('train', slice(0, n_train + n_val)),
+                     'test': ('test', slice(0, self.meta['test']))}
+
+    # the original indices of the train and validation images in torchvision's training set
+    def split_indices(self):
+        with np.load(os.path.join(self.path, 'split.npz')) as f:
+            return f['train'], f['val']
+
+    # (n, 3, 32, 32) uint8 images and (n,) int64 labels of a split ('train', 'val', 'test' or
+    # 'trainval', the train split followed by the validation split) as tensor views of the
+    # memory maps; nothing is read until the tensors are used
+    def split(self, name):
+        part, rows = self.rows[name]
+        return (torch.from_numpy(self.arrays[part + '_images'][rows]),
+                torch.from_numpy(self.arrays[part + '_labels'][rows]))
+
+    def loader(self, name, batch_size, shuffle=False, normalized=True):
+        X, y = self.split(name)
+        return BatchLoader(X, y, batch_size, shuffle, normalized)
+
+# batches (X, y) of images and labels, like a DataLoader over a TensorDataset: a fresh order
+# every epoch with shuffle, and with normalized the uint8 images of each batch are turned into
+# normalized float32 as the batch is read
+class BatchLoader:
+
+    def __init__(self, X, y, batch_size, shuffle=False, normalized=True):
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.normalized = normalized
+        # the rows of one epoch, so len(loader.sampler) works like for a DataLoader
+        self.sampler = range(len(X))
+
+    def __len__(self):
+        return (len(self.X) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        n = len(self.X)
+        for i in range(0, n, self.batch_size):
+            if self.shuffle:
+                if i == 0:
+                    order = torch.randperm(n)
+                # sorted rows read the memory map in file order
+                rows = order[i:i + self.batch_size].sort().values
+                X, y = self.X[rows], self.y[rows]
+            else:
+                X, y = self.X[i:i + self.batch_size], self.y[i:i + self.batch_size]
+            yield (normalize(X) if self.normalized else X), y
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""NumPy inference runtime for the CIFAR-10 models of deepnnforcifar10.py
+
+Runs the forward pass of a trained ConvModel or FiveLayerFC without importing
+torch, so CPU workers start fast and stay small. The convolutions use the
+im2col + GEMM conv2d of convolution2drgb.py.
+
+Export a trained model once (on the torch side):
+
+    from cnn_numpy_runtime import export_state_dict
+    export_state_dict(model, 'convmodel.npz')
+
+and serve it with NumPy only:
+
+    from cnn_numpy_runtime import load_model
+    net = load_model('convmodel.npz')
+    logits = net(X)          # X is a (N, 3, 32, 32) float32 batch, as from the DataLoader
+    labels = net.predict(X)
+"""
+
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from convolution2drgb import conv2d
+
+# the layer stacks of ConvModel and FiveLayerFC in deepnnforcifar10.py, used for .npz files
+# that hold a bare state_dict without the architecture written by export_state_dict
+def _conv_block(first):
+    conv = {'type': 'Conv2d', 'stride': [1, 1], 'padding': [1, 1], 'dilation': [1, 1]}
+    return [dict(conv, key='net.%d' % first),
+            {'type': 'ReLU'},
+            dict(conv, key='net.%d' % (first + 2)),
+            {'type': 'ReLU'},
+            {'type': 'MaxPool2d', 'kernel_size': [2, 2], 'stride': [2, 2], 'padding': [0, 0]},
+            {'type': 'BatchNorm2d', 'key': 'net.%d' % (first + 5), 'eps': 1e-5}]
+
+ARCHITECTURES = {
+    'ConvModel': (_conv_block(0) + _conv_block(6) + _conv_block(12)
+                  + [{'type': 'Flatten'},
+                     {'type': 'Linear', 'key': 'net.19'}, {'type': 'ReLU'},
+                     {'type': 'Linear', 'key': 'net.21'}, {'type': 'ReLU'},
+                     {'type': 'Linear', 'key': 'net.23'}]),
+    'FiveLayerFC': [{'type': 'Flatten'},
+                    {'type': 'Linear', 'key': 'net.1'}, {'type': 'ReLU'},
+                    {'type': 'Linear', 'key': 'net.3'}, {'type': 'ReLU'},
+                    {'type': 'Linear', 'key': 'net.5'}],
+}
+
+def _pair(v):
+    return list(v) if isinstance(v, (tuple, list)) else [v, v]
+
+# describe the layers of model.net (an nn.Sequential) as plain dicts
+def _describe(net, prefix='net'):
+    layers = []
+    for name, m in net.named_children():
+        layer = {'type': type(m).__name__, 'key': '%s.%s' % (prefix, name)}
+        if layer['type'] == 'Conv2d':
+            if m.groups != 1 or isinstance(m.padding, str):
+                raise ValueError("unsupported Conv2d %s" % (m,))
+            layer.update(stride=_pair(m.stride), padding=_pair(m.padding), dilation=_pair(m.dilation))
+        elif layer['type'] == 'MaxPool2d':
+            if m.ceil_mode or m.dilation not in (1, (1, 1)):
+                raise ValueError("unsupported MaxPool2d %s" % (m,))
+            layer.update(kernel_size=_pair(m.kernel_size), stride=_pair(m.stride or m.kernel_size),
+                         padding=_pair(m.padding))
+        elif layer['type'] == 'BatchNorm2d':
+            layer.update(eps=m.eps)
+        elif layer['type'] not in ('ReLU', 'Flatten', 'Linear'):
+            raise ValueError("no NumPy implementation of %s" % (layer['type'],))
+        layers.append(layer)
+    return layers
+
+# save the weights of a ConvModel/FiveLayerFC (anything with an nn.Sequential called net)
+# together with its layer stack, so load_model can rebuild it without torch
+def export_state_dict(model, path):
+    arrays = {k: v.detach().cpu().numpy() for k, v in model.state_dict().items()}
+    arrays['__architecture__'] = np.array(json.dumps(_describe(model.net)))
+    np.savez(path, **arrays)
+
+# the layers, working on channels-last (N, H, W, C) float arrays
+
+def _conv2d(x, layer, params):
+    (sh, sw), (dh, dw) = layer['stride'], layer['dilation']
+    if sh != sw or dh != dw:
+        raise ValueError("Conv2d with different strides or dilations per axis is not supported: %s" % (layer,))
+    # torch weights are (out, in, kh, kw), conv2d wants (out, kh, kw, in)
+    weight = params[layer['key'] + '.weight'].transpose(0, 2, 3, 1)
+    bias = params.get(layer['key'] + '.bias')
+    return conv2d(x, weight, bias, stride=sh, padding=tuple(layer['padding']), dilation=dh)
+
+def _relu(x, layer, params):
+    return np.maximum(x, 0, out=x)
+
+def _maxpool2d(x, layer, params):
+    (kh, kw), (sh, sw), (ph, pw) = layer['kernel_size'], layer['stride'], layer['padding']
+    if ph or pw:
+        x = np.pad(x, ((0, 0), (ph, ph), (pw, pw), (0, 0)), constant_values=-np.inf)
+    N, H, W, C = x.shape
+    if (kh, kw) == (sh, sw) and H % kh == 0 and W % kw == 0:
+        # non-overlapping windows: a reshape is enough
+        return x.reshape(N, H // kh, kh, W // kw, kw, C).max(axis=(2, 4))
+    return sliding_window_view(x, (kh, kw), axis=(1, 2))[:, ::sh, ::sw].max(axis=(-2, -1))
+
+def _batchnorm2d(x, layer, params):
+    # eval mode: normalize with the running statistics, folded into one scale and shift
+    key = layer['key']
+    scale = params[key + '.weight'] / np.sqrt(params[key + '.running_var'] + layer['eps'])
+    shift = params[key + '.bias'] - params[key + '.running_mean'] * scale
+    x *= scale.astype(x.dtype)
+    x += shift.astype(x.dtype)
+    return x
+
+def _flatten(x, layer, params):
+    # torch flattens (N, C, H, W)
+    if x.ndim == 4:
+        x = x.transpose(0, 3, 1, 2)
+    return x.reshape(x.shape[0], -1)
+
+def _linear(x, layer, params):
+    x = x @ params[layer['key'] + '.weight'].T
+    bias = params.get(layer['key'] + '.bias')
+    if bias is not None:
+        x += bias
+    return x
+
+LAYERS = {
+    'Conv2d': _conv2d,
+    'ReLU': _relu,
+    'MaxPool2d': _maxpool2d,
+    'BatchNorm2d': _batchnorm2d,
+    'Flatten': _flatten,
+    'Linear': _linear,
+}
+
+class NumpyCNN:
+
+    def __init__(self, layers, params, dtype=np.float32):
+        self.layers = layers
+        self.dtype = dtype
+        self.params = {k: v.astype(dtype) if v.dtype.kind == 'f' else v for k, v in params.items()}
+
+    def __call__(self, X):
+        return self.forward(X)
+
+    def forward(self, X):
+        # X is a (N, C, H, W) batch like the torch models take (a torch tensor's .numpy() works),
+        # returns the (N, num_classes) logits
+        # the layers work in place, so always start from a copy
+        x = np.asarray(X, dtype=self.dtype)
+        x = np.ascontiguousarray(x.transpose(0, 2, 3, 1)) if x.ndim == 4 else x.copy()
+        for layer in self.layers:
+            x = LAYERS[layer['type']](x, layer, self.params)
+        return x
+
+    def predict(self, X):
+        # return the index of the highest output in the output layer
+        return self.forward(X).argmax(axis=1)
+
+# rebuild a model saved with export_state_dict; for a bare state_dict saved with
+# np.savez(path, **state_dict) pass arch='ConvModel' or arch='FiveLayerFC'
+def load_model(path, arch=None, dtype=np.float32):
+    with np.load(path) as f:
+        params = {k: f[k] for k in f.files}
+    if '__architecture__' in params:
+        layers = json.loads(str(params.pop('__architecture__')))
+    elif arch in ARCHITECTURES:
+        layers = ARCHITECTURES[arch]
+    else:
+        raise ValueError("%s holds no architecture, pass arch as one of %s" % (path, sorted(ARCHITECTURES)))
+    return NumpyCNN(layers, params, dtype)
@@ -7,47 +7,438 @@ Original file is located at
     https://colab.research.google.com/drive/1qXOHANTJtSsoPu8cMXNySOm8N_ZRjm2E
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# bring images and filters to batched form
+# I is (W, H, 3) or (N, W, H, 3), G is (w, h, 3) or (K, w, h, 3)
+# returns the batched arrays and flags telling which batch axes to drop again
+def _as_batch(I, G):
+    I = np.asarray(I)
+    G = np.asarray(G)
+    single_image = I.ndim == 3
+    single_filter = G.ndim == 3
+    if single_image:
+        I = I[np.newaxis]
+    if single_filter:
+        G = G[np.newaxis]
+    if I.ndim != 4 or G.ndim != 4 or I.shape[-1] != G.shape[-1]:
+        raise ValueError("expected I of shape (N, W, H, C) and G of shape (K, w, h, C), "
+                         "got %s and %s" % (I.shape, G.shape))
+    return I, G, single_image, single_filter
+
+# the dtype every method computes and returns in: that of float (or complex) images and
+# filters, so float32 scans stay float32, and float64 (the output the loop version
+# accumulated into) for integer and bool ones, so uint8 images cannot wrap around
+def _output_dtype(I, G):
+    dtype = np.result_type(I, G)
+    return dtype if dtype.kind in 'fc' else np.dtype(np.float64)
+
+# zero pad the two spatial axes of a batch of images (N, W, H, C)
+# padding is an int or a (pad_W, pad_H) pair, applied on both sides
+def _pad(I, padding):
+    pad_W, pad_H = (padding, padding) if np.isscalar(padding) else padding
+    if pad_W == 0 and pad_H == 0:
+        return I
+    return np.pad(I, ((0, 0), (pad_W, pad_W), (pad_H, pad_H), (0, 0)))
+
+# spread the taps of a filter bank (K, w, h, C) d pixels apart by inserting zeros
+def _dilate(G, d):
+    if d == 1:
+        return G
+    K, w, h, C = G.shape
+    dilated = np.zeros((K, d * (w - 1) + 1, d * (h - 1) + 1, C), dtype=G.dtype)
+    dilated[:, ::d, ::d] = G
+    return dilated
+
+# undo _as_batch on an output of shape (N, K, output_W, output_H, 3)
+def _unbatch(output, single_image, single_filter):
+    if single_filter:
+        output = output[:, 0]
+    if single_image:
+        output = output[0]
+    return output
+
+# smallest length >= n whose only prime factors are 2, 3 and 5, which the FFT handles fastest
+def _next_fast_len(n):
+    best = 2 * n
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p235 = p35
+            while p235 < n:
+                p235 *= 2
+            best = min(best, p235)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+# direct method: dot every w x h window with every filter
+# I is (N, W, H, C), G is (K, w, h, C), output is (N, K, output_W, output_H, C)
+def _convolution_direct(I, G, s):
+    w, h = G.shape[1:3]
+
+    # view every w x h window of every image without copying it, then keep every s-th one
+    # windows has shape (N, output_W, output_H, C, w, h)
+    windows = sliding_window_view(I, (w, h), axis=(1, 2))[:, ::s, ::s]
+
+    # multiply each window with each filter and sum over the window, channel by channel
+    return np.einsum('nxycij,kijc->nkxyc', windows, G)
+
+# FFT method: same result as _convolution_direct, computed with real FFTs per channel
+def _convolution_fft(I, G, s):
+    W, H = I.shape[1:3]
+    w, h = G.shape[1:3]
+
+    # a circular convolution of length >= W only wraps around into the first w-1 outputs,
+    # which are not part of the valid region, so no extra zero padding is needed
+    shape = (_next_fast_len(W), _next_fast_len(H))
+
+    # the sliding window is a correlation, i.e. a convolution with the flipped filter
+    I_hat = np.fft.rfft2(I, s=shape, axes=(1, 2))
+    G_hat = np.fft.rfft2(G[:, ::-1, ::-1], s=shape, axes=(1, 2))
 
-def convolution_2d_rgb(I, G, s):
-    # I is the input RGB image with shape (W, H, 3)
-    # G is the filter with shape (w, h, 3)
+    # (N, 1, ...) * (1, K, ...) -> (N, K, shape[0], shape[1] // 2 + 1, C)
+    full = np.fft.irfft2(I_hat[:, np.newaxis] * G_hat[np.newaxis], s=shape, axes=(2, 3))
+
+    # keep the valid region and apply the stride afterwards
+    return full[:, :, w - 1:W:s, h - 1:H:s]
+
+# split every channel of a filter bank (K, w, h, C) into a sum of rank-1 (separable) filters
+# G[k, :, :, c] = sum_r cols[k, r, :, c] outer rows[k, r, :, c], found with a per-channel SVD
+# singular values below tol times the largest one of that channel are dropped; with the default
+# tol only numerically zero ones are, so the split is exact, a larger tol gives a low-rank
+# approximation of the filters
+# returns cols (K, R, w, C) and rows (K, R, h, C), R being the largest rank over all channels
+def separable_factors(G, tol=None):
+    K, w, h, C = G.shape
+    U, S, Vt = np.linalg.svd(G.transpose(0, 3, 1, 2))
+    if tol is None:
+        tol = max(w, h) * np.finfo(S.dtype).eps
+    keep = S > tol * S[..., :1]
+    R = max(1, int(keep.sum(axis=-1).max()))
+
+    # fold the singular values into the column factors and zero the dropped terms
+    S = np.where(keep, S, 0)[..., :R]
+    cols = U[..., :, :R] * S[..., np.newaxis, :]     # (K, C, w, R)
+    rows = Vt[..., :R, :]                            # (K, C, R, h)
+    return cols.transpose(0, 3, 2, 1), rows.transpose(0, 2, 3, 1)
+
+# separable method: filter the columns with the w-tap factors and then the rows with the h-tap
+# factors, one pass per rank-1 term, so each output costs about w + h multiply-adds per term
+# instead of w*h
+def _convolution_separable(I, cols, rows, s, d=1):
+    N, W, H, C = I.shape
+    K, R, w, _ = cols.shape
+    h = rows.shape[2]
+    output_W = 1 + (W - d * (w - 1) - 1) // s
+    output_H = 1 + (H - d * (h - 1) - 1) // s
+    dtype = np.result_type(I, cols)
+
+    # pass 1, along W at the output stride: (N, K, R, output_W, H, C)
+    tmp = np.zeros((N, K, R, output_W, H, C), dtype=dtype)
+    for i in range(w):
+        tmp += I[:, np.newaxis, np.newaxis, i * d:i * d + (output_W - 1) * s + 1:s] * cols[:, :, i, np.newaxis, np.newaxis]
+
+    # pass 2, along H at the output stride, summing the rank-1 terms: (N, K, output_W, output_H, C)
+    output = np.zeros((N, K, output_W, output_H, C), dtype=dtype)
+    for r in range(R):
+        for j in range(h):
+            output += tmp[:, :, r, :, j * d:j * d + (output_H - 1) * s + 1:s] * rows[:, r, j, np.newaxis, np.newaxis]
+    return output
+
+# default cap on the size of one tile of the unfolded patch matrix, in bytes
+MAX_PATCH_BYTES = 64 * 2**20
+
+# im2col: unfold a batch of (already padded) images (N, W, H, C) into patches for a
+# w x h filter with stride s and dilation d, a few output rows at a time
+# yields (x0, x1, patches) where patches is a contiguous (C, N, x1-x0, output_H, w, h) array
+# holding the windows of output rows x0..x1-1; tiles are sized so that patches never
+# takes more than max_bytes (but always at least one output row)
+def im2col_tiles(I, w, h, s=1, d=1, max_bytes=MAX_PATCH_BYTES):
+    N, W, H, C = I.shape
+    span_w = d * (w - 1) + 1
+    span_h = d * (h - 1) + 1
+    output_W = 1 + (W - span_w) // s
+    output_H = 1 + (H - span_h) // s
+
+    row_bytes = N * output_H * C * w * h * I.dtype.itemsize
+    rows = int(max(1, min(output_W, max_bytes // row_bytes)))
+
+    for x0 in range(0, output_W, rows):
+        x1 = min(output_W, x0 + rows)
+        # the input rows the output rows x0..x1-1 read from
+        tile = I[:, x0 * s:(x1 - 1) * s + span_w]
+        windows = sliding_window_view(tile, (span_w, span_h), axis=(1, 2))[:, ::s, ::s, :, ::d, ::d]
+        yield x0, x1, np.ascontiguousarray(windows.transpose(3, 0, 1, 2, 4, 5))
+
+# GEMM method: same result as _convolution_direct, computed one row tile at a time as a batch
+# of C matrix products (patches of channel c) @ (filter bank of channel c), so BLAS applies
+# all K filters of a tile in one call
+def _convolution_gemm(I, G, s, d=1, max_bytes=MAX_PATCH_BYTES):
+    N, W, H, C = I.shape
+    K, w, h, _ = G.shape
+    output_W = 1 + (W - d * (w - 1) - 1) // s
+    output_H = 1 + (H - d * (h - 1) - 1) // s
+
+    # (C, w*h, K) filter matrices, one per channel
+    # in the float output dtype, so the matmul of integer patches cannot overflow either
+    dtype = _output_dtype(I, G)
+    G_mat = G.transpose(3, 1, 2, 0).reshape(C, w * h, K).astype(dtype, copy=False)
+    output = np.empty((N, K, output_W, output_H, C), dtype=dtype)
+    for x0, x1, patches in im2col_tiles(I, w, h, s, d, max_bytes):
+        # (C, N*rows*output_H, w*h) @ (C, w*h, K) -> (C, N*rows*output_H, K)
+        prod = np.matmul(patches.reshape(C, -1, w * h), G_mat)
+        output[:, :, x0:x1] = prod.reshape(C, N, x1 - x0, output_H, K).transpose(1, 4, 2, 3, 0)
+    return output
+
+# multi-channel convolution as in a conv layer (torch.nn.Conv2d), channels last:
+# every filter is summed over all input channels instead of filtering them separately
+# X is (N, W, H, C), weight is (K, w, h, C), bias is (K,) or None
+# returns (N, output_W, output_H, K)
+def conv2d(X, weight, bias=None, stride=1, padding=0, dilation=1, max_bytes=MAX_PATCH_BYTES):
+    X = _pad(np.asarray(X), padding)
+    weight = np.asarray(weight)
+    N, W, H, C = X.shape
+    K, w, h, _ = weight.shape
+    output_W = 1 + (W - dilation * (w - 1) - 1) // stride
+    output_H = 1 + (H - dilation * (h - 1) - 1) // stride
+    if output_W < 1 or output_H < 1:
+        raise ValueError("filter %s is larger than the padded image %s" % ((w, h), (W, H)))
+
+    # (C*w*h, K) so the patch layout (C, w, h) lines up with the weights
+    # (float32 layers stay float32, integer inputs are computed in float64, see _output_dtype)
+    dtype = _output_dtype(X, weight)
+    W_mat = weight.transpose(3, 1, 2, 0).reshape(C * w * h, K).astype(dtype, copy=False)
+    output = np.empty((N, output_W, output_H, K), dtype=dtype)
+    for x0, x1, patches in im2col_tiles(X, w, h, stride, dilation, max_bytes):
+        # (N*rows*output_H, C*w*h) @ (C*w*h, K)
+        cols = patches.transpose(1, 2, 3, 0, 4, 5).reshape(-1, C * w * h)
+        output[:, x0:x1] = (cols @ W_mat).reshape(N, x1 - x0, output_H, K)
+    if bias is not None:
+        output += bias
+    return output
+
+# relative cost of one multiply-add in the direct method, of one FFT butterfly per point,
+# of copying one patch element in im2col, of one multiply-add inside BLAS and of one
+# multiply-add of a 1-D pass of the separable method, measured with benchmark_convolution2drgb.py
+DIRECT_COST = 1.0
+FFT_COST = 0.07
+IM2COL_COST = 0.25
+GEMM_COST = 0.01
+SEPARABLE_COST = 0.5
+
+# estimate the cost of each method for images of shape (N, W, H, C) (already padded) and
+# filters (K, w, h, C) at stride s and dilation d, returns the cheapest of 'direct', 'fft', 'gemm'
+# and, if the separable rank of the filters is given, 'separable'
+def choose_conv_method(image_shape, filter_shape, s, d=1, rank=None):
+    N, W, H, C = image_shape
+    K, w, h, _ = filter_shape
+    output_W = 1 + (W - d * (w - 1) - 1) // s
+    output_H = 1 + (H - d * (h - 1) - 1) // s
+    patch = N * C * output_W * output_H * w * h
+
+    # the direct method does w*h multiply-adds per strided output pixel and filter;
+    # it runs on the dilated filter, zeros included
+    cost = {'direct': DIRECT_COST * K * N * C * output_W * output_H * (d * (w - 1) + 1) * (d * (h - 1) + 1)}
+
+    # the FFT method transforms every image and filter once, multiplies the spectra of every
+    # image/filter pair and transforms every pair back; the stride does not help it at all
+    L = _next_fast_len(W) * _next_fast_len(H)
+    cost['fft'] = FFT_COST * C * L * (np.log2(L) * (N + K + N * K) + N * K)
+
+    # the GEMM method copies every patch once and lets BLAS apply all K filters to it
+    cost['gemm'] = IM2COL_COST * patch + GEMM_COST * K * patch
+
+    # the separable method runs a w-tap pass over output_W x H pixels and an h-tap pass over
+    # output_W x output_H pixels for every rank-1 term
+    if rank is not None:
+        cost['separable'] = SEPARABLE_COST * N * K * C * rank * output_W * (H * w + output_H * h)
+
+    return min(cost, key=cost.get)
+
+def convolution_2d_rgb(I, G, s, verbose=False, method='auto', padding=0, dilation=1,
+                       max_bytes=MAX_PATCH_BYTES, separable_tol=None):
+    # I is the input RGB image with shape (W, H, 3), or a batch of images (N, W, H, 3)
+    # G is the filter with shape (w, h, 3), or a bank of filters (K, w, h, 3)
     # s is the stride
+    # method is 'direct', 'fft', 'gemm', 'separable' or 'auto' (pick one with choose_conv_method)
+    # padding zero pads the image on both sides, dilation spreads the filter taps apart
+    # max_bytes caps the size of the unfolded patch tiles of the gemm method
+    # separable_tol opts into approximating the filters by their leading separable terms
+    # (see separable_factors), by default the separable method is exact
+    # verbose prints the output size and the method taken (with the rank for separable)
+    # every channel is filtered separately, so the output is (output_W, output_H, 3)
+    # for a single image and filter and (N, K, output_W, output_H, 3) for batches
+    # (the N or K axis is dropped when I or G is a single image or filter)
+
+    I, G, single_image, single_filter = _as_batch(I, G)
+    dtype = _output_dtype(I, G)
+    I = _pad(I.astype(dtype, copy=False), padding)
+    G = G.astype(dtype, copy=False)
 
     # Get dimensions
-    W, H, _ = I.shape
-    w, h, _ = G.shape
+    W, H = I.shape[1:3]
+    w, h = G.shape[1:3]
+    span_w = dilation * (w - 1) + 1
+    span_h = dilation * (h - 1) + 1
+    if span_w > W or span_h > H:
+        raise ValueError("filter %s is larger than the image %s" % ((span_w, span_h), (W, H)))
 
     # Calculate the dimensions of the output
+    output_W = 1 + (W - span_w) // s
+    output_H = 1 + (H - span_h) // s
+
+    if method in ('auto', 'separable'):
+        cols, rows = separable_factors(G, separable_tol)
+        rank = cols.shape[1]
+    if method == 'auto':
+        method = choose_conv_method(I.shape, G.shape, s, dilation, rank)
+    if verbose:
+        print(output_W,output_H,method,'rank %d' % rank if method == 'separable' else '')
+
+    if method == 'direct':
+        output = _convolution_direct(I, _dilate(G, dilation), s)
+    elif method == 'fft':
+        output = _convolution_fft(I, _dilate(G, dilation), s)
+    elif method == 'gemm':
+        output = _convolution_gemm(I, G, s, dilation, max_bytes)
+    elif method == 'separable':
+        output = _convolution_separable(I, cols, rows, s, dilation)
+    else:
+        raise ValueError("unknown convolution method %r" % (method,))
+
+    return _unbatch(output, single_image, single_filter)
+
+# default cap on the input tile each worker of the out-of-core convolution holds, in bytes
+MAX_TILE_BYTES = 256 * 2**20
+
+# split the output_W x output_H output of a w x h filter at stride s into tiles of at most
+# tile_rows x tile_cols output pixels; every tile also gets the input halo it reads from
+# yields ((x0, x1, y0, y1), (i0, i1, j0, j1)) output and input index ranges
+def _out_of_core_tiles(output_W, output_H, w, h, s, tile_rows, tile_cols):
+    for x0 in range(0, output_W, tile_rows):
+        x1 = min(output_W, x0 + tile_rows)
+        for y0 in range(0, output_H, tile_cols):
+            y1 = min(output_H, y0 + tile_cols)
+            yield (x0, x1, y0, y1), (x0 * s, (x1 - 1) * s + w, y0 * s, (y1 - 1) * s + h)
+
+# the floats a method holds per value of the input tile it convolves: the float copy of the
+# tile and, for K filters (of separable rank `rank`), its intermediates and output
+# (the gemm patch tiles are capped at the size of the input tile, see _convolve_tile)
+def _tile_footprint(method, K, rank=None):
+    if method == 'direct':
+        return 1 + K
+    if method == 'fft':
+        # the image spectrum, the K products of spectra and the two passes of their inverse
+        # transforms, on tiles padded to a fast length
+        return 3 + 5 * K
+    if method == 'gemm':
+        return 2 + 2 * K
+    if method == 'separable':
+        # the first pass over all rank-1 terms, the product added to it and the output
+        return 1 + K * (2 * rank + 1)
+    raise ValueError("unknown convolution method %r" % (method,))
+
+# convolve one tile of the memory mapped image and write it straight into the output file
+# both files are mapped only while the tile is processed, so the pages it touched are
+# unmapped again and do not pile up in the resident set of the worker
+# method is decided by the parent; for 'separable' the factors (cols, rows) of G come with it
+def _convolve_tile(image_path, output_path, G, s, method, factors, output_range, input_range):
+    x0, x1, y0, y1 = output_range
+    i0, i1, j0, j1 = input_range
+    I = np.load(image_path, mmap_mode='r')
+    tile = np.array(I[i0:i1, j0:j1], dtype=_output_dtype(I, G))
+    del I
+    if method == 'separable':
+        result = _unbatch(_convolution_separable(tile[np.newaxis], *factors, s), True, G.ndim == 3)
+    else:
+        result = convolution_2d_rgb(tile, G, s, method=method, max_bytes=tile.nbytes)
+    output = np.load(output_path, mmap_mode='r+')
+    output[..., x0:x1, y0:y1, :] = result
+    output.flush()
+    del output
+    return output_range
+
+def convolution_2d_rgb_out_of_core(image_path, G, s, output_path, method='auto', processes=None,
+                                   tile_shape=None, max_bytes=MAX_TILE_BYTES):
+    # image_path is a .npy file holding an RGB image (W, H, 3) too large to load, it is
+    # read through np.memmap one tile at a time
+    # G is the filter (w, h, 3) or a bank of filters (K, w, h, 3), s is the stride
+    # output_path is the .npy file the output (output_W, output_H, 3) or (K, output_W, output_H, 3)
+    # is written to, again through np.memmap
+    # tiles are convolved in parallel on a pool of `processes` worker processes (all cores by
+    # default, 1 runs in this process); tile_shape is the (rows, cols) of output pixels per tile,
+    # by default tiles are sized so that each worker holds about max_bytes: the float copy of its
+    # input tile and the intermediates and output of the method (decided once, for all tiles)
+    # returns the output as a read-only memmap
+
+    I = np.load(image_path, mmap_mode='r')
+    dtype = _output_dtype(I, G)
+    G = np.asarray(G).astype(dtype, copy=False)
+    W, H, C = I.shape
+    w, h = G.shape[-3:-1]
+    K = 1 if G.ndim == 3 else G.shape[0]
+    if w > W or h > H:
+        raise ValueError("filter %s is larger than the image %s" % ((w, h), (W, H)))
     output_W = 1 + (W - w) // s
     output_H = 1 + (H - h) // s
-    print(output_W,output_H)
-    # Initialize the output with zeros
-    output = np.zeros((output_W, output_H, 3))
-
-    # Iterate over the output pixels
-    for x in range(output_W):
-        for y in range(output_H):
-            # Compute the starting position in the input image
-
-            start_x = x * s
-            start_y = y * s
-            print(start_x,start_y)
-            # Perform the convolution for each channel (r, g, b)
-            for c in range(3):
-                # Extract the corresponding region from the input image
-                input_region = I[start_x:start_x + w, start_y:start_y + h, c]
-
-                # Example: Multiply the filter with the input region and sum the result
-                output[x, y, c] = np.sum(input_region * G[:, :, c])
 
-    return output
+    # the side of square-ish input tiles whose float copy and intermediates take about max_bytes
+    tile_side = lambda footprint: int(np.sqrt(max_bytes / (C * dtype.itemsize * footprint)))
+
+    # decide the method (and factor the filters) once here rather than in every tile,
+    # for tiles of the size the float copy alone would allow
+    factors = rank = None
+    if method in ('auto', 'separable'):
+        factors = separable_factors(G.reshape((K, w, h, C)))
+        rank = factors[0].shape[1]
+    if method == 'auto':
+        side = tile_side(1)
+        method = choose_conv_method((1, min(W, max(w, side)), min(H, max(h, side)), C), (K, w, h, C), s, 1, rank)
+    footprint = _tile_footprint(method, K, rank)
+
+    if tile_shape is None:
+        # square-ish input tiles of about max_bytes each, intermediates included
+        side = tile_side(footprint)
+        tile_rows = max(1, (side - w) // s + 1)
+        tile_cols = max(1, (side - h) // s + 1)
+    else:
+        tile_rows, tile_cols = tile_shape
+
+    output_shape = (output_W, output_H, C) if G.ndim == 3 else (G.shape[0], output_W, output_H, C)
+    # the dtype convolution_2d_rgb returns for every tile (float64 for uint8 scans)
+    output = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype, shape=output_shape)
+    # the workers open the file themselves, make sure the header and size are on disk
+    output.flush()
+    del output
+
+    tiles = list(_out_of_core_tiles(output_W, output_H, w, h, s, tile_rows, tile_cols))
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1:
+        for output_range, input_range in tiles:
+            _convolve_tile(image_path, output_path, G, s, method, factors, output_range, input_range)
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(_convolve_tile, image_path, output_path, G, s, method, factors,
+                                   output_range, input_range)
+                       for output_range, input_range in tiles]
+            for f in futures:
+                f.result()
+
+    return np.load(output_path, mmap_mode='r')
 
-# Example usage:
-# Assuming I is an RGB image and G is a filter
-I = np.random.rand(10, 10, 3)  # Example input image
-G = np.random.rand(3, 3, 3)    # Example filter
-s = 2                          # Example stride
+if __name__ == '__main__':
+    # Example usage:
+    # Assuming I is an RGB image and G is a filter
+    I = np.random.rand(10, 10, 3)  # Example input image
+    G = np.random.rand(3, 3, 3)    # Example filter
+    s = 2                          # Example stride
 
-result = convolution_2d_rgb(I, G, s)
-print(result)
\ No newline at end of file
+    result = convolution_2d_rgb(I, G, s, verbose=True)
+    print(result)
@@ -11,16 +11,17 @@ In this exercise, you will first develop a fully connected neural net model and
 """
 
 import torch
-import torchvision
-import torchvision.transforms as transforms
 import numpy as np
 import matplotlib.pyplot as plt
 import torch.nn as nn
 
 import sklearn
 from sklearn.metrics import accuracy_score, confusion_matrix, classification_report
+
 import copy
 
+from cifar10_data import CIFAR10Cache, tmean, tstd
+
 """# The CIFAR10 dataset
 - Download and normalize the CIFAR10 dataset from torchvision
 - Split the CIFAR10 data into train, validation and test set
@@ -29,31 +30,17 @@ import copy
 - Define the string class labels (targets are numeric 0-9)
 """
 
-# mean and std for the RGB channels in CIFAR10
-tmean = [0.49139968, 0.48215841, 0.44653091]
-tstd = [0.24703223, 0.24348513, 0.26158784]
-
-# transform the 32x32x3 images into a tensor after normalizing
-# each channel using the parameters above
-transform = transforms.Compose(
-    [transforms.ToTensor(),
-     transforms.Normalize(tmean, tstd)])
-
-# download and transform the  trainset and testset for training
-trainset = torchvision.datasets.CIFAR10(root='./data',train=True,download=True,transform=transform)
-testset = torchvision.datasets.CIFAR10(root='./data',train=False,download=True,transform=transform)
-
-#split trainset into a train and a val set (90-10 split)
-lengths = [int(p * len(trainset)) for p in [0.9,0.1]]
-tr,v = torch.utils.data.random_split(trainset,lengths)
-train_sampler = torch.utils.data.SubsetRandomSampler(tr.indices)
-val_sampler = torch.utils.data.SubsetRandomSampler(v.indices)
+# mean and std for the RGB channels in CIFAR10 (tmean, tstd) are in cifar10_data.py
+# CIFAR10Cache decodes the trainset and testset once into uint8 memory maps under ./data,
+# with the 90-10 train/val split fixed by a seed (the same split in every notebook);
+# the loaders normalize each batch as they read it
+cifar10 = CIFAR10Cache(root='./data')
 
 # set batch size and set up the data generators for train, val, test sets
 batch_size = 64
-trainloader = torch.utils.data.DataLoader(trainset,batch_size=batch_size,sampler=train_sampler)
-valloader = torch.utils.data.DataLoader(trainset,batch_size=batch_size,sampler=val_sampler)
-testloader = torch.utils.data.DataLoader(testset, batch_size=batch_size)
+trainloader = cifar10.loader('train', batch_size, shuffle=True)
+valloader = cifar10.loader('val', batch_size)
+testloader = cifar10.loader('test', batch_size)
 
 print("Number of training batches = ",len(trainloader))
 print("Number of validation batches = ",len(valloader))
@@ -510,6 +497,22 @@ print(f"Accuracy: {accuracy}")
 print(f"Confusion Matrix:\n{conf_matrix}")
 print(f"Classification Report:\n{class_report}")
 
+"""# Export the ConvModel for the NumPy runtime
+- save the weights and layer stack to an .npz that cnn_numpy_runtime.py loads without torch
+- check that the NumPy forward pass gives the same logits as torch on a test batch
+"""
+
+from cnn_numpy_runtime import export_state_dict, load_model
+
+export_state_dict(model, 'convmodel.npz')
+numpy_model = load_model('convmodel.npz')
+
+tX, ty = next(iter(testloader))
+with torch.no_grad():
+    torch_logits = model.net(tX.to(device)).cpu().numpy()
+numpy_logits = numpy_model(tX.numpy())
+print('max logit difference numpy vs torch: ', np.max(np.abs(numpy_logits - torch_logits)))
+
 """Training Five Layer NN to an accuracy of > 50%
 
 """
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""Gaussian discriminant analysis for gda_svm_cifar10.py without the flattened data set in memory
+
+StreamingLDA fits the same model as sklearn's LinearDiscriminantAnalysis(solver='lsqr') from
+batches, e.g. straight from a DataLoader: it only keeps per-class counts and sums and the
+pooled scatter matrix (d x d), accumulated in float64 from the float32 batches (whose scatter
+products can be taken in float32 at half the cost), and solves for the discriminant once at
+the end. partial_fit adds labelled batches to a fitted model and re-solves, without going
+over the earlier data again.
+
+    lda = StreamingLDA().fit(cifar10.loader('trainval', 1000))
+    lda.predict(Xtest)
+
+reduced() turns a fitted StreamingLDA into a ReducedRankLDA, which keeps only the class
+means and the (d x r, r <= K - 1) discriminant projection, a few hundred KB instead of the
+d x d scatter and covariance matrices: it classifies by projecting and taking the nearest
+class centroid (corrected for the priors) in the r-dimensional discriminant space, which
+with r = K - 1 gives the same predictions as the full model. save/load store it as a .npz.
+
+    rr_lda = lda.reduced()
+    rr_lda.save('lda.npz')
+    ReducedRankLDA.load('lda.npz').predict(Xtest)
+
+StreamingQDA gives every class its own covariance, modelled as low rank plus diagonal (its
+leading eigenpairs, found by randomized subspace iteration over a few passes of the batches,
+and the rest of its diagonal), so no d x d matrix is ever formed, and evaluates the class
+log-likelihoods with the Woodbury identity and the matrix determinant lemma in O(d r) per
+class and sample.
+
+    qda = StreamingQDA(n_components=20).fit(cifar10.loader('trainval', 1000))
+    qda.predict(Xtest)
+"""
+
+import os
+
+import numpy as np
+import scipy.linalg
+
+from batch_utils import flat_rows
+
+class StreamingLDA:
+
+    # shrinkage None (plain pooled covariance), a float a in [0, 1] or 'auto' (Ledoit-Wolf)
+    # like sklearn, a float shrinks towards the scaled identity, (1 - a) S + a trace(S) / d I,
+    # and 'auto' shrinks the correlation matrix towards the identity, i.e. S towards its diagonal,
+    # with one Ledoit-Wolf intensity for the pooled covariance (sklearn estimates one per
+    # class from that class's samples alone, and so shrinks more)
+    # dtype is the type the (shifted) batches are cast to for their scatter products; the sums
+    # they are added to are float64 whatever it is, so float32 only rounds within a batch
+    def __init__(self, shrinkage=None, dtype=np.float64):
+        self.shrinkage = shrinkage
+        self.dtype = dtype
+
+    def _reset(self, d):
+        self.count_ = np.zeros(0, dtype=np.int64)
+        self.sum_ = np.zeros((0, d))
+        self.scatter_ = np.zeros((d, d))
+        # the scatter is of x - shift_ (the mean of the first batch), which keeps the
+        # subtraction of the class means at the end from cancelling
+        self.shift_ = None
+        # for 'auto': the sum over the samples of ||z||^4, z the standardized, class centered sample
+        self.fourth_ = 0.0
+
+    def _grow(self, num_classes):
+        extra = num_classes - len(self.count_)
+        if extra > 0:
+            self.count_ = np.concatenate((self.count_, np.zeros(extra, dtype=np.int64)))
+            self.sum_ = np.vstack((self.sum_, np.zeros((extra, self.sum_.shape[1]))))
+
+    # add a batch (X any shape with the samples first, y integer labels 0 .. K-1) to the statistics
+    def _accumulate(self, X, y):
+        X = flat_rows(X)
+        y = np.asarray(y).astype(np.int64)
+        if not hasattr(self, 'count_'):
+            self._reset(X.shape[1])
+        if self.shift_ is None:
+            self.shift_ = X.mean(axis=0, dtype=np.float64)
+        self._grow(y.max() + 1)
+        Xc = (X - self.shift_).astype(self.dtype, copy=False)
+        self.scatter_ += Xc.T @ Xc
+        np.add.at(self.count_, y, 1)
+        sums = np.zeros((len(self.count_), X.shape[1]))
+        np.add.at(sums, y, Xc)
+        self.sum_ += sums
+        if self.shrinkage == 'auto':
+            # Ledoit-Wolf needs the fourth moment of the standardized, class centered samples;
+            # it is taken with the class means and variances known so far (this batch included),
+            # which approaches the exact value as the estimates settle
+            means = self.sum_ / np.maximum(self.count_, 1)[:, np.newaxis]
+            Z = (Xc - means[y]) / np.sqrt(np.maximum(self._variances(), 1e-12))
+            self.fourth_ += np.sum(np.einsum('ij,ij->i', Z, Z) ** 2)
+
+    # the diagonal of the pooled within-class covariance
+    def _variances(self):
+        present = self.count_ > 0
+        means = self.sum_[present] / self.count_[present, np.newaxis]
+        return (self.scatter_.diagonal() - self.count_[present] @ means ** 2) / self.count_.sum()
+
+    # the pooled within-class covariance (biased, as sklearn's lsqr solver uses)
+    def _covariance(self, unshrunk=False):
+        n = self.count_.sum()
+        present = self.count_ > 0
+        means = self.sum_[present] / self.count_[present, np.newaxis]
+        S = (self.scatter_ - (means.T * self.count_[present]) @ means) / n
+        if unshrunk or self.shrinkage is None:
+            return S
+        if self.shrinkage == 'auto':
+            alpha = self._ledoit_wolf(S, n)
+            target = S.diagonal().copy()
+        else:
+            alpha = float(self.shrinkage)
+            target = np.trace(S) / len(S)
+        S *= 1 - alpha
+        S[np.diag_indices_from(S)] += alpha * target
+        return S
+
+    # Ledoit-Wolf shrinkage of the correlation matrix towards the identity, as
+    # sklearn.covariance.ledoit_wolf_shrinkage on standardized data
+    def _ledoit_wolf(self, S, n):
+        d = len(S)
+        scale = np.sqrt(np.maximum(S.diagonal(), 1e-12))
+        C = S / scale[:, np.newaxis] / scale[np.newaxis, :]
+        sq = np.sum(C ** 2)
+        delta = (sq - d) / d
+        beta = (self.fourth_ / n - sq) / (d * n)
+        return 0.0 if delta <= 0 else min(beta, delta) / delta
+
+    def _solve(self):
+        n = self.count_.sum()
+        present = self.count_ > 0
+        self.classes_ = np.flatnonzero(present)
+        self.priors_ = self.count_[present] / n
+        self.means_ = self.sum_[present] / self.count_[present, np.newaxis] + self.shift_
+        self.covariance_ = self._covariance()
+        try:
+            W = scipy.linalg.solve(self.covariance_, self.means_.T, assume_a='pos')
+        except np.linalg.LinAlgError:
+            # a singular covariance: least squares, like sklearn's lsqr solver
+            W = scipy.linalg.lstsq(self.covariance_, self.means_.T)[0]
+        self.coef_ = W.T
+        self.intercept_ = -0.5 * np.einsum('kd,kd->k', self.means_, self.coef_) + np.log(self.priors_)
+        return self
+
+    # fit on batches: an iterable of (X, y) batches (a DataLoader) or, with y, arrays X and y
+    # that are gone over batch_size rows at a time
+    def fit(self, X, y=None, batch_size=1000):
+        if hasattr(self, 'count_'):
+            del self.count_
+        batches = X if y is None else ((X[i:i + batch_size], y[i:i + batch_size]) for i in range(0, len(X), batch_size))
+        for Xb, yb in batches:
+            self._accumulate(Xb, yb)
+        return self._solve()
+
+    # add one labelled batch (or an iterable of batches, like fit) to the model
+    def partial_fit(self, X, y=None):
+        batches = X if y is None else [(X, y)]
+        for Xb, yb in batches:
+            self._accumulate(Xb, yb)
+        return self._solve()
+
+    def decision_function(self, X):
+        return flat_rows(X) @ self.coef_.T.astype(np.float32) + self.intercept_
+
+    def predict(self, X, batch_size=10000):
+        return np.concatenate([self.classes_[self.decision_function(X[i:i + batch_size]).argmax(axis=1)]
+                               for i in range(0, len(X), batch_size)])
+
+    def score(self, X, y):
+        return np.mean(self.predict(X) == np.asarray(y))
+
+    # the reduced-rank model with the n_components (default and at most K - 1) leading
+    # discriminant directions: W whitens the within-class covariance (W^T S W = I) and spans the
+    # prior weighted between-class scatter of the means, so Euclidean distances between
+    # projections are the Mahalanobis distances of the LDA
+    def reduced(self, n_components=None):
+        centered = self.means_ - self.priors_ @ self.means_
+        try:
+            # S = L L^T, and L^-1 whitens
+            L = scipy.linalg.cholesky(self.covariance_, lower=True)
+            whitened = scipy.linalg.solve_triangular(L, centered.T * np.sqrt(self.priors_), lower=True)
+            unwhiten = lambda U: scipy.linalg.solve_triangular(L.T, U, lower=False)
+        except np.linalg.LinAlgError:
+            # a singular covariance: the pseudo-inverse square root
+            values, vectors = np.linalg.eigh(self.covariance_)
+            keep = values > values.max() * 1e-12
+            root = vectors[:, keep] / np.sqrt(values[keep])
+            whitened = root.T @ (centered.T * np.sqrt(self.priors_))
+            unwhiten = lambda U: root @ U
+        U, singular_values, _ = np.linalg.svd(whitened, full_matrices=False)
+        rank = np.sum(singular_values > singular_values[0] * 1e-10)
+        r = min(rank, len(self.classes_) - 1, n_components or rank)
+        scalings = unwhiten(U[:, :r])
+        return ReducedRankLDA(scalings, self.priors_ @ self.means_, centered @ scalings, self.means_,
+                              self.priors_, self.classes_)
+
+class ReducedRankLDA:
+
+    # scalings (d x r) the discriminant projection, xbar (d) the overall mean, centroids (K x r)
+    # the projected class means; means (K x d) are kept for inspection (the notebook's images)
+    def __init__(self, scalings, xbar, centroids, means, priors, classes):
+        self.scalings_ = np.asarray(scalings, dtype=np.float32)
+        self.xbar_ = np.asarray(xbar, dtype=np.float32)
+        self.centroids_ = np.asarray(centroids, dtype=np.float64)
+        self.means_ = np.asarray(means, dtype=np.float32)
+        self.priors_ = np.asarray(priors, dtype=np.float64)
+        self.classes_ = np.asarray(classes)
+
+    # the r discriminant coordinates of the rows of X, X W - xbar W (no centered copy of X)
+    def transform(self, X):
+        return flat_rows(X) @ self.scalings_ - self.xbar_ @ self.scalings_
+
+    # nearest centroid with the log priors: -||z - c_k||^2 / 2 + log pi_k, up to a term
+    # common to all classes
+    def decision_function(self, X):
+        Z = self.transform(X)
+        return Z @ self.centroids_.T - 0.5 * np.einsum('kr,kr->k', self.centroids_, self.centroids_) + np.log(self.priors_)
+
+    def predict(self, X, batch_size=10000):
+        return np.concatenate([self.classes_[self.decision_function(X[i:i + batch_size]).argmax(axis=1)]
+                               for i in range(0, len(X), batch_size)])
+
+    def score(self, X, y):
+        return np.mean(self.predict(X) == np.asarray(y))
+
+    def save(self, path):
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, scalings=self.scalings_, xbar=self.xbar_, centroids=self.centroids_, means=self.means_,
+                 priors=self.priors_, classes=self.classes_)
+        # a half-written file never replaces a complete one
+        os.replace(tmp, path)
+        return self
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['scalings'], f['xbar'], f['centroids'], f['means'], f['priors'], f['classes'])
+
+class StreamingQDA:
+
+    # a Gaussian per class with covariance V_k diag(lambda_k) V_k^T + diag(psi_k): the
+    # n_components leading eigenpairs of the class covariance, found by randomized subspace
+    # iteration (n_oversamples extra directions, n_iter power iterations), plus the rest of its
+    # diagonal, psi_k = diag(S_k) - diag(V_k diag(lambda_k) V_k^T), to which reg times the mean
+    # variance of the class is added so that it stays positive definite
+    def __init__(self, n_components=20, n_oversamples=10, n_iter=2, reg=1e-2, random_state=0):
+        self.n_components = n_components
+        self.n_oversamples = n_oversamples
+        self.n_iter = n_iter
+        self.reg = reg
+        self.random_state = random_state
+
+    # one pass: the class counts, means and variances
+    def _moments(self, batches):
+        count, total, squares = 0, 0, 0
+        for X, y in batches:
+            X = flat_rows(X)
+            y = np.asarray(y).astype(np.int64)
+            if np.isscalar(count):
+                d = X.shape[1]
+                count, total, squares = np.zeros(0, dtype=np.int64), np.zeros((0, d)), np.zeros((0, d))
+            extra = y.max() + 1 - len(count)
+            if extra > 0:
+                count = np.concatenate((count, np.zeros(extra, dtype=np.int64)))
+                total = np.vstack((total, np.zeros((extra, total.shape[1]))))
+                squares = np.vstack((squares, np.zeros((extra, squares.shape[1]))))
+            np.add.at(count, y, 1)
+            for k in np.unique(y):
+                Xk = X[y == k].astype(np.float64)
+                total[k] += Xk.sum(axis=0)
+                squares[k] += np.einsum('ij,ij->j', Xk, Xk)
+        present = count > 0
+        self.classes_ = np.flatnonzero(present)
+        count = count[present]
+        self.means_ = total[present] / count[:, np.newaxis]
+        # unbiased, as sklearn's QDA
+        self.variances_ = (squares[present] - count[:, np.newaxis] * self.means_ ** 2) / (count[:, np.newaxis] - 1)
+        self.priors_ = count / count.sum()
+        return count
+
+    # one pass: S_k Q_k for the (d x l) bases Q_k of every class, from the class centered samples
+    def _products(self, batches, Q):
+        index = {k: j for j, k in enumerate(self.classes_)}
+        Y = np.zeros_like(Q)
+        means = self.means_.astype(np.float32)
+        for X, y in batches:
+            X = flat_rows(X)
+            y = np.asarray(y)
+            for k in np.unique(y):
+                j = index[k]
+                Xk = X[y == k] - means[j]
+                Y[j] += Xk.T @ (Xk @ Q[j].astype(np.float32))
+        return Y
+
+    # batches: an iterable of (X, y) batches that can be gone over several times (a DataLoader),
+    # or arrays X and y gone over batch_size rows at a time; n_iter + 2 passes over the data
+    def fit(self, X, y=None, batch_size=1000):
+        if y is None:
+            batches = X
+        else:
+            batches = [(X[i:i + batch_size], y[i:i + batch_size]) for i in range(0, len(X), batch_size)]
+        count = self._moments(batches)
+        K, d = self.means_.shape
+        l = min(self.n_components + self.n_oversamples, d)
+        rng = np.random.default_rng(self.random_state)
+        Q = np.linalg.qr(rng.standard_normal((K, d, l)))[0]
+        for _ in range(self.n_iter):
+            Q = np.linalg.qr(self._products(batches, Q) / (count[:, np.newaxis, np.newaxis] - 1))[0]
+        Y = self._products(batches, Q) / (count[:, np.newaxis, np.newaxis] - 1)
+        # the eigenpairs of S_k restricted to span(Q_k): Q^T S Q = U diag(lambda) U^T
+        r = min(self.n_components, l)
+        eigenvalues, eigenvectors = np.linalg.eigh(np.einsum('kdi,kdj->kij', Q, Y))
+        self.eigenvalues_ = np.maximum(eigenvalues[:, ::-1][:, :r], 0)
+        self.components_ = np.einsum('kdi,kij->kdj', Q, eigenvectors[:, :, ::-1][:, :, :r])
+        explained = np.einsum('kdj,kj->kd', self.components_ ** 2, self.eigenvalues_)
+        self.noise_variances_ = (np.maximum(self.variances_ - explained, 0)
+                                 + self.reg * self.variances_.mean(axis=1, keepdims=True))
+        self._factor()
+        return self
+
+    # Woodbury: with D = diag(psi), S^-1 = D^-1 - D^-1 V M^-1 V^T D^-1, M = diag(lambda)^-1 + V^T D^-1 V
+    # = L L^T, so (x - mu)^T S^-1 (x - mu) = sum((x - mu)^2 / psi) - ||(x - mu)^T P||^2 with
+    # P = D^-1 V L^-T; and log|S| = log|D| + log|diag(lambda)| + log|M| (the determinant lemma)
+    def _factor(self):
+        K, d, r = self.components_.shape
+        inverse = 1 / self.noise_variances_
+        lam = np.maximum(self.eigenvalues_, 1e-12 * self.variances_.max())
+        P = np.empty((K, d, r))
+        self.log_det_ = np.empty(K)
+        for k in range(K):
+            DV = self.components_[k] * inverse[k][:, np.newaxis]
+            L = np.linalg.cholesky(np.diag(1 / lam[k]) + self.components_[k].T @ DV)
+            P[k] = scipy.linalg.solve_triangular(L, DV.T, lower=True).T
+            self.log_det_[k] = (np.sum(np.log(self.noise_variances_[k])) + np.sum(np.log(lam[k]))
+                                + 2 * np.sum(np.log(L.diagonal())))
+        # everything prediction needs as (d x ...) matrices for one product each with the samples
+        self.inverse_variances_ = inverse.T.astype(np.float32)
+        self.weighted_means_ = (self.means_ * inverse).T.astype(np.float32)
+        self.projections_ = P.transpose(1, 0, 2).reshape(d, K * r).astype(np.float32)
+        self.projected_means_ = np.einsum('kd,kdr->kr', self.means_, P)
+        self.mean_terms_ = np.sum(self.means_ ** 2 * inverse, axis=1)
+
+    # the (n x K) log densities log N(x | mu_k, S_k) of the rows of X: three products of X with
+    # d x K and d x (K r) matrices, O(n d K r), no per-class d x d matrix or centered copy of X
+    def log_likelihood(self, X):
+        X = flat_rows(X)
+        K, d, r = self.components_.shape
+        quadratic = ((X * X) @ self.inverse_variances_ - 2 * (X @ self.weighted_means_)).astype(np.float64)
+        quadratic += self.mean_terms_
+        projected = (X @ self.projections_).astype(np.float64).reshape(len(X), K, r) - self.projected_means_
+        quadratic -= np.einsum('nkr,nkr->nk', projected, projected)
+        return -0.5 * (quadratic + self.log_det_ + d * np.log(2 * np.pi))
+
+    def decision_function(self, X):
+        return self.log_likelihood(X) + np.log(self.priors_)
+
+    def predict(self, X, batch_size=5000):
+        return np.concatenate([self.classes_[self.decision_function(X[i:i + batch_size]).argmax(axis=1)]
+                               for i in range(0, len(X), batch_size)])
+
+    def score(self, X, y):
+        return np.mean(self.predict(X) == np.asarray(y))
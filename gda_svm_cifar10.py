@@ -9,18 +9,25 @@ Original file is located at
 # SVM and GDA for CIFAR-10
 """
 
+import os
+import resource
+import time
+
 import torch
-import torchvision
-import torchvision.transforms as transforms
 import numpy as np
 import matplotlib.pyplot as plt
 
 import sklearn
 from sklearn.metrics import accuracy_score, confusion_matrix, classification_report
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
 from sklearn.svm import LinearSVC, SVC
 from scipy.spatial.distance import cdist
 
+from cifar10_data import CIFAR10Cache, normalize, tmean, tstd
+from gda_models import ReducedRankLDA, StreamingLDA, StreamingQDA
+from pca_features import cached_pca
+from svm_sweep import PrecomputedKernel, parallel_c_sweep
+from svm_primal import ApproximateRBFSVM, LinearSVMPath
+
 """# The CIFAR10 dataset
 - Download and normalize the CIFAR10 dataset from torchvision
 - Split the CIFAR10 data into train, validation and test set
@@ -29,31 +36,18 @@ from scipy.spatial.distance import cdist
 - Define the string class labels (targets are numeric 0-9)
 """
 
-# mean and std for the RGB channels in CIFAR10
-tmean = [0.49139968, 0.48215841, 0.44653091]
-tstd = [0.24703223, 0.24348513, 0.26158784]
-
-# transform the 32x32x3 images into a tensor after normalizing
-# each channel using the parameters above
-transform = transforms.Compose(
-    [transforms.ToTensor(),
-     transforms.Normalize(tmean, tstd)])
-
-# download and transform the  trainset and testset for training
-trainset = torchvision.datasets.CIFAR10(root='./data',train=True,download=True,transform=transform)
-testset = torchvision.datasets.CIFAR10(root='./data',train=False,download=True,transform=transform)
-
-#split trainset into a train and a val set (90-10 split)
-lengths = [int(p * len(trainset)) for p in [0.9,0.1]]
-tr,v = torch.utils.data.random_split(trainset,lengths)
-train_sampler = torch.utils.data.SubsetRandomSampler(tr.indices)
-val_sampler = torch.utils.data.SubsetRandomSampler(v.indices)
+# mean and std for the RGB channels in CIFAR10 (tmean, tstd) are in cifar10_data.py
+# CIFAR10Cache decodes the trainset and testset once into uint8 memory maps under ./data,
+# with the 90-10 train/val split fixed by a seed (the same split in every notebook);
+# the images stay uint8 (a quarter of the float32 memory) and are normalized with
+# normalize() where the models use them
+cifar10 = CIFAR10Cache(root='./data')
 
 # set batch size and set up the data generators for train, val, test sets
 batch_size = 128
-trainloader = torch.utils.data.DataLoader(trainset,batch_size=batch_size,sampler=train_sampler)
-valloader = torch.utils.data.DataLoader(trainset,batch_size=batch_size,sampler=val_sampler)
-testloader = torch.utils.data.DataLoader(testset, batch_size=batch_size)
+trainloader = cifar10.loader('train', batch_size, shuffle=True)
+valloader = cifar10.loader('val', batch_size)
+testloader = cifar10.loader('test', batch_size)
 
 print("Number of training batches = ",len(trainloader))
 print("Number of validation batches = ",len(valloader))
@@ -80,20 +74,18 @@ for i in range(0,rows*cols):
 
 """# Accumulate the training, validation, and test sets"""
 
-def extract_data(generator):
-    X = torch.zeros((0,3,32,32))
-    y = torch.zeros((0,))
-    for (Xtr,ytr) in generator:
-        X = torch.vstack([X,Xtr])
-        y = torch.concat((y,ytr),axis=0)
-    return X,y
-
-Xtrain,ytrain = extract_data(trainloader)
+# zero-copy uint8 views of the cached memory maps; the train and validation images are stored
+# back to back, so trainX (both together, for GDA) is a view as well
+start = time.perf_counter()
+Xtrain,ytrain = cifar10.split('train')
 print("Training data: ",Xtrain.shape,ytrain.shape)
-Xval,yval = extract_data(valloader)
+Xval,yval = cifar10.split('val')
 print("Validation data: ",Xval.shape,yval.shape)
-Xtest,ytest = extract_data(testloader)
+Xtest,ytest = cifar10.split('test')
 print("Test data: ",Xtest.shape,ytest.shape)
+trainX,trainy = cifar10.split('trainval')
+print("loaded in %.2f s, %s images, peak RSS %.0f MB" % (time.perf_counter() - start, trainX.dtype,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
 
 """# GDA with same covariance for each class (5 points)
 
@@ -105,9 +97,7 @@ Set up an LDA model using sklearn's [LDA](https://scikit-learn.org/stable/module
 - visualize the means of the 10 classes, and interpret the images in relation to the classes they represent.
 """
 
-# concatenate the train and validation sets for GDA
-trainX = torch.vstack((Xtrain,Xval))
-trainy = torch.cat([ytrain,yval])
+# the train and validation sets for GDA: trainX and trainy already hold them back to back
 print(trainX.shape,trainy.shape)
 
 # your code here (LDA model with same covariance for every class)
@@ -116,14 +106,14 @@ print(trainX.shape,trainy.shape)
 # set up LDA model and fit on (trainX,trainy)
 # about 2 lines
 
-# Reshape trainX as (50000, 3072)
-trainX_flat = trainX.reshape((50000,3072))
-
-# Create the LDA classifier with 'lsqr' solver and store_covariance=True
-lda = LinearDiscriminantAnalysis(solver='lsqr', store_covariance=True)
-
-# Fit the LDA model on the training data
-lda.fit(trainX_flat, trainy)
+# StreamingLDA (gda_models.py) fits the same model as
+# LinearDiscriminantAnalysis(solver='lsqr', store_covariance=True), but from batches of
+# (trainX, trainy) as the loader normalizes them: only the class counts and sums and the
+# 3072 x 3072 scatter matrix are kept, so the flattened 50000 x 3072 set is never in memory
+start = time.perf_counter()
+lda = StreamingLDA().fit(cifar10.loader('trainval', 1000))
+print("LDA fitted in %.1f s, peak RSS %.0f MB" % (time.perf_counter() - start,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
 
 """# Test model on Xtest and ytest (4 points)
 - print accuracy of model on (Xtest,ytest)
@@ -136,7 +126,7 @@ lda.fit(trainX_flat, trainy)
 
 
 # Reshape Xtest as (number of samples, number of features)
-Xtest_flat = Xtest.reshape((Xtest.shape[0], -1))
+Xtest_flat = normalize(Xtest).reshape((Xtest.shape[0], -1))
 
 # Predict labels using the trained LDA model
 lda_predictions = lda.predict(Xtest_flat)
@@ -155,6 +145,32 @@ print('Classification Report:\n', classification_rep)
 confusion = confusion_matrix(ytest, lda_predictions)
 print('Confusion Matrix:\n', confusion)
 
+# the reduced-rank LDA keeps only the class means and the 3072 x 9 discriminant projection and
+# classifies by the nearest class centroid in the 9-dimensional discriminant space; it makes
+# the same predictions as the full model
+rr_lda = lda.reduced()
+rr_lda.save('./data/lda_reduced.npz')
+print(f"Reduced-rank LDA: {os.path.getsize('./data/lda_reduced.npz') / 1024:.0f} KB on disk, "
+      f"{rr_lda.scalings_.shape[1]} discriminant directions")
+start = time.perf_counter()
+rr_predictions = ReducedRankLDA.load('./data/lda_reduced.npz').predict(Xtest_flat)
+print(f'Reduced-rank LDA test accuracy {accuracy_score(ytest, rr_predictions):.4f}, '
+      f'loaded and predicted in {time.perf_counter() - start:.2f}s')
+
+"""# GDA with a different covariance for each class
+- full QDA needs ten 3072 x 3072 class covariances; StreamingQDA (gda_models.py) models each as its 20 leading eigenpairs plus a diagonal, found in a few passes over the streamed training set, and evaluates the log-likelihoods with the Woodbury identity, O(3072 x 20) per class and image
+"""
+
+start = time.perf_counter()
+qda = StreamingQDA(n_components=20).fit(cifar10.loader('trainval', 1000))
+qda_fit_time = time.perf_counter() - start
+start = time.perf_counter()
+qda_predictions = qda.predict(Xtest_flat)
+print(f'QDA test accuracy {accuracy_score(ytest, qda_predictions):.4f}, fit {qda_fit_time:.1f}s, '
+      f'predict {time.perf_counter() - start:.2f}s, peak RSS '
+      f'{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB')
+print('Confusion Matrix:\n', confusion_matrix(ytest, qda_predictions))
+
 """# Visualize the means (1 point)
 - comment on the visualizations in this cell. That is, interpret these means in terms of the classes they represent.
 """
@@ -187,7 +203,9 @@ The sklearn implementation of SVM (SVC) is very slow, because it uses all points
 
 # subselect 5000 examples from the CIFAR-10 dataset
 N = 5000
-sXtrain = trainX[:N]
+sXtrain = normalize(trainX[:N])
+Xval = normalize(Xval)
+Xtest = normalize(Xtest)
 sytrain = trainy[:N]
 
 """# Linear SVM kernel
@@ -200,19 +218,13 @@ C_vals = np.array([0.0001,0.001,0.01,0.1,1,10])
 
 
 # Linear kernel SVM
-linear_accuracies = []
-
-for C in C_vals:
-    # Train linear SVM
-    linear_svm = SVC(kernel='linear', C=C, probability=False)
-    linear_svm.fit(sXtrain.reshape((N, -1)), sytrain)
-
-    # Predict on validation set
-    y_val_pred = linear_svm.predict(Xval.reshape((Xval.shape[0], -1)))
-
-    # Measure accuracy
-    accuracy = accuracy_score(yval, y_val_pred)
-    linear_accuracies.append(accuracy)
+# the 5000 x 5000 train Gram matrix and the validation cross-kernel are computed once (blocked
+# float32, see svm_sweep.py) and every C fits SVC(kernel='precomputed') on them, each C in its
+# own process on the kernels in shared memory
+linear_kernel = PrecomputedKernel(sXtrain, 'linear')
+linear_accuracies, linear_fit_times, linear_models = parallel_c_sweep(linear_kernel, sytrain, Xval, yval, C_vals)
+for C, accuracy, fit_time in zip(C_vals, linear_accuracies, linear_fit_times):
+    print(f'C={C:g}: validation accuracy {accuracy:.4f}, fit {fit_time:.1f}s')
 
 # plot C_vals and val set accuracy in a semilog plot
 # 1 line of code
@@ -232,14 +244,12 @@ plt.show()
 best_linear_C = C_vals[np.argmax(linear_accuracies)]
 print(f'Best C value for Linear SVM: {best_linear_C}')
 
-# Build a linear model with the best C value
-best_linear_svm = SVC(kernel='linear', C=best_linear_C, probability=False)
-best_linear_svm.fit(sXtrain.view(N, -1).numpy(), sytrain)
+# the linear model with the best C value was fitted in the sweep
+best_linear_svm = linear_models[np.argmax(linear_accuracies)]
 
-# Evaluate the linear model on the full test set
-flat_Xtest = Xtest.view(Xtest.shape[0], -1).numpy()
+# Evaluate the linear model on the full test set (through its kernel with the training set)
 ytest_np=ytest.view(ytest.shape[0], -1).numpy()
-y_test_pred_linear = best_linear_svm.predict(flat_Xtest)
+y_test_pred_linear = best_linear_svm.predict(linear_kernel(Xtest))
 accuracy_linear = accuracy_score(ytest_np, y_test_pred_linear)
 print(f'Linear SVM Test Accuracy: {accuracy_linear:.4f}')
 
@@ -250,6 +260,19 @@ print('Confusion Matrix:')
 print(confusion_matrix(ytest_np, y_test_pred_linear))
 best_linear_C = C_vals[np.argmax(linear_accuracies)]
 
+"""# Linear SVM path on the full training set
+- a primal (squared hinge, as LinearSVC) solver fits the whole C_vals curve on all 45000 training images, each C starting from the solution of the previous one and the classes split over worker processes (see svm_primal.py)
+"""
+
+start = time.perf_counter()
+linear_path = LinearSVMPath(C_vals).fit(normalize(Xtrain), ytrain)
+print(f'Linear SVM path over {len(C_vals)} C values on {len(Xtrain)} images: {time.perf_counter() - start:.1f}s')
+path_accuracies = linear_path.score_path(Xval, yval)
+for C, accuracy in zip(C_vals, path_accuracies):
+    print(f'C={C:g}: validation accuracy {accuracy:.4f}')
+best_path = np.argmax(path_accuracies)
+print(f'Best C value: {C_vals[best_path]}, test accuracy {accuracy_score(ytest_np, linear_path.predict(Xtest, best_path)):.4f}')
+
 """# RBF SVM kernel
 - choosing regularization C using a validation set
 """
@@ -258,20 +281,12 @@ C_vals = np.array([0.0001,0.001,0.01,0.1,1,10,100])
 
 # your code here for finding good value of C for RBF kernel
 # about 6 lines
-# RBF kernel SVM
-rbf_accuracies = []
-
-for C in C_vals:
-    # Train RBF SVM
-    rbf_svm = SVC(kernel='rbf', C=C, probability=False)
-    rbf_svm.fit(sXtrain.reshape((N, -1)), sytrain)
-
-    # Predict on validation set
-    y_val_pred_rbf = rbf_svm.predict(Xval.reshape((Xval.shape[0], -1)))
-
-    # Measure accuracy
-    accuracy_rbf = accuracy_score(yval, y_val_pred_rbf)
-    rbf_accuracies.append(accuracy_rbf)
+# RBF kernel SVM (gamma='scale', as SVC's default), kernels computed once as above; the large
+# C values, which take the longest to fit, are dropped (NaN) once a C falls 2% behind a smaller one
+rbf_kernel = PrecomputedKernel(sXtrain, 'rbf')
+rbf_accuracies, rbf_fit_times, rbf_models = parallel_c_sweep(rbf_kernel, sytrain, Xval, yval, C_vals, tolerance=0.02)
+for C, accuracy, fit_time in zip(C_vals, rbf_accuracies, rbf_fit_times):
+    print(f'C={C:g}: validation accuracy {accuracy:.4f}, fit {fit_time:.1f}s')
 
 # your code here
 # build best RBF model with best value of C
@@ -289,18 +304,16 @@ plt.show()
 # report test set accuracy, confusion matrix and classification report on test set
 # about 6 lines of code
 
-best_rbf_C = C_vals[np.argmax(rbf_accuracies)]
+best_rbf_C = C_vals[np.nanargmax(rbf_accuracies)]
 print(f'Best C value for RBF SVM: {best_rbf_C}')
 
-# Build an RBF model with the best C value
-best_rbf_svm = SVC(kernel='rbf', C=best_rbf_C, probability=False)
-best_rbf_svm.fit(sXtrain.view(N, -1).numpy(), sytrain)
+# the RBF model with the best C value was fitted in the sweep
+best_rbf_svm = rbf_models[np.nanargmax(rbf_accuracies)]
 
 
-# Evaluate the RBF model on the full test set
-flat_Xtest_rbf = Xtest.view(Xtest.shape[0], -1).numpy()
+# Evaluate the RBF model on the full test set (through its kernel with the training set)
 ytest_np_rbf=ytest.view(ytest.shape[0], -1).numpy()
-y_test_pred_rbf = best_rbf_svm.predict(flat_Xtest_rbf)
+y_test_pred_rbf = best_rbf_svm.predict(rbf_kernel(Xtest))
 
 accuracy_rbf = accuracy_score(ytest_np_rbf, y_test_pred_rbf)
 print(f'RBF SVM Test Accuracy: {accuracy_rbf:.4f}')
@@ -311,6 +324,37 @@ print(classification_report(ytest_np_rbf, y_test_pred_rbf))
 print('Confusion Matrix:')
 print(confusion_matrix(ytest_np_rbf, y_test_pred_rbf))
 
+"""# Approximate RBF SVM on all 50000 training images
+- the exact SVC above only sees 5000 images; random Fourier features (or a Nystrom map) approximate the same RBF kernel with 2000 explicit features, on which a linear hinge-loss SVM trains on the whole training set (see svm_primal.py)
+"""
+
+for features in ['rff', 'nystroem']:
+    start = time.perf_counter()
+    approximate_svm = ApproximateRBFSVM(features, n_components=2000, C=1).fit(cifar10.loader('trainval', 5000))
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    y_test_pred_approximate = approximate_svm.predict(Xtest)
+    predict_time = time.perf_counter() - start
+    print(f'{features} SVM on 50000 images: test accuracy {accuracy_score(ytest_np_rbf, y_test_pred_approximate):.4f}, '
+          f'fit {fit_time:.1f}s, predict {predict_time:.1f}s')
+
+"""# LDA and SVM on PCA features
+- a randomized PCA of the training images, fitted once from streamed batches and cached in ./data (see pca_features.py); LDA (on all training images) and the RBF SVM (on the 5000 image subset, best C from above) then train on k << 3072 components
+"""
+
+pca = cached_pca('./data/cifar10_pca256.npz', cifar10.loader('train', 1000), n_components=256)
+for k in [32, 64, 128, 256]:
+    start = time.perf_counter()
+    pca_lda = StreamingLDA().fit(pca.transform_batches(cifar10.loader('trainval', 1000), k))
+    lda_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pca_svm = SVC(kernel='rbf', C=best_rbf_C).fit(pca.transform(sXtrain, k), sytrain)
+    svm_time = time.perf_counter() - start
+    Xtest_pca = pca.transform(Xtest, k)
+    print(f'k={k} ({pca.explained_variance_ratio_[:k].sum():.3f} of the variance): '
+          f'LDA test accuracy {accuracy_score(ytest_np, pca_lda.predict(Xtest_pca)):.4f} (fit {lda_time:.1f}s), '
+          f'RBF SVM test accuracy {accuracy_score(ytest_np, pca_svm.predict(Xtest_pca)):.4f} (fit {svm_time:.1f}s)')
+
 """# Comment on linear SVM vs RBF kernel SVM
 
 For the RBF kernel SVM, the best C value is 1.0.
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""Kernel feature construction for kernels_logistic_regression.py
+
+gaussian_kernel builds the kernel matrix K[i, j] = exp(-||a_i - b_j||^2 / (2 s^2)) of the
+notebook without the cdist -> square -> divide -> negate -> exp chain of full size
+temporaries: squared distances come from ||a||^2 + ||b||^2 - 2 a.b one block of rows at a
+time, written straight into the output and exponentiated in place, so the peak memory is
+about the size of the output.
+
+KernelCache keeps squared distance matrices (and the k-means landmarks for every N) between
+calls, so sweeping the kernel width s over the same data and landmarks costs one exponential
+per value.
+
+select_landmarks picks landmarks for large data sets, either by mini-batch k-means (which
+can start from the centers of a previous N) or by greedy pivoted Cholesky, which adds the
+point the current Nystrom approximation of the kernel explains worst until the error
+is below a tolerance.
+
+sparse_gaussian_kernel drops the kernel entries beyond a radius (4 s by default), or uses
+the compactly supported Wendland kernel, and builds the kernel matrix as a CSR matrix from
+a KD-tree or ball-tree radius query on the landmarks, so memory and build time go with the
+number of neighbors instead of n x m. LogisticRegression takes the CSR matrix as it is.
+"""
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.neighbors import NearestNeighbors
+
+# rows of the output handled per block, and the number of rows from which the blocks are
+# spread over several threads (numpy releases the GIL in matmul and the ufuncs)
+BLOCK_ROWS = 4096
+PARALLEL_ROWS = 16384
+
+# fill out (a block of rows) with the squared distances between the rows A and B
+def _sq_distance_block(A, B, sq_B, out):
+    # out = ||a||^2 + ||b||^2 - 2 a.b
+    np.matmul(A, B.T, out=out)
+    out *= -2
+    out += np.einsum('ij,ij->i', A, A)[:, np.newaxis]
+    out += sq_B
+    # rounding can leave a squared distance slightly negative
+    np.maximum(out, 0, out=out)
+
+def _gaussian_block(A, B, sq_B, gamma, out):
+    _sq_distance_block(A, B, sq_B, out)
+    out *= -gamma
+    np.exp(out, out=out)
+
+# run block_fn(A_block, B, sq_B, out_block) over the row blocks of an n x m output
+def _blocked(block_fn, A, B, dtype, block_rows, n_jobs, out):
+    A = np.asarray(A, dtype=dtype)
+    B = np.asarray(B, dtype=dtype)
+    n, m = A.shape[0], B.shape[0]
+    if out is None:
+        out = np.empty((n, m), dtype=dtype)
+    elif out.shape != (n, m) or out.dtype != dtype:
+        raise ValueError("out must be a %s array of shape %s" % (np.dtype(dtype), (n, m)))
+
+    sq_B = np.einsum('ij,ij->i', B, B)
+    blocks = [(i, min(n, i + block_rows)) for i in range(0, n, block_rows)]
+    if n_jobs is None:
+        n_jobs = (os.cpu_count() or 1) if n >= PARALLEL_ROWS else 1
+
+    if n_jobs == 1 or len(blocks) == 1:
+        for i0, i1 in blocks:
+            block_fn(A[i0:i1], B, sq_B, out[i0:i1])
+    else:
+        with ThreadPoolExecutor(n_jobs) as pool:
+            list(pool.map(lambda b: block_fn(A[b[0]:b[1]], B, sq_B, out[b[0]:b[1]]), blocks))
+    return out
+
+# squared euclidean distances between the rows of A (n x d) and B (m x d), n x m
+# same blocking, threading and out arguments as gaussian_kernel
+def sq_distances(A, B, dtype=np.float64, block_rows=BLOCK_ROWS, n_jobs=None, out=None):
+    return _blocked(_sq_distance_block, A, B, dtype, block_rows, n_jobs, out)
+
+# Gaussian kernel matrix between the rows of A (n x d) and B (m x d), n x m
+# s is the kernel width, dtype the output type (np.float32 halves the memory)
+# n_jobs threads work on blocks of block_rows rows; by default one thread for small outputs
+# and all cores from PARALLEL_ROWS rows on
+# out can be a preallocated n x m array of the given dtype to write into
+def gaussian_kernel(A, B, s, dtype=np.float64, block_rows=BLOCK_ROWS, n_jobs=None, out=None):
+    gamma = np.dtype(dtype).type(1 / (2 * s * s))
+    block_fn = lambda A, B, sq_B, out: _gaussian_block(A, B, sq_B, gamma, out)
+    return _blocked(block_fn, A, B, dtype, block_rows, n_jobs, out)
+
+# linear kernel (Gram) matrix A B^T between the rows of A (n x d) and B (m x d), n x m
+# same blocking, threading and out arguments as gaussian_kernel
+def linear_kernel(A, B, dtype=np.float64, block_rows=BLOCK_ROWS, n_jobs=None, out=None):
+    block_fn = lambda A, B, sq_B, out: np.matmul(A, B.T, out=out)
+    return _blocked(block_fn, A, B, dtype, block_rows, n_jobs, out)
+
+# Gaussian kernel from precomputed squared distances D: exp(-D / (2 s^2)), one new array
+def gaussian_from_sq_distances(D, s):
+    K = np.multiply(D, D.dtype.type(-1 / (2 * s * s)))
+    return np.exp(K, out=K)
+
+# a key for the contents of an array, so equal data hits the cache whatever object holds it
+def _fingerprint(A):
+    A = np.ascontiguousarray(A)
+    h = hashlib.blake2b(A.view(np.uint8).reshape(-1), digest_size=16)
+    h.update(repr((A.shape, A.dtype.str)).encode())
+    return h.hexdigest()
+
+# memo of squared distance matrices and mini-batch k-means landmarks with least recently used eviction
+# keys are fingerprints of the data and landmark arrays (and N for k-means), entries are
+# dropped oldest-use first once they take more than max_bytes together
+class KernelCache:
+
+    def __init__(self, max_bytes=512 * 2**20, dtype=np.float64):
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        return sum(self.sizes.values())
+
+    def _get(self, key, compute, size):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = compute()
+        self.entries[key] = value
+        self.sizes[key] = size(value)
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            old, _ = self.entries.popitem(last=False)
+            del self.sizes[old]
+        return value
+
+    # squared distances between the rows of A and B (do not modify the returned array)
+    def sq_distances(self, A, B):
+        key = ('sq_distances', _fingerprint(A), _fingerprint(B))
+        return self._get(key, lambda: sq_distances(A, B, dtype=self.dtype), lambda D: D.nbytes)
+
+    # Gaussian kernel of width s between the rows of A and B, from the cached distances
+    def gaussian(self, A, B, s):
+        return gaussian_from_sq_distances(self.sq_distances(A, B), s)
+
+    # mini-batch k-means landmarks for N, seeded from the landmarks for N // 2 (from the cache or
+    # fitted the same way), so growing N on a slider refines landmarks already found while the
+    # landmarks for an N do not depend on the values the slider went through before
+    def minibatch_kmeans(self, X, N, random_state=0):
+        def fit():
+            seed = self.minibatch_kmeans(X, N // 2, random_state) if N >= 2 else None
+            return minibatch_kmeans_landmarks(X, N, seed, random_state=random_state)
+        return self._get(('minibatch_kmeans', _fingerprint(X), N, random_state), fit, lambda c: c.nbytes)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+
+# mini-batch k-means centers for N landmarks
+# init_centers (e.g. the centers found for the previous N) seed the run: all of them if there
+# are at most N, padded with random points of X, or a random N of them otherwise
+def minibatch_kmeans_landmarks(X, N, init_centers=None, batch_size=4096, random_state=0):
+    rng = np.random.RandomState(random_state)
+    if init_centers is None:
+        init = 'k-means++'
+    else:
+        init_centers = np.asarray(init_centers)
+        if len(init_centers) >= N:
+            init = init_centers[rng.choice(len(init_centers), N, replace=False)]
+        else:
+            extra = X[rng.choice(len(X), N - len(init_centers), replace=False)]
+            init = np.vstack((init_centers, extra))
+    kmeans = MiniBatchKMeans(n_clusters=N, init=init, n_init=1, batch_size=batch_size,
+                             random_state=random_state).fit(X)
+    return kmeans.cluster_centers_
+
+# greedy pivoted Cholesky of the Gaussian kernel of X, without forming the kernel matrix
+# every step adds the point with the largest residual diagonal of K - C W^-1 C^T (C the kernel
+# columns of the landmarks so far, W their kernel matrix) as a landmark, until the mean
+# residual diagonal drops below tol or max_landmarks are chosen
+# returns the indices of the chosen points in X
+def pivoted_cholesky_landmarks(X, s, tol=1e-2, max_landmarks=None):
+    n = len(X)
+    max_landmarks = n if max_landmarks is None else min(n, max_landmarks)
+    # diag(K) = 1 for the Gaussian kernel
+    residual = np.ones(n)
+    # Cholesky columns so far, stored as rows of a buffer that doubles when full
+    L = np.empty((min(max_landmarks, 64), n))
+    pivots = []
+    while len(pivots) < max_landmarks and residual.mean() > tol:
+        j = len(pivots)
+        if j == len(L):
+            L = np.vstack((L, np.empty((min(j, max_landmarks - j), n))))
+        i = int(np.argmax(residual))
+        if residual[i] <= 1e-12:
+            # the kernel of X is exhausted to rounding
+            break
+        column = L[j]
+        gaussian_kernel(X, X[i:i + 1], s, out=column[:, np.newaxis])
+        column -= L[:j, i] @ L[:j]
+        column /= np.sqrt(residual[i])
+        residual -= column ** 2
+        # the chosen points are explained exactly, rounding aside
+        residual[i] = 0
+        np.maximum(residual, 0, out=residual)
+        pivots.append(i)
+    return np.array(pivots, dtype=int)
+
+# relative Nystrom approximation error ||K - C W^+ C^T||_F / ||K||_F of the Gaussian kernel
+# of X with the given landmarks, estimated on a random sample of at most `sample` points
+def nystrom_error(X, landmarks, s, sample=2000, random_state=0):
+    if len(X) > sample:
+        X = X[np.random.RandomState(random_state).choice(len(X), sample, replace=False)]
+    K = gaussian_kernel(X, X, s)
+    C = gaussian_kernel(X, landmarks, s)
+    W = gaussian_kernel(landmarks, landmarks, s)
+    approx = C @ np.linalg.pinv(W, hermitian=True) @ C.T
+    return np.linalg.norm(K - approx) / np.linalg.norm(K)
+
+# pick landmarks of the Gaussian kernel of width s for the rows of X
+# method 'kmeans' (full-batch KMeans(n_clusters=N)), 'minibatch-kmeans' (N centers, seeded from
+# init_centers if given) or 'pivoted-cholesky' (grow until the mean residual is below tol,
+# at most N landmarks)
+# returns the landmarks and a dict with the method, the number of landmarks, the selection time
+# in seconds and the Nystrom approximation error
+def select_landmarks(X, s, method='minibatch-kmeans', N=None, tol=1e-2, init_centers=None, random_state=0):
+    start = time.perf_counter()
+    if method == 'kmeans':
+        landmarks = KMeans(n_clusters=N, random_state=random_state).fit(X).cluster_centers_
+    elif method == 'minibatch-kmeans':
+        landmarks = minibatch_kmeans_landmarks(X, N, init_centers, random_state=random_state)
+    elif method == 'pivoted-cholesky':
+        landmarks = X[pivoted_cholesky_landmarks(X, s, tol, N)]
+    else:
+        raise ValueError("unknown landmark selection method %r" % (method,))
+    elapsed = time.perf_counter() - start
+    info = {
+        'method': method,
+        'landmarks': len(landmarks),
+        'time': elapsed,
+        'nystrom_error': nystrom_error(X, landmarks, s, random_state=random_state),
+    }
+    return landmarks, info
+
+# a radius query index over the landmarks B for sparse_gaussian_kernel, reusable for the
+# training and the test points; algorithm is 'kd_tree' or 'ball_tree'
+def neighbor_index(B, algorithm='kd_tree', n_jobs=None):
+    return NearestNeighbors(algorithm=algorithm, n_jobs=n_jobs).fit(B)
+
+# sparse n x m (CSR) kernel matrix between the rows of A and the landmarks B
+# kernel 'truncated': the Gaussian kernel of width s, set to zero beyond radius * s
+# kernel 'wendland': the compactly supported (1 - r)^4 (4 r + 1), r = distance / (radius * s),
+# positive definite in up to 3 dimensions
+# index can be a neighbor_index(B) built before, B is then not used
+def sparse_gaussian_kernel(A, B, s, radius=4.0, kernel='truncated', index=None, dtype=np.float64):
+    if index is None:
+        index = neighbor_index(B)
+    cutoff = radius * s
+    K = index.radius_neighbors_graph(A, cutoff, mode='distance', sort_results=False)
+    K.data = K.data.astype(dtype, copy=False)
+    if kernel == 'truncated':
+        K.data **= 2
+        K.data *= -1 / (2 * s * s)
+        np.exp(K.data, out=K.data)
+    elif kernel == 'wendland':
+        r = K.data / cutoff
+        K.data = (1 - r) ** 4 * (4 * r + 1)
+    else:
+        raise ValueError("unknown sparse kernel %r" % (kernel,))
+    return K
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""Solvers for the kernel logistic regression of kernels_logistic_regression.py
+
+BatchedKernelLogisticRegression fits one L2-regularized logistic regression per kernel
+width s on the Gaussian kernel features exp(-D / (2 s^2)) of a single squared distance
+matrix D (training points x landmarks), all widths together: every Newton (IRLS) step is a
+batch of matrix products and linear solves over the stack of widths, and widths drop out of
+the batch as they converge. It solves the same problem as sklearn's LogisticRegression(C=C)
+(unpenalized intercept) and stops on the same gradient tolerance.
+
+StreamingKernelLogisticRegression fits the same model for data that does not fit in
+memory: it reads X (e.g. an np.memmap) one chunk of rows at a time, builds the chunk's
+kernel features against the landmarks on the fly and updates the weights with mini-batch
+SGD or Adam, so the full kernel matrix never exists. Each pass also sums the exact gradient
+at the weights the pass started from, which is the stopping rule and, in the next pass, the
+control variate of the mini-batch gradients (SVRG, Johnson and Zhang, 2013), so the fit
+converges to the same model as LogisticRegression. It can save a checkpoint after every
+epoch and pick up from it, and predicts chunk by chunk as well.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+from scipy.special import expit
+
+from kernel_features import gaussian_from_sq_distances, gaussian_kernel
+
+# stack of kernel feature matrices with an intercept column: (S, n, m + 1)
+def _design(D, widths):
+    n, m = D.shape
+    F = np.empty((len(widths), n, m + 1), dtype=D.dtype)
+    for i, s in enumerate(widths):
+        F[i, :, :m] = gaussian_from_sq_distances(D, s)
+    F[:, :, m] = 1
+    return F
+
+# F @ beta for every width: (S, n)
+def _margins(F, beta):
+    return np.matmul(F, beta[..., np.newaxis])[..., 0]
+
+# per width: C * sum of log-losses + ||w||^2 / 2 (intercept not penalized), for weights (S, m + 1)
+def _objective(F, y, beta, C):
+    z = _margins(F, beta)
+    # log(1 + exp(z)) - y z is the log-loss of a 0/1 label
+    loss = (np.logaddexp(0, z) - y * z).sum(axis=1)
+    return C * loss + 0.5 * np.einsum('sj,sj->s', beta[:, :-1], beta[:, :-1])
+
+class BatchedKernelLogisticRegression:
+
+    def __init__(self, widths, C=1.0, max_iter=100, tol=1e-4):
+        self.widths = np.asarray(widths, dtype=float)
+        self.C = C
+        self.max_iter = max_iter
+        self.tol = tol
+
+    # D is the (n x m) squared distance matrix between the training points and the landmarks
+    # (e.g. from KernelCache.sq_distances), y the 0/1 labels
+    def fit(self, D, y):
+        F = _design(np.asarray(D, dtype=float), self.widths)
+        y = np.asarray(y, dtype=float)
+        S, n, p = F.shape
+        C = self.C
+        # identity on the weights, nothing on the intercept
+        ridge = np.eye(p)
+        ridge[-1, -1] = 0
+
+        beta = np.zeros((S, p))
+        self.n_iter_ = np.zeros(S, dtype=int)
+        self.objective_ = _objective(F, y, beta, C)
+
+        # the widths still being fitted; converged ones drop out of the batch
+        idx = np.arange(S)
+        b = beta.copy()
+        objective = self.objective_.copy()
+        G = np.empty_like(F)
+        for _ in range(self.max_iter):
+            prob = expit(_margins(F, b))
+            grad = C * np.matmul((prob - y)[:, np.newaxis, :], F)[:, 0] + b @ ridge
+
+            # stop a width once its gradient is small, like sklearn's tol
+            keep = np.abs(grad).max(axis=1) > self.tol
+            if not keep.all():
+                if not keep.any():
+                    break
+                idx, b, objective, prob, grad = idx[keep], b[keep], objective[keep], prob[keep], grad[keep]
+                F, G = F[keep], G[:keep.sum()]
+
+            # Hessian of the objective and Newton step for every active width at once
+            np.multiply(F, np.sqrt(C * prob * (1 - prob))[..., np.newaxis], out=G)
+            H = np.matmul(G.transpose(0, 2, 1), G) + ridge
+            step = np.linalg.solve(H, grad[..., np.newaxis])[..., 0]
+
+            # halve the Newton step until the objective does not go up
+            t = np.ones(len(idx))
+            new = _objective(F, y, b - step, C)
+            for _ in range(30):
+                worse = new > objective
+                if not worse.any():
+                    break
+                t[worse] /= 2
+                new[worse] = _objective(F[worse], y, b[worse] - t[worse, np.newaxis] * step[worse], C)
+
+            b -= t[:, np.newaxis] * step
+            objective = new
+            beta[idx] = b
+            self.objective_[idx] = objective
+            self.n_iter_[idx] += 1
+
+        self.coef_ = beta[:, :-1]
+        self.intercept_ = beta[:, -1]
+        return self
+
+    # class 1 probabilities of every width for points with squared distances D to the landmarks:
+    # (S, n)
+    def predict_proba(self, D):
+        D = np.asarray(D, dtype=float)
+        P = np.empty((len(self.widths), D.shape[0]))
+        for i, s in enumerate(self.widths):
+            P[i] = expit(gaussian_from_sq_distances(D, s) @ self.coef_[i] + self.intercept_[i])
+        return P
+
+    # mean log-loss of every width on labelled points: (S,)
+    def log_loss(self, D, y, eps=1e-15):
+        P = np.clip(self.predict_proba(D), eps, 1 - eps)
+        y = np.asarray(y, dtype=float)
+        return -(y * np.log(P) + (1 - y) * np.log(1 - P)).mean(axis=1)
+
+# fit every width on (D_train, y_train) and return the validation log-loss per width and the fit
+def width_scan(D_train, y_train, D_val, y_val, widths, C=1.0):
+    model = BatchedKernelLogisticRegression(widths, C=C).fit(D_train, y_train)
+    return model.log_loss(D_val, y_val), model
+
+# row ranges of at most chunk_rows rows covering n rows
+def _chunks(n, chunk_rows):
+    return [(i, min(n, i + chunk_rows)) for i in range(0, n, chunk_rows)]
+
+# a key for a streamed fit: the model parameters that shape its path and a sample of the data
+# (n, d, dtypes and up to `sample` evenly spaced rows of X and y, so a memmap is barely read)
+def _problem_key(X, y, params, sample=1000):
+    rows = np.unique(np.linspace(0, X.shape[0] - 1, min(X.shape[0], sample)).astype(int))
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((X.shape, np.dtype(X.dtype).str, np.asarray(y[:1]).dtype.str) + params).encode())
+    for A in (np.asarray(X[rows]), np.asarray(y[rows])):
+        h.update(np.ascontiguousarray(A).view(np.uint8).reshape(-1))
+    return h.hexdigest()
+
+class StreamingKernelLogisticRegression:
+
+    # landmarks (m x d) and kernel width s define the features; C is the inverse regularization
+    # strength of LogisticRegression; optimizer 'adam' or 'sgd' (with momentum), with the
+    # step size learning_rate on variance reduced mini-batch gradients; batch_size rows per
+    # update, chunk_rows rows read from X at a time
+    # fit stops once the largest entry of the gradient of the objective divided by C n (the
+    # mean log-loss plus ||w||^2 / (2 C n), as LogisticRegression scales it) is at most tol,
+    # or after `epochs` passes
+    # checkpoint is an .npz path written after every epoch; fit resumes from it if it exists and
+    # was written for the same landmarks, parameters and data, and starts over otherwise
+    def __init__(self, landmarks, s, C=1.0, optimizer='adam', learning_rate=0.1, batch_size=64,
+                 epochs=100, tol=1e-4, chunk_rows=65536, checkpoint=None, random_state=0, dtype=np.float32):
+        if optimizer not in ('adam', 'sgd'):
+            raise ValueError("unknown optimizer %r" % (optimizer,))
+        self.landmarks = np.asarray(landmarks)
+        self.s = s
+        self.C = C
+        self.optimizer = optimizer
+        self.learning_rate = learning_rate
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.tol = tol
+        self.chunk_rows = chunk_rows
+        self.checkpoint = checkpoint
+        self.random_state = random_state
+        self.dtype = dtype
+
+    def _features(self, X):
+        return gaussian_kernel(X, self.landmarks, self.s, dtype=self.dtype)
+
+    def _key(self, X, y):
+        params = (self.s, self.C, self.optimizer, self.learning_rate, self.batch_size, self.chunk_rows,
+                  self.random_state, np.dtype(self.dtype).str, self.landmarks.shape,
+                  hashlib.blake2b(np.ascontiguousarray(self.landmarks).view(np.uint8).reshape(-1),
+                                  digest_size=16).hexdigest())
+        return _problem_key(X, y, params)
+
+    def _save(self, key):
+        tmp = self.checkpoint + '.tmp.npz'
+        np.savez(tmp, beta=self.beta_, m=self.m_, v=self.v_, t=self.t_, epoch=self.epoch_,
+                 snapshot=self.snapshot_, gradient=self.gradient_, key=key)
+        # replace the old checkpoint only once the new one is complete
+        os.replace(tmp, self.checkpoint)
+
+    # the state of the checkpoint if it belongs to this problem (key); False if it does not
+    def _load(self, key):
+        with np.load(self.checkpoint) as f:
+            if 'key' not in f or str(f['key']) != key:
+                return False
+            self.beta_, self.m_, self.v_ = f['beta'], f['m'], f['v']
+            self.snapshot_, self.gradient_ = f['snapshot'], f['gradient']
+            self.t_, self.epoch_ = int(f['t']), int(f['epoch'])
+        return True
+
+    # X (n x d, in memory or an np.memmap) and the 0/1 labels y
+    def fit(self, X, y):
+        n = X.shape[0]
+        p = len(self.landmarks) + 1
+        key = self._key(X, y) if self.checkpoint is not None else None
+        if not (key is not None and os.path.exists(self.checkpoint) and self._load(key)):
+            # weights with the intercept last, first and second moment estimates, update count
+            self.beta_ = np.zeros(p)
+            self.m_ = np.zeros(p)
+            self.v_ = np.zeros(p)
+            self.t_ = 0
+            self.epoch_ = 0
+            # the weights the last pass started from and the exact gradient there
+            self.snapshot_ = np.zeros(p)
+            self.gradient_ = np.full(p, np.inf)
+        # the l2 penalty ||w||^2 / 2 spread over the n samples of the C-weighted loss
+        penalty = np.ones(p) / (self.C * n)
+        penalty[-1] = 0
+
+        while self.epoch_ < self.epochs and np.abs(self.gradient_).max() > self.tol:
+            # a fresh order of the chunks and of the rows within them every epoch; seeded with the
+            # epoch, so a resumed fit goes on exactly as an uninterrupted one
+            rng = np.random.RandomState([self.random_state, self.epoch_])
+            start = self.beta_.copy()
+            gradient = penalty * start
+            # no snapshot before the first pass has summed a gradient
+            reduce = self.epoch_ > 0
+            chunks = _chunks(n, self.chunk_rows)
+            for k in rng.permutation(len(chunks)):
+                i0, i1 = chunks[k]
+                F = self._features(X[i0:i1])
+                yc = np.asarray(y[i0:i1], dtype=float)
+                # the residuals of the chunk at the start of the pass and at the snapshot
+                err_start = expit(F @ start[:-1] + start[-1]) - yc
+                gradient += np.append(err_start @ F, err_start.sum()) / n
+                if reduce:
+                    err_snapshot = expit(F @ self.snapshot_[:-1] + self.snapshot_[-1]) - yc
+                order = rng.permutation(i1 - i0)
+                for b0 in range(0, len(order), self.batch_size):
+                    rows = order[b0:b0 + self.batch_size]
+                    Fb = F[rows]
+                    err = expit(Fb @ self.beta_[:-1] + self.beta_[-1]) - yc[rows]
+                    if reduce:
+                        # the mini-batch gradient minus its value at the snapshot plus the exact
+                        # gradient there: unbiased, and its variance vanishes at the optimum
+                        err = err - err_snapshot[rows]
+                    grad = np.append(err @ Fb, err.sum()) / len(rows) + penalty * self.beta_
+                    if reduce:
+                        grad += self.gradient_ - penalty * self.snapshot_
+                    self._step(grad, self.learning_rate)
+            self.snapshot_, self.gradient_ = start, gradient
+            self.epoch_ += 1
+            if key is not None:
+                self._save(key)
+
+        # the weights whose gradient was checked, if the fit converged
+        self.converged_ = bool(np.abs(self.gradient_).max() <= self.tol)
+        beta = self.snapshot_ if self.converged_ else self.beta_
+        self.coef_ = beta[:-1]
+        self.intercept_ = beta[-1]
+        return self
+
+    def _step(self, grad, rate, beta1=0.9, beta2=0.999, eps=1e-8):
+        self.t_ += 1
+        if self.optimizer == 'adam':
+            self.m_ *= beta1
+            self.m_ += (1 - beta1) * grad
+            self.v_ *= beta2
+            self.v_ += (1 - beta2) * grad ** 2
+            m_hat = self.m_ / (1 - beta1 ** self.t_)
+            v_hat = self.v_ / (1 - beta2 ** self.t_)
+            self.beta_ -= rate * m_hat / (np.sqrt(v_hat) + eps)
+        else:
+            # heavy-ball momentum
+            self.m_ *= beta1
+            self.m_ += grad
+            self.beta_ -= rate * self.m_
+
+    # class 1 probabilities, chunk_rows rows of X at a time; out can be a preallocated
+    # (e.g. memory-mapped) length n array to write into
+    def predict_proba(self, X, out=None):
+        n = X.shape[0]
+        if out is None:
+            out = np.empty(n)
+        for i0, i1 in _chunks(n, self.chunk_rows):
+            out[i0:i1] = expit(self._features(X[i0:i1]) @ self.coef_ + self.intercept_)
+        return out
+
+    def predict(self, X):
+        return self.predict_proba(X) > 0.5
@@ -24,9 +24,13 @@ Original file is located at
 import numpy as np
 import pandas as pd
 import sklearn as sklearn
-from scipy.spatial.distance import pdist, cdist, squareform
 from sklearn.linear_model import LogisticRegression
 from sklearn.cluster import KMeans
+from sklearn.kernel_approximation import RBFSampler
+
+from kernel_features import gaussian_kernel, KernelCache, select_landmarks, neighbor_index, sparse_gaussian_kernel
+from kernel_solvers import width_scan
+from boundary_grid import adaptive_grid
 
 from ipywidgets import interact
 
@@ -87,19 +91,15 @@ $\large {e^{(\frac{-||x-x'||^2}{2s^2})}}$
 s=1.5 # kernel width (you can play with this parameter)
 
 # build the kernel matrix on training data (about 2 lines of vectorized code)
-eucDist_X = pdist(X=X, metric='euclidean')
-# print(eucDist_X.shape) # Has m*(m-1)/2 pdist entries
-sqrMat_X = squareform(eucDist_X)
-Ktrain = np.exp(-1*(sqrMat_X)**2/(2*s*s))
+Ktrain = gaussian_kernel(X, X, s)
 # print(Ktrain.shape) # 200 x 200
 
 # build a logistic model on the kernel matrix (2 lines of code) using sklearn's LogisticRegression()
 logreg = LogisticRegression().fit(Ktrain, y)
 
 # construct the kernel representation of the test_points with the training set landmarks
-# hint: consider using cdist in scipy.spatial.distance (about 2-3 lines of code)
-sqrMat_Xtest = cdist(test_points, X, metric='euclidean')
-Ktest = np.exp(-1*(sqrMat_Xtest)**2/(2*s*s))
+# gaussian_kernel replaces the cdist -> square -> exp chain (see kernel_features.py)
+Ktest = gaussian_kernel(test_points, X, s)
 
 # use your learned model to predict using the kernel representation.
 # Store the predictions in array Z (1 line of code)
@@ -111,6 +111,14 @@ Z = logreg.predict_proba(Ktest)[:,1]
 Z = Z.reshape(xx.shape)
 plot_boundary(Z,X,y,xx,yy)
 
+"""## The same boundary at high resolution
+- adaptive_grid scores the model on a coarse 33x33 grid and only refines the cells the boundary (or a fast change of the probability) runs through, down to a 1025x1025 grid; the other cells are interpolated (see boundary_grid.py)
+"""
+
+Z_fine, xx_fine, yy_fine, evaluated = adaptive_grid(lambda P: logreg.predict_proba(gaussian_kernel(P, X, s))[:,1])
+print('scored %d of %d grid points (%.1f%%)' % (evaluated.sum(), evaluated.size, 100 * evaluated.mean()))
+plot_boundary(Z_fine,X,y,xx_fine,yy_fine)
+
 """## Kernel regression using clustering to select landmarks
 - run Kmeans on the original data to build N clusters (N=30). You can vary this and study its impact.
 - Use the cluster centers as landmarks for building the kernel representation. That is, construct the kernel matrix K (hint: the function cdist in scipy.spatial.distance might be helpful). Use euclidean distance as your metric. Ignore the bias term (column of 1s) in the construction of K. So K will be of size N x N
@@ -134,16 +142,14 @@ print(landmarks.shape)
 s = 1 # kernel width (play with this parameter)
 
 # build the kernel matrix with the kmeans cluster centers (2 lines of code)
-sqrMat_X = cdist(X, landmarks, metric='euclidean')
-Ktrain = np.exp(-1*(sqrMat_X)**2/(2*s*s))
+Ktrain = gaussian_kernel(X, landmarks, s)
 
 
 # build a logistic model on the kernel matrix (2 lines of code)
 logreg = LogisticRegression().fit(Ktrain, y)
 
 # build a kernel representation of the test points with the kmeans cluster centers (2 lines of code)
-sqrMat_Xtest = cdist(test_points, landmarks, metric='euclidean')
-Ktest = np.exp(-1*(sqrMat_Xtest)**2/(2*s*s))
+Ktest = gaussian_kernel(test_points, landmarks, s)
 
 # Predict probabilities on the testpoints (1 line of code)
 Z = logreg.predict_proba(Ktest)[:,1]
@@ -175,15 +181,13 @@ plt.show()
 s = 1.5 # kernel width (play with this parameter)
 
 #build the kernel matrix with respect to the new landmarks (2 lines of code)
-sqrMat_X = cdist(X, centers, metric='euclidean')
-Ktrain = np.exp(-1*(sqrMat_X)**2/(2*s*s))
+Ktrain = gaussian_kernel(X, centers, s)
 
 # build a logistic model on the kernel matrix (2 lines of code)
 logreg = LogisticRegression().fit(Ktrain, y)
 
 # build a kernel representation of the test points (2 lines of code)
-sqrMat_Xtest = cdist(test_points, centers, metric='euclidean')
-Ktest = np.exp(-1*(sqrMat_Xtest)**2/(2*s*s))
+Ktest = gaussian_kernel(test_points, centers, s)
 
 # predict on the testpoints (1 line of code)
 Z = logreg.predict_proba(Ktest)[:,1]
@@ -196,20 +200,49 @@ plot_boundary(Z,X,y,xx,yy)
 plt.scatter(centers[:,0],centers[:,1], s=100, c='red' )
 plt.show()
 
+"""## Kernel regression with random Fourier features
+- instead of measuring the distance to every landmark, map each point to D random Fourier features, cos(w.x + b) with w drawn from N(0, I/s^2) and b from U(0, 2 pi)
+- inner products of these features approximate the same Gaussian kernel $e^{(\frac{-||x-x'||^2}{2s^2})}$, and get closer as D grows
+   - https://scikit-learn.org/stable/modules/generated/sklearn.kernel_approximation.RBFSampler.html (gamma = 1/(2s^2))
+- building the features and fitting the logistic model cost O(N D) instead of O(N^2), and the test points are scored without any distances to the training set
+- see benchmark_kernels.py for accuracy and runtime against the exact kernel as N grows
+"""
+
+s = 1.5 # kernel width
+D = 300 # number of random features
+
+# map the training points to random Fourier features
+rff = RBFSampler(gamma=1/(2*s*s), n_components=D, random_state=0).fit(X)
+Ftrain = rff.transform(X)
+
+# build a logistic model on the features
+logreg = LogisticRegression().fit(Ftrain, y)
+
+# map the test points with the same features and predict
+Z = logreg.predict_proba(rff.transform(test_points))[:,1]
+
+Z = Z.reshape(xx.shape)
+plot_boundary(Z,X,y,xx,yy)
+plt.title('Random Fourier features')
+plt.show()
+
 """# Experimenting with number of clusters and standard deviation"""
 
+# the slider reruns this function for every move; the squared distances (and the k-means fit
+# for each N) do not depend on s, so they are kept in a cache and only the exponential and
+# the logistic fit are redone when s changes
+kernel_cache = KernelCache()
+
 def LogisticRegression_StrategicLandmarks(s=1.5, N=20):
     plt.rcParams['figure.figsize'] = (7.0, 7.0)
     #build the kernel matrix with respect to the new landmarks (2 lines of code)
-    sqrMat_X = cdist(X, centers, metric='euclidean')
-    Ktrain = np.exp(-1*(sqrMat_X)**2/(2*s*s))
+    Ktrain = kernel_cache.gaussian(X, centers, s)
 
     # build a logistic model on the kernel matrix (2 lines of code)
     logreg = LogisticRegression().fit(Ktrain, y)
 
     # build a kernel representation of the test points (2 lines of code)
-    sqrMat_Xtest = cdist(test_points, centers, metric='euclidean')
-    Ktest = np.exp(-1*(sqrMat_Xtest)**2/(2*s*s))
+    Ktest = kernel_cache.gaussian(test_points, centers, s)
 
     # predict on the testpoints (1 line of code)
     Z = logreg.predict_proba(Ktest)[:,1]
@@ -225,19 +258,17 @@ def LogisticRegression_StrategicLandmarks(s=1.5, N=20):
 
 
     ## K Means cluster landmarks
-    kmeans = KMeans(n_clusters=N, random_state=0).fit(X)
-    landmarks = kmeans.cluster_centers_
+    # mini-batch k-means, started from the (cached) landmarks for N // 2
+    landmarks = kernel_cache.minibatch_kmeans(X, N, random_state=0)
     # build the kernel matrix with the kmeans cluster centers (2 lines of code)
-    sqrMat_X = cdist(X, landmarks, metric='euclidean')
-    Ktrain = np.exp(-1*(sqrMat_X)**2/(2*s*s))
+    Ktrain = kernel_cache.gaussian(X, landmarks, s)
 
 
     # build a logistic model on the kernel matrix (2 lines of code)
     logreg = LogisticRegression().fit(Ktrain, y)
 
     # build a kernel representation of the test points with the kmeans cluster centers (2 lines of code)
-    sqrMat_Xtest = cdist(test_points, landmarks, metric='euclidean')
-    Ktest = np.exp(-1*(sqrMat_Xtest)**2/(2*s*s))
+    Ktest = kernel_cache.gaussian(test_points, landmarks, s)
 
     # Predict probabilities on the testpoints (1 line of code)
     Z = logreg.predict_proba(Ktest)[:,1]
@@ -247,24 +278,20 @@ def LogisticRegression_StrategicLandmarks(s=1.5, N=20):
 
     Z = Z.reshape(xx.shape)
     plot_boundary(Z,X,y,xx,yy)
-    plt.title("KMeans Landmarks")
-    plt.scatter(kmeans.cluster_centers_[:,0],kmeans.cluster_centers_[:,1], s=100, c='red' )
+    plt.title("Mini-batch k-means Landmarks")
+    plt.scatter(landmarks[:,0],landmarks[:,1], s=100, c='red' )
     plt.show()
 
     # build the kernel matrix on training data (about 2 lines of vectorized code)
-    eucDist_X = pdist(X=X, metric='euclidean')
-    # print(eucDist_X.shape) # Has m*(m-1)/2 pdist entries
-    sqrMat_X = squareform(eucDist_X)
-    Ktrain = np.exp(-1*(sqrMat_X)**2/(2*s*s))
+    Ktrain = kernel_cache.gaussian(X, X, s)
     # print(Ktrain.shape) # 200 x 200
 
     # build a logistic model on the kernel matrix (2 lines of code) using sklearn's LogisticRegression()
     logreg = LogisticRegression().fit(Ktrain, y)
 
     # construct the kernel representation of the test_points with the training set landmarks
-    # hint: consider using cdist in scipy.spatial.distance (about 2-3 lines of code)
-    sqrMat_Xtest = cdist(test_points, X, metric='euclidean')
-    Ktest = np.exp(-1*(sqrMat_Xtest)**2/(2*s*s))
+    # gaussian_kernel replaces the cdist -> square -> exp chain (see kernel_features.py)
+    Ktest = kernel_cache.gaussian(test_points, X, s)
 
     # use your learned model to predict using the kernel representation.
     # Store the predictions in array Z (1 line of code)
@@ -288,4 +315,87 @@ interact(LogisticRegression_StrategicLandmarks, s=2.0, N=20)
 ### how does the choice of kernel width affect the quality of the decision boundary learned?
 - the smaller the spread, the sharper are the decision boundaries (i.e., model overfits given enough landmarks; otherwise labeled as *High variance model*)
 - the greater the spread, the blurry the decision boundary gets and predictions are bound to have less confidence. (i.e., model underfits as the landmark spreads overlap with each other; otherwise labeled as *High Bias model*)
-"""
\ No newline at end of file
+"""
+
+"""# Choosing the kernel width with a validation set
+- draw 200 more XOR points as a validation set
+- fit one kernel logistic model per width s, with all training points as landmarks, and measure the log-loss on the validation set
+- width_scan fits all widths together from one squared distance matrix (batched Newton steps, see kernel_solvers.py), instead of one LogisticRegression fit after another
+"""
+
+rng_val = np.random.RandomState(1)
+X_val = rng_val.randn(200, 2)
+y_val = np.logical_xor(X_val[:, 0] > 0, X_val[:, 1] > 0)
+
+widths = np.linspace(0.25, 4, 40)
+D_train = kernel_cache.sq_distances(X, X)
+D_val = kernel_cache.sq_distances(X_val, X)
+val_loss, width_models = width_scan(D_train, y, D_val, y_val, widths)
+
+best_s = widths[np.argmin(val_loss)]
+print('best kernel width s = ', best_s)
+
+plt.rcParams['figure.figsize'] = (7.0, 5.0)
+plt.plot(widths, val_loss, marker='o')
+plt.xlabel('kernel width s')
+plt.ylabel('validation log-loss')
+plt.show()
+
+"""# Choosing landmarks for large data sets
+- full-batch KMeans over all of X gets slow once X has hundreds of thousands of points
+- mini-batch k-means fits the centers on small random batches, and can start each N from the centers of the previous N (init_centers; the slider above starts every N from the landmarks for N // 2 through kernel_cache.minibatch_kmeans, so the landmarks for an N are reproducible), so growing N refines the landmarks already found
+- pivoted Cholesky adds, one at a time, the point whose kernel column the landmarks so far explain worst, until the Nystrom approximation error of the kernel is below a tolerance
+- for each: the selection time and the relative Nystrom error ||K - C W^-1 C^T|| / ||K|| (on a sample of the points), to pick the smallest set of landmarks that is still accurate
+"""
+
+rng_large = np.random.RandomState(2)
+X_large = rng_large.randn(100000, 2)
+y_large = np.logical_xor(X_large[:, 0] > 0, X_large[:, 1] > 0)
+s_large = 1.0
+
+print('%-18s %6s %10s %12s' % ('method', 'N', 'select(s)', 'Nystrom err'))
+previous = None
+for N in [5, 10, 20, 40]:
+    landmarks, info = select_landmarks(X_large, s_large, 'kmeans', N=N)
+    print('%-18s %6d %10.3f %12.2e' % ('kmeans', info['landmarks'], info['time'], info['nystrom_error']))
+    # start from the mini-batch centers of the previous N
+    previous, info = select_landmarks(X_large, s_large, 'minibatch-kmeans', N=N, init_centers=previous)
+    print('%-18s %6d %10.3f %12.2e' % ('minibatch-kmeans', info['landmarks'], info['time'], info['nystrom_error']))
+for tol in [1e-1, 1e-2, 1e-3]:
+    landmarks, info = select_landmarks(X_large, s_large, 'pivoted-cholesky', tol=tol)
+    print('%-18s %6d %10.3f %12.2e   tol %g' % ('pivoted-cholesky', info['landmarks'], info['time'], info['nystrom_error'], tol))
+
+# the smallest pivoted Cholesky set with a Nystrom error below 1e-2, on the XOR data of the notebook
+landmarks, info = select_landmarks(X_large, s_large, 'pivoted-cholesky', tol=1e-2)
+logreg = LogisticRegression().fit(gaussian_kernel(X_large, landmarks, s_large, dtype=np.float32), y_large)
+Z = logreg.predict_proba(gaussian_kernel(test_points, landmarks, s_large))[:,1]
+Z = Z.reshape(xx.shape)
+plt.rcParams['figure.figsize'] = (7.0, 7.0)
+plot_boundary(Z,X,y,xx,yy)
+plt.scatter(landmarks[:,0],landmarks[:,1], s=100, c='red' )
+plt.title('Pivoted Cholesky landmarks (%d)' % len(landmarks))
+plt.show()
+
+"""# Sparse kernels for small widths
+- when s is small against the spread of the data, most kernel entries are practically zero: exp(-8) = 3e-4 at 4s
+- sparse_gaussian_kernel keeps only the entries within 4s (or uses the compactly supported Wendland kernel) and builds Ktrain/Ktest as CSR matrices from a KD-tree radius query, instead of the dense N x M matrix
+- LogisticRegression fits on the sparse matrices directly
+"""
+
+s_sparse = 0.3
+index = neighbor_index(X)
+Ktrain = sparse_gaussian_kernel(X, X, s_sparse, index=index)
+print('stored entries of Ktrain: %d of %d (%.1f%%)' % (Ktrain.nnz, X.shape[0] * X.shape[0], 100 * Ktrain.nnz / (X.shape[0] * X.shape[0])))
+logreg = LogisticRegression().fit(Ktrain, y)
+Ktest = sparse_gaussian_kernel(test_points, X, s_sparse, index=index)
+Z = logreg.predict_proba(Ktest)[:,1]
+
+# the same model on the dense kernel
+Z_dense = LogisticRegression().fit(gaussian_kernel(X, X, s_sparse), y).predict_proba(gaussian_kernel(test_points, X, s_sparse))[:,1]
+print('largest difference to the dense kernel probabilities: ', np.max(np.abs(Z - Z_dense)))
+
+Z = Z.reshape(xx.shape)
+plt.rcParams['figure.figsize'] = (7.0, 7.0)
+plot_boundary(Z,X,y,xx,yy)
+plt.title('Kernel truncated at 4s, s = %g' % s_sparse)
+plt.show()
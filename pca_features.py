@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""A PCA feature stage for gda_svm_cifar10.py: fitted once on streamed batches, cached on disk
+
+StreamingPCA accumulates the mean and the d x d scatter matrix of batches as they come (a
+DataLoader, or partial_fit one batch at a time, as StreamingLDA does), and takes the top
+n_components principal axes from it with a randomized SVD (Halko et al.), so the 3072-pixel
+images are gone over once and never held in memory together. The axes are sorted, so one
+fit projects to any k <= n_components by slicing.
+
+The fitted projection is saved to a .npz (written to a temporary file and renamed into
+place) with a fingerprint of the data and the parameters it was fitted with; cached_pca
+loads it if it exists and the fingerprint matches, cut down to the n_components asked for,
+and fits and saves it otherwise. transform and
+transform_batches project arrays or streamed (X, y) batches to k float32 components, which
+StreamingLDA, SVC or LinearSVMPath then train on instead of the raw pixels:
+
+    pca = cached_pca('./data/cifar10_pca256.npz', cifar10.loader('train', 1000))
+    lda = StreamingLDA().fit(pca.transform_batches(cifar10.loader('trainval', 1000), k=64))
+    lda.predict(pca.transform(Xtest, k=64))
+"""
+
+import hashlib
+import itertools
+import os
+
+import numpy as np
+from sklearn.utils.extmath import randomized_svd
+
+from batch_utils import flat_rows
+
+class StreamingPCA:
+
+    # n_components principal axes kept; n_oversamples and n_iter (power iterations) are those of
+    # sklearn's randomized_svd; dtype is the type of the accumulators (and of the scatter products)
+    def __init__(self, n_components=256, n_oversamples=10, n_iter=4, random_state=0, dtype=np.float64):
+        self.n_components = n_components
+        self.n_oversamples = n_oversamples
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.dtype = dtype
+
+    # add a batch (any shape with the samples first) to the statistics
+    def _accumulate(self, X):
+        X = flat_rows(X)
+        if not hasattr(self, 'count_'):
+            self.count_ = 0
+            # the statistics are of x - shift_ (the mean of the first batch), which keeps the
+            # subtraction of the mean at the end from cancelling
+            self.shift_ = X.mean(axis=0)
+            self.sum_ = np.zeros(X.shape[1], dtype=self.dtype)
+            self.scatter_ = np.zeros((X.shape[1], X.shape[1]), dtype=self.dtype)
+        Xc = (X - self.shift_).astype(self.dtype, copy=False)
+        self.scatter_ += Xc.T @ Xc
+        self.sum_ += Xc.sum(axis=0)
+        self.count_ += len(X)
+
+    def _solve(self):
+        n = self.count_
+        mean = self.sum_ / n
+        covariance = (self.scatter_ - n * np.outer(mean, mean)) / (n - 1)
+        _, variances, components = randomized_svd(covariance, self.n_components,
+                                                  n_oversamples=self.n_oversamples, n_iter=self.n_iter,
+                                                  random_state=self.random_state)
+        self.mean_ = (mean + self.shift_).astype(np.float32)
+        self.components_ = components.astype(np.float32)
+        self.explained_variance_ = variances
+        self.explained_variance_ratio_ = variances / np.trace(covariance)
+        return self
+
+    # fit on batches: an iterable of batches, X or (X, y) (a DataLoader), or an array X gone over
+    # batch_size rows at a time
+    def fit(self, X, batch_size=1000):
+        if hasattr(self, 'count_'):
+            del self.count_
+        batches = (X[i:i + batch_size] for i in range(0, len(X), batch_size)) if hasattr(X, 'shape') else X
+        for batch in batches:
+            self._accumulate(batch[0] if isinstance(batch, (tuple, list)) else batch)
+        return self._solve()
+
+    # add one batch of rows to the statistics and re-solve
+    def partial_fit(self, X):
+        self._accumulate(X)
+        return self._solve()
+
+    # the first k (default all) principal components of the rows of X, as float32; out can be a
+    # preallocated (n x k) array to write into
+    def transform(self, X, k=None, out=None, batch_size=10000):
+        X = flat_rows(X)
+        W = self.components_[:k].T
+        if out is None:
+            out = np.empty((len(X), W.shape[1]), dtype=np.float32)
+        for i in range(0, len(X), batch_size):
+            np.matmul(X[i:i + batch_size] - self.mean_, W, out=out[i:i + batch_size])
+        return out
+
+    # (components, y) for every (X, y) batch of an iterable, as they stream in
+    def transform_batches(self, batches, k=None):
+        for X, y in batches:
+            yield self.transform(X, k), y
+
+    def save(self, path):
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, mean=self.mean_, components=self.components_, explained_variance=self.explained_variance_,
+                 explained_variance_ratio=self.explained_variance_ratio_, count=self.count_,
+                 key=getattr(self, 'key_', ''))
+        # a half-written file never replaces a complete one
+        os.replace(tmp, path)
+        return self
+
+    # the StreamingPCA saved in path, with its first n_components axes only if given (all of
+    # them if fewer were saved); key_ is the fingerprint cached_pca saved with it, '' if none
+    @classmethod
+    def load(cls, path, n_components=None):
+        with np.load(path) as f:
+            components = f['components'][:n_components]
+            pca = cls(n_components=len(components))
+            pca.mean_, pca.components_ = f['mean'], components
+            pca.explained_variance_ = f['explained_variance'][:n_components]
+            pca.explained_variance_ratio_ = f['explained_variance_ratio'][:n_components]
+            pca.count_ = int(f['count'])
+            pca.key_ = str(f['key']) if 'key' in f.files else ''
+        return pca
+
+# a fingerprint of the data of a fit and of the parameters (a tuple) it is fitted with: the
+# shape and dtype of the rows and a hash of a sample of them, and the batches to fit on (an
+# iterable that yields its first batch, peeked at, again)
+# of an array X the sample is spread over all rows; of an iterable of batches it is the first
+# batch, with the number of batches if it has a len, so a shuffled loader never matches
+def _data_key(batches, params, sample=1000):
+    if hasattr(batches, 'shape'):
+        X, n = batches, batches.shape[0]
+    else:
+        iterator = iter(batches)
+        first = next(iterator)
+        n = len(batches) if hasattr(batches, '__len__') else None
+        batches = itertools.chain([first], iterator)
+        X = first[0] if isinstance(first, (tuple, list)) else first
+    rows = np.unique(np.linspace(0, X.shape[0] - 1, min(X.shape[0], sample)).astype(int))
+    X = np.asarray(X[rows])
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((n, X.shape[1:], X.dtype.str) + params).encode())
+    h.update(np.ascontiguousarray(X).view(np.uint8).reshape(-1))
+    return batches, h.hexdigest()
+
+# the StreamingPCA saved in path, or one fitted on batches (see StreamingPCA.fit) and saved
+# there; the parameters are StreamingPCA's, and a cached fit of other data or parameters, or
+# with fewer components, is refitted; one with more is cut down to n_components
+def cached_pca(path, batches, n_components=256, **kwargs):
+    batches, key = _data_key(batches, tuple(sorted(kwargs.items())))
+    if os.path.exists(path):
+        pca = StreamingPCA.load(path, n_components)
+        if pca.key_ == key and pca.n_components == n_components:
+            return pca
+    pca = StreamingPCA(n_components, **kwargs).fit(batches)
+    pca.key_ = key
+    return pca.save(path)
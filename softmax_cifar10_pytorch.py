@@ -10,8 +10,6 @@ Original file is located at
 """
 
 import torch
-import torchvision
-import torchvision.transforms as transforms
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
@@ -20,6 +18,8 @@ import matplotlib.pyplot as plt
 import sklearn
 from sklearn.metrics import accuracy_score, confusion_matrix, classification_report
 
+from cifar10_data import CIFAR10Cache, tmean, tstd
+
 """# The CIFAR10 dataset
 - Download and normalize the CIFAR10 dataset from torchvision
 - Split the CIFAR10 data into train, validation and test set
@@ -28,31 +28,17 @@ from sklearn.metrics import accuracy_score, confusion_matrix, classification_rep
 - Define the string class labels (targets are numeric 0-9)
 """
 
-# mean and std for the RGB channels in CIFAR10
-tmean = [0.49139968, 0.48215841, 0.44653091]
-tstd = [0.24703223, 0.24348513, 0.26158784]
-
-# transform the 32x32x3 images into a tensor after normalizing
-# each channel using the parameters above
-transform = transforms.Compose(
-    [transforms.ToTensor(),
-     transforms.Normalize(tmean, tstd)])
-
-# download and transform the  trainset and testset for training
-trainset = torchvision.datasets.CIFAR10(root='./data',train=True,download=True,transform=transform)
-testset = torchvision.datasets.CIFAR10(root='./data',train=False,download=True,transform=transform)
-
-#split trainset into a train and a val set (90-10 split)
-lengths = [int(p * len(trainset)) for p in [0.9,0.1]]
-tr,v = torch.utils.data.random_split(trainset,lengths)
-train_sampler = torch.utils.data.SubsetRandomSampler(tr.indices)
-val_sampler = torch.utils.data.SubsetRandomSampler(v.indices)
+# mean and std for the RGB channels in CIFAR10 (tmean, tstd) are in cifar10_data.py
+# CIFAR10Cache decodes the trainset and testset once into uint8 memory maps under ./data,
+# with the 90-10 train/val split fixed by a seed (the same split in every notebook);
+# the loaders normalize each batch as they read it
+cifar10 = CIFAR10Cache(root='./data')
 
 # set batch size and set up the data generators for train, val, test sets
 batch_size = 128
-trainloader = torch.utils.data.DataLoader(trainset,batch_size=batch_size,sampler=train_sampler)
-valloader = torch.utils.data.DataLoader(trainset,batch_size=batch_size,sampler=val_sampler)
-testloader = torch.utils.data.DataLoader(testset, batch_size=batch_size)
+trainloader = cifar10.loader('train', batch_size, shuffle=True)
+valloader = cifar10.loader('val', batch_size)
+testloader = cifar10.loader('test', batch_size)
 
 print("Number of training batches = ",len(trainloader))
 print("Number of validation batches = ",len(valloader))
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""Approximate RBF SVMs for gda_svm_cifar10.py that train on all 50000 images
+
+SVC(kernel='rbf') needs the n x n kernel and a solver that is quadratic or worse in n, which
+is why the notebook trains it on 5000 images. ApproximateRBFSVM maps the flattened images
+to an explicit feature space whose inner products approximate the same RBF kernel (random
+Fourier features, or a Nystrom map on landmark images) and trains a linear SVM with the
+hinge loss on the features, so the cost is linear in n and prediction is the feature map
+followed by one matrix multiply with the (n_components x 10) weights.
+
+The linear SVM is liblinear's (LinearSVC with the hinge loss): one-vs-rest dual coordinate
+descent (Hsieh et al., 2008), run until the projected gradient gap is below tol, on the
+feature matrix the batches are mapped into.
+
+    svm = ApproximateRBFSVM('rff', n_components=2000, C=1).fit(cifar10.loader('trainval', 5000))
+    svm.predict(Xtest)
+
+LinearSVMPath fits one-vs-rest linear SVMs (LinearSVC's squared hinge loss) for a whole
+sequence of C values in the primal, by Newton's method, each C starting from the solution
+of the previous one, with the classes split over worker processes that share the data:
+
+    path = LinearSVMPath(C_vals).fit(Xtrain, ytrain)
+    accuracies = path.score_path(Xval, yval)
+    path.predict(Xtest, np.argmax(accuracies))
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+from sklearn.svm import LinearSVC
+
+from batch_utils import flat_rows
+from kernel_features import BLOCK_ROWS, gaussian_kernel
+from svm_sweep import SharedArrays, attach_shared
+
+# SVC's gamma='scale', 1 / (d X.var()), for rows X
+def _scale_gamma(X):
+    return 1.0 / (X.shape[1] * X.var(dtype=np.float64))
+
+class RandomFourierFeatures:
+
+    # z(x) = sqrt(2 / D) cos(W^T x + b), W ~ N(0, 2 gamma I), b ~ U[0, 2 pi), so that
+    # z(x).z(y) ~ exp(-gamma ||x - y||^2) (RBFSampler, computed in float32 a block at a time)
+    def __init__(self, gamma='scale', n_components=2000, random_state=0, dtype=np.float32):
+        self.gamma = gamma
+        self.n_components = n_components
+        self.random_state = random_state
+        self.dtype = dtype
+
+    def fit(self, X):
+        X = flat_rows(X)
+        self.gamma_ = _scale_gamma(X) if self.gamma == 'scale' else self.gamma
+        rng = np.random.default_rng(self.random_state)
+        self.weights_ = (np.sqrt(2 * self.gamma_) *
+                         rng.standard_normal((X.shape[1], self.n_components))).astype(self.dtype)
+        self.offsets_ = rng.uniform(0, 2 * np.pi, self.n_components).astype(self.dtype)
+        return self
+
+    # out can be a preallocated (n x n_components) array (or a slice of one) to write into
+    def transform(self, X, out=None):
+        X = flat_rows(X)
+        if out is None:
+            out = np.empty((len(X), self.n_components), dtype=self.dtype)
+        scale = np.dtype(self.dtype).type(np.sqrt(2 / self.n_components))
+        for i in range(0, len(X), BLOCK_ROWS):
+            block = out[i:i + BLOCK_ROWS]
+            np.matmul(X[i:i + BLOCK_ROWS], self.weights_, out=block)
+            block += self.offsets_
+            np.cos(block, out=block)
+            block *= scale
+        return out
+
+class NystroemFeatures:
+
+    # z(x) = K(x, L) K(L, L)^(-1/2) for n_components landmark rows L drawn from the rows
+    # fit sees (Nystroem), with the kernel computed by kernel_features.gaussian_kernel
+    def __init__(self, gamma='scale', n_components=2000, random_state=0, dtype=np.float32):
+        self.gamma = gamma
+        self.n_components = n_components
+        self.random_state = random_state
+        self.dtype = dtype
+
+    def fit(self, X):
+        X = flat_rows(X)
+        self.gamma_ = _scale_gamma(X) if self.gamma == 'scale' else self.gamma
+        self.s_ = np.sqrt(0.5 / self.gamma_)
+        rng = np.random.default_rng(self.random_state)
+        rows = rng.choice(len(X), min(self.n_components, len(X)), replace=False)
+        self.landmarks_ = X[np.sort(rows)]
+        K = gaussian_kernel(self.landmarks_, self.landmarks_, self.s_)
+        # K^(-1/2) with the eigenvalues clipped away from 0, as sklearn's Nystroem
+        eigenvalues, eigenvectors = np.linalg.eigh(K)
+        eigenvalues = np.maximum(eigenvalues, 1e-12)
+        self.normalization_ = ((eigenvectors / np.sqrt(eigenvalues)) @ eigenvectors.T).astype(self.dtype)
+        return self
+
+    def transform(self, X, out=None):
+        X = flat_rows(X)
+        if out is None:
+            out = np.empty((len(X), len(self.landmarks_)), dtype=self.dtype)
+        for i in range(0, len(X), BLOCK_ROWS):
+            K = gaussian_kernel(X[i:i + BLOCK_ROWS], self.landmarks_, self.s_, dtype=self.dtype)
+            np.matmul(K, self.normalization_, out=out[i:i + BLOCK_ROWS])
+        return out
+
+# batches (X, y) of arrays X and y, batch_size rows at a time, or X itself if it is an iterable of
+# batches (a DataLoader); and the number of rows they have
+def _batches(X, y, batch_size):
+    if y is None:
+        return X, len(X.sampler)
+    return ((X[i:i + batch_size], y[i:i + batch_size]) for i in range(0, len(X), batch_size)), len(X)
+
+class ApproximateRBFSVM:
+
+    # features 'rff' (RandomFourierFeatures) or 'nystroem' (NystroemFeatures) for the RBF
+    # kernel exp(-gamma ||x - y||^2); gamma 'scale' is SVC's default, estimated on the first
+    # batch (which also gives the Nystroem landmarks); C, tol (on the projected gradient gap)
+    # and max_iter (passes) are those of LinearSVC(loss='hinge')
+    def __init__(self, features='rff', n_components=2000, gamma='scale', C=1.0, tol=1e-4, max_iter=1000,
+                 random_state=0, dtype=np.float32):
+        if features not in ('rff', 'nystroem'):
+            raise ValueError("unknown features %r" % (features,))
+        self.features = features
+        self.n_components = n_components
+        self.gamma = gamma
+        self.C = C
+        self.tol = tol
+        self.max_iter = max_iter
+        self.random_state = random_state
+        self.dtype = dtype
+
+    # the feature matrix and the labels of all batches, filled into one preallocated array
+    def _transform_batches(self, batches, n):
+        Z, labels = None, np.empty(n, dtype=np.int64)
+        i = 0
+        for Xb, yb in batches:
+            if Z is None:
+                if not hasattr(self, 'feature_map_'):
+                    feature_map = RandomFourierFeatures if self.features == 'rff' else NystroemFeatures
+                    self.feature_map_ = feature_map(self.gamma, self.n_components, self.random_state,
+                                                    self.dtype).fit(Xb)
+                Z = np.empty((n, self.feature_map_.transform(Xb[:1]).shape[1]), dtype=self.dtype)
+            self.feature_map_.transform(Xb, out=Z[i:i + len(Xb)])
+            labels[i:i + len(Xb)] = np.asarray(yb)
+            i += len(Xb)
+        return Z, labels
+
+    # fit on an iterable of (X, y) batches (a DataLoader) or, with y, arrays X and y that are
+    # mapped batch_size rows at a time
+    def fit(self, X, y=None, batch_size=5000):
+        if hasattr(self, 'feature_map_'):
+            del self.feature_map_
+        Z, labels = self._transform_batches(*_batches(X, y, batch_size))
+        self.svm_ = LinearSVC(C=self.C, loss='hinge', dual=True, tol=self.tol, max_iter=self.max_iter,
+                              random_state=self.random_state).fit(Z, labels)
+        self.classes_ = self.svm_.classes_
+        return self
+
+    def decision_function(self, X, batch_size=5000):
+        X = flat_rows(X)
+        return np.concatenate([self.svm_.decision_function(self.feature_map_.transform(X[i:i + batch_size]))
+                               for i in range(0, len(X), batch_size)])
+
+    def predict(self, X):
+        return self.classes_[self.decision_function(X).argmax(axis=1)]
+
+    def score(self, X, y):
+        return np.mean(self.predict(X) == np.asarray(y))
+
+# X [w; b] for a weight vector with the bias last, with the products in the dtype of X
+def _margins(X, w):
+    return (X @ w[:-1].astype(X.dtype)).astype(np.float64) + w[-1]
+
+# X^T r with the bias row last
+def _transpose_product(X, r):
+    return np.append((r.astype(X.dtype) @ X).astype(np.float64), r.sum())
+
+# the binary squared hinge SVM, ||w||^2 / 2 + C sum_i max(0, 1 - y_i [x_i; 1].w)^2 (y_i = +-1),
+# by Newton's method with conjugate gradient steps (Keerthi and DeCoste's finite Newton method,
+# liblinear's L2-loss primal solver), from w; stops when the gradient norm is below tol times
+# the smaller of g0_norm (the norm at w = 0) and the norm at the starting w, so a warm start
+# is solved at least as accurately as a cold one and always to a relative decrease of tol.
+# Every matrix product is one pass over X, in its dtype; returns w and the number of Newton steps
+def _newton_squared_hinge(X, y, C, w, tol, max_iter, g0_norm, cg_iter=50):
+    margins = y * _margins(X, w)
+    for step in range(max_iter):
+        active = margins < 1
+        grad = w - 2 * C * _transpose_product(X, np.where(active, y * (1 - margins), 0))
+        if step == 0:
+            threshold = tol * min(g0_norm, np.linalg.norm(grad))
+        if np.linalg.norm(grad) <= threshold:
+            return w, step
+        # conjugate gradient on (I + 2 C X_a^T X_a) d = -grad, X_a the rows in the margin,
+        # to a relative residual of 0.1 (an inexact Newton step, as in liblinear's TRON)
+        hessian = lambda v: v + 2 * C * _transpose_product(X, np.where(active, _margins(X, v), 0))
+        d = np.zeros_like(w)
+        r = -grad
+        p = r.copy()
+        rr = r @ r
+        for _ in range(cg_iter):
+            Hp = hessian(p)
+            a = rr / (p @ Hp)
+            d += a * p
+            r -= a * Hp
+            rr, rr_old = r @ r, rr
+            if np.sqrt(rr) <= 0.1 * np.linalg.norm(grad):
+                break
+            p = r + rr / rr_old * p
+        # backtracking (Armijo) line search; the objective along d only needs X d once
+        z = y * _margins(X, d)
+        objective = lambda t: (0.5 * (w + t * d) @ (w + t * d)
+                               + C * np.sum(np.maximum(0, 1 - margins - t * z) ** 2))
+        f0, slope, t = objective(0), grad @ d, 1.0
+        while objective(t) > f0 + 0.01 * t * slope and t > 1e-10:
+            t /= 2
+        w = w + t * d
+        margins = margins + t * z
+    return w, max_iter
+
+# the squared hinge path of the classes (indices into classes, labels the class indices of the
+# samples) over C_vals in order, every C starting from the solution of the previous one;
+# (len(C_vals), len(classes), d + 1) weights with the bias last, and the Newton steps
+def _class_paths(X, labels, classes, C_vals, tol, max_iter):
+    W = np.zeros((len(C_vals), len(classes), X.shape[1] + 1))
+    steps = np.zeros((len(C_vals), len(classes)), dtype=np.int64)
+    for j, k in enumerate(classes):
+        y = np.where(labels == k, 1.0, -1.0)
+        # the gradient norm at w = 0 over C, the cold start scale of the stopping rule
+        g0_unit = 2 * np.linalg.norm(_transpose_product(X, y))
+        w = np.zeros(X.shape[1] + 1)
+        for i, C in enumerate(C_vals):
+            w, steps[i, j] = _newton_squared_hinge(X, y, C, w, tol, max_iter, C * g0_unit)
+            W[i, j] = w
+    return W, steps
+
+# worker process: the paths of some classes on the shared X and labels, sent back through conn
+def _class_paths_worker(specs, classes, C_vals, tol, max_iter, conn):
+    blocks, arrays = attach_shared(specs)
+    result = _class_paths(arrays['X'], arrays['labels'], classes, C_vals, tol, max_iter)
+    del arrays
+    for block in blocks:
+        block.close()
+    conn.send(result)
+    conn.close()
+
+class LinearSVMPath:
+
+    # one-vs-rest squared hinge (L2-loss) linear SVMs, LinearSVC's default loss with the bias
+    # penalized like the weights (intercept_scaling=1), for every C of C_vals in the given
+    # order, each C warm-started from the solution of the one before (an increasing sequence
+    # is the cheap direction); tol is relative to the gradient norm at 0 or at the warm start,
+    # whichever is smaller, max_iter the Newton steps per C; the classes are split over n_jobs
+    # worker processes (default: the number of CPUs, at most one per class) that map X from
+    # shared memory
+    def __init__(self, C_vals, tol=1e-3, max_iter=50, n_jobs=None):
+        self.C_vals = C_vals
+        self.tol = tol
+        self.max_iter = max_iter
+        self.n_jobs = n_jobs
+
+    # X (n x d, any batch of images) and integer labels y
+    def fit(self, X, y):
+        X = flat_rows(X)
+        self.classes_, labels = np.unique(np.asarray(y), return_inverse=True)
+        C_vals = np.asarray(self.C_vals, dtype=np.float64)
+        k = len(self.classes_)
+        n_jobs = min(self.n_jobs or os.cpu_count() or 1, k)
+        groups = [np.arange(j, k, n_jobs) for j in range(n_jobs)]
+        W = np.zeros((len(C_vals), k, X.shape[1] + 1))
+        self.n_iter_ = np.zeros((len(C_vals), k), dtype=np.int64)
+        if n_jobs == 1:
+            W[:], self.n_iter_[:] = _class_paths(X, labels, groups[0], C_vals, self.tol, self.max_iter)
+        else:
+            context = multiprocessing.get_context()
+            with SharedArrays(X=X, labels=labels) as shared:
+                workers = []
+                for classes in groups:
+                    receiver, sender = context.Pipe(duplex=False)
+                    process = context.Process(target=_class_paths_worker, daemon=True,
+                                              args=(shared.specs, classes, C_vals, self.tol, self.max_iter, sender))
+                    process.start()
+                    sender.close()
+                    workers.append((classes, receiver, process))
+                try:
+                    for classes, receiver, process in workers:
+                        try:
+                            W[:, classes], self.n_iter_[:, classes] = receiver.recv()
+                        except EOFError:
+                            raise RuntimeError("the worker for classes %s failed (exit code %s)"
+                                               % (list(classes), process.exitcode))
+                        process.join()
+                finally:
+                    for classes, receiver, process in workers:
+                        if process.is_alive():
+                            process.terminate()
+                            process.join()
+                        receiver.close()
+        self.coef_path_ = W[:, :, :-1].astype(X.dtype)
+        self.intercept_path_ = W[:, :, -1]
+        return self
+
+    # the decision function of the model of C_vals[i]
+    def decision_function(self, X, i):
+        return flat_rows(X) @ self.coef_path_[i].T + self.intercept_path_[i]
+
+    def predict(self, X, i):
+        return self.classes_[self.decision_function(X, i).argmax(axis=1)]
+
+    # the accuracy of every C on (X, y), with one matrix product for the whole path
+    def score_path(self, X, y):
+        scores = np.einsum('nd,ckd->cnk', flat_rows(X), self.coef_path_) + self.intercept_path_[:, np.newaxis]
+        return np.mean(self.classes_[scores.argmax(axis=2)] == np.asarray(y), axis=1)
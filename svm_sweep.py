@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Regularization sweeps of kernel SVMs for gda_svm_cifar10.py with the kernel computed once
+
+SVC(kernel='rbf' or 'linear', C=C) recomputes the kernel between the training images for
+every fit and the cross-kernel to the validation images for every predict. PrecomputedKernel
+computes the train Gram matrix and the cross-kernels once, in blocked float32 matrix
+products (kernel_features.py), and svc_c_sweep fits SVC(kernel='precomputed') on them for
+every C, so the sweep costs about as much as the solver alone. The kernels and gamma='scale'
+are the ones SVC would use, so the models are the same up to float32 rounding.
+
+    kernel = PrecomputedKernel(sXtrain, 'rbf')
+    accuracies, models = svc_c_sweep(kernel, sytrain, Xval, yval, C_vals)
+    models[np.argmax(accuracies)].predict(kernel(Xtest))
+
+parallel_c_sweep runs the same sweep with every C in its own worker process: the kernels and
+labels are copied into shared memory once and mapped by the workers, so nothing big is
+pickled, and C values that are falling behind can be dropped while the sweep runs:
+
+    accuracies, fit_times, models = parallel_c_sweep(kernel, sytrain, Xval, yval, C_vals, tolerance=0.02)
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from sklearn.metrics import accuracy_score
+from sklearn.svm import SVC
+
+from batch_utils import flat_rows
+from kernel_features import gaussian_kernel, linear_kernel
+
+class PrecomputedKernel:
+
+    # kernel 'rbf' (exp(-gamma ||a - b||^2)) or 'linear'; gamma 'scale' is SVC's default,
+    # 1 / (d * X.var()) of the training rows
+    def __init__(self, Xtrain, kernel='rbf', gamma='scale', dtype=np.float32):
+        if kernel not in ('rbf', 'linear'):
+            raise ValueError("unknown kernel %r" % (kernel,))
+        self.Xtrain = flat_rows(Xtrain)
+        self.kernel = kernel
+        self.dtype = dtype
+        if gamma == 'scale':
+            gamma = 1.0 / (self.Xtrain.shape[1] * self.Xtrain.var(dtype=np.float64))
+        self.gamma = gamma
+        # libsvm works in float64; convert the train Gram matrix once instead of in every fit
+        self.train = self(self.Xtrain).astype(np.float64)
+
+    # the (n x n_train) kernel between the rows of X and the training rows
+    def __call__(self, X):
+        if self.kernel == 'linear':
+            return linear_kernel(flat_rows(X), self.Xtrain, dtype=self.dtype)
+        # exp(-gamma d^2) = exp(-d^2 / (2 s^2))
+        return gaussian_kernel(flat_rows(X), self.Xtrain, np.sqrt(0.5 / self.gamma), dtype=self.dtype)
+
+# fit SVC(kernel='precomputed', C=C) on the precomputed train kernel for every C and score it
+# on (Xval, yval), whose cross-kernel is computed once; returns the validation accuracies
+# and the fitted models
+def svc_c_sweep(kernel, ytrain, Xval, yval, C_vals, **svc_args):
+    Kval = kernel(Xval)
+    accuracies, models = [], []
+    for C in C_vals:
+        model = SVC(kernel='precomputed', C=C, **svc_args).fit(kernel.train, np.asarray(ytrain))
+        accuracies.append(accuracy_score(np.asarray(yval), model.predict(Kval)))
+        models.append(model)
+    return np.array(accuracies), models
+
+# arrays copied once into shared memory blocks, which worker processes map by name instead
+# of receiving pickled copies; the blocks are freed on close (or leaving a with block)
+class SharedArrays:
+
+    def __init__(self, **arrays):
+        self.blocks = []
+        self.specs = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# the arrays of SharedArrays.specs in this process, and the blocks to keep open while they are used
+def attach_shared(specs):
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+# worker process: fit SVC(kernel='precomputed', C=C) on the shared kernels and send
+# (validation accuracy, fit time, model) back through conn
+def _fit_c(specs, C, svc_args, conn):
+    blocks, arrays = attach_shared(specs)
+    start = time.perf_counter()
+    model = SVC(kernel='precomputed', C=C, **svc_args).fit(arrays['train'], arrays['ytrain'])
+    fit_time = time.perf_counter() - start
+    accuracy = accuracy_score(arrays['yval'], model.predict(arrays['val']))
+    del arrays
+    for block in blocks:
+        block.close()
+    conn.send((accuracy, fit_time, model))
+    conn.close()
+
+# svc_c_sweep with every C fitted in its own process, at most n_jobs (default: the number of
+# CPUs) at a time, on the train kernel, the validation cross-kernel and the labels put in
+# shared memory once. The C values are started in increasing order; with tolerance, when a C
+# scores more than tolerance below the best smaller C, the larger C values (which take the
+# longest to fit) are dropped, and the running ones terminated. Returns the validation
+# accuracies, the fit times (in seconds) and the models, NaN, NaN and None for a dropped C
+def parallel_c_sweep(kernel, ytrain, Xval, yval, C_vals, n_jobs=None, tolerance=None, **svc_args):
+    n_jobs = n_jobs or os.cpu_count() or 1
+    C_vals = np.asarray(C_vals, dtype=np.float64)
+    accuracies = np.full(len(C_vals), np.nan)
+    fit_times = np.full(len(C_vals), np.nan)
+    models = [None] * len(C_vals)
+    pending = list(np.argsort(C_vals))
+    running = {}
+    context = multiprocessing.get_context()
+    with SharedArrays(train=kernel.train, val=kernel(Xval).astype(np.float64),
+                      ytrain=np.asarray(ytrain), yval=np.asarray(yval)) as shared:
+        try:
+            while pending or running:
+                while pending and len(running) < n_jobs:
+                    i = pending.pop(0)
+                    receiver, sender = context.Pipe(duplex=False)
+                    process = context.Process(target=_fit_c, args=(shared.specs, float(C_vals[i]), svc_args, sender),
+                                              daemon=True)
+                    process.start()
+                    sender.close()
+                    running[receiver] = (i, process)
+                for receiver in multiprocessing.connection.wait(list(running)):
+                    if receiver not in running:
+                        # terminated by an earlier result of this round
+                        continue
+                    i, process = running.pop(receiver)
+                    try:
+                        accuracies[i], fit_times[i], models[i] = receiver.recv()
+                    except EOFError:
+                        raise RuntimeError("the fit for C=%g failed (exit code %s)" % (C_vals[i], process.exitcode))
+                    finally:
+                        receiver.close()
+                        process.join()
+                    smaller = accuracies[(C_vals < C_vals[i]) & ~np.isnan(accuracies)]
+                    if tolerance is not None and len(smaller) and accuracies[i] < smaller.max() - tolerance:
+                        pending = [j for j in pending if C_vals[j] <= C_vals[i]]
+                        for other in [r for r, (j, _) in running.items() if C_vals[j] > C_vals[i]]:
+                            _, process = running.pop(other)
+                            process.terminate()
+                            process.join()
+                            other.close()
+        finally:
+            for receiver, (_, process) in running.items():
+                process.terminate()
+                process.join()
+                receiver.close()
+    return accuracies, fit_times, models